@@ -0,0 +1 @@
+# Этот файл делает папку benchmarks Python пакетом
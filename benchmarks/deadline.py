@@ -0,0 +1,65 @@
+"""
+Проверка срока запроса (modules.deadline) на синтетической LM (LM_BACKEND=synthetic, без сети
+и API ключа): process_text под коротким сроком должен упрощать стадию банальности, но не
+принимать связки, оценка которых упрощена или не завершена.
+
+    python -m benchmarks.deadline --deadline 7 --triplets 12 --banal-threshold 0.3
+
+Печатает, сколько связок принято, отсеяно и оценено частично (с упрощенными стадиями). Код
+выхода 1, если принята связка с упрощенной или неполной оценкой или если срок ни разу не
+привел к упрощению стадии (тогда проверка ничего не показала - уменьшите --deadline).
+"""
+
+import argparse
+import os
+import sys
+
+# Синтетическая LM должна быть выбрана до импорта config
+os.environ.setdefault('LM_BACKEND', 'synthetic')
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dspy
+
+from modules.deadline import start_deadline
+from modules.extract import TransformationExtractor
+from modules.lm import SyntheticLM
+from modules.process import assess_text, filter_assessments
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that degraded assessments are never accepted under a deadline.")
+    parser.add_argument("--deadline", type=float, default=7.0, help="Request deadline in seconds.")
+    parser.add_argument("--triplets", type=int, default=12, help="Triplets returned by the synthetic extractor.")
+    parser.add_argument("--banal-threshold", type=float, default=0.3)
+    parser.add_argument("--reproducibility-threshold", type=float, default=0.0)
+    args = parser.parse_args()
+
+    def lm(model):
+        return SyntheticLM(model, triplets=args.triplets, cache=False)
+
+    dspy.configure(lm=lm('synthetic/main'), banal_lm=lm('synthetic/banal'))
+    text = "Синтетический текст для проверки срока запроса. " * 20
+    with dspy.context(deadline=start_deadline(args.deadline)):
+        report = assess_text(TransformationExtractor(), text, banal_threshold=args.banal_threshold)
+    accepted, _ = filter_assessments(report['assessments'], args.banal_threshold, args.reproducibility_threshold)
+
+    accepted_ids = {id(triplet) for triplet in accepted}
+    partial = [a for a in report['assessments'] if a.get('partial')]
+    degraded = [a for a in partial if a['partial']['degraded_stages']]
+    wrongly_accepted = [a for a in partial if id(a['enriched_triplet']) in accepted_ids]
+
+    print(f"Связок: {len(report['assessments'])}, принято: {len(accepted)}, "
+          f"оценено частично: {len(partial)} (с упрощенной банальностью: {len(degraded)})")
+    for assessment in wrongly_accepted:
+        print(f"  Принята при неполной оценке: {assessment['triplet'].get('transformation')} - {assessment['partial']}")
+    if wrongly_accepted:
+        return 1
+    if not degraded:
+        print("Срок не привел к упрощению стадий - проверка ничего не показала")
+        return 1
+    print("Связки с упрощенной или неполной оценкой не приняты")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
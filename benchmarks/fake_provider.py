@@ -0,0 +1,180 @@
+"""
+Локальный OpenAI-совместимый провайдер (POST /chat/completions) с синтетическими ответами и
+искусственным ограничением: для проверки лимитера запросов к LLM без OpenRouter.
+
+    python -m benchmarks.fake_provider --port 8099 --max-concurrency 4 --rps 10 --error-rate 0.05
+
+Ответ 429 (с заголовком Retry-After, если задан --retry-after) - при превышении
+--max-concurrency одновременных запросов или --rps запросов в секунду на модель; 503 - с
+вероятностью --error-rate. Сервер направляется на него через LM_API_BASE:
+
+    LM_API_BASE=http://127.0.0.1:8099 OPENROUTER_API_KEY=fake python main.py --validate
+
+GET /stats - счетчики ответов по кодам и максимум одновременных запросов.
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from modules.synthetic_lm import estimate_tokens, synthetic_response
+
+
+class ProviderState:
+    """Ограничения и счетчики провайдера; общие для потоков сервера."""
+
+    def __init__(self, max_concurrency=0, rps=0.0, error_rate=0.0, retry_after=None,
+                 latency=0.0, jitter=0.0, triplets=5, seed=0):
+        self.max_concurrency = max_concurrency
+        self.rps = rps
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.latency = latency
+        self.jitter = jitter
+        self.triplets = triplets
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._windows = {}
+        self.stats = {'200': 0, '429': 0, '503': 0, 'max_in_flight': 0}
+
+    def admit(self, model):
+        """Код ответа для нового запроса: 200, 429 или 503."""
+        with self._lock:
+            if self.max_concurrency and self._in_flight >= self.max_concurrency:
+                return self._count(429)
+            if self.rps:
+                # Окно в одну секунду на модель
+                second = int(time.monotonic())
+                window_second, count = self._windows.get(model, (second, 0))
+                if window_second != second:
+                    window_second, count = second, 0
+                if count >= self.rps:
+                    return self._count(429)
+                self._windows[model] = (window_second, count + 1)
+            if self._rng.random() < self.error_rate:
+                return self._count(503)
+            self._in_flight += 1
+            self.stats['max_in_flight'] = max(self.stats['max_in_flight'], self._in_flight)
+            return self._count(200)
+
+    def finish(self):
+        with self._lock:
+            self._in_flight -= 1
+
+    def delay(self):
+        with self._lock:
+            return max(0.0, self.latency + self._rng.uniform(-self.jitter, self.jitter))
+
+    def _count(self, status):
+        self.stats[str(status)] += 1
+        return status
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats, in_flight=self._in_flight)
+
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status, body, headers=None):
+            data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path.rstrip('/').endswith('/stats'):
+                self._send_json(200, state.snapshot())
+            else:
+                self._send_json(404, {'error': {'message': 'not found'}})
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+            if not self.path.rstrip('/').endswith('/chat/completions'):
+                self._send_json(404, {'error': {'message': 'not found'}})
+                return
+
+            model = body.get('model', '')
+            status = state.admit(model)
+            if status == 429:
+                headers = {'Retry-After': str(state.retry_after)} if state.retry_after is not None else None
+                self._send_json(429, {'error': {'message': 'Rate limit exceeded', 'code': 429}}, headers)
+                return
+            if status == 503:
+                self._send_json(503, {'error': {'message': 'Provider unavailable', 'code': 503}})
+                return
+
+            try:
+                time.sleep(state.delay())
+                messages = body.get('messages', [])
+                text = synthetic_response(messages, state.triplets)
+                prompt_tokens = estimate_tokens(''.join(str(m.get('content')) for m in messages))
+                completion_tokens = estimate_tokens(text)
+            finally:
+                state.finish()
+            self._send_json(200, {
+                'id': f'fake-{time.time_ns()}',
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': text}, 'finish_reason': 'stop'}],
+                'usage': {
+                    'prompt_tokens': prompt_tokens,
+                    'completion_tokens': completion_tokens,
+                    'total_tokens': prompt_tokens + completion_tokens,
+                },
+            })
+
+    return Handler
+
+
+def start_server(state, host='127.0.0.1', port=0):
+    """Запускает провайдера в фоновом потоке; возвращает (сервер, базовый URL)."""
+    server = ThreadingHTTPServer((host, port), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://{host}:{server.server_address[1]}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake OpenAI-compatible provider with injected throttling.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--max-concurrency", type=int, default=0, help="429 above this many requests in flight.")
+    parser.add_argument("--rps", type=float, default=0.0, help="429 above this many requests per second per model.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with 503.")
+    parser.add_argument("--retry-after", type=float, help="Retry-After seconds sent with 429.")
+    parser.add_argument("--latency-ms", type=float, default=200.0)
+    parser.add_argument("--jitter-ms", type=float, default=50.0)
+    parser.add_argument("--triplets", type=int, default=5)
+    args = parser.parse_args()
+
+    state = ProviderState(
+        max_concurrency=args.max_concurrency, rps=args.rps, error_rate=args.error_rate,
+        retry_after=args.retry_after, latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000,
+        triplets=args.triplets,
+    )
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(state))
+    server.daemon_threads = True
+    print(f"Фейковый провайдер: http://{args.host}:{args.port} (статистика - GET /stats)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
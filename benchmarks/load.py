@@ -0,0 +1,362 @@
+"""
+Нагрузочный прогон HTTP сервера: POST /process, /process/batch или /process/stream.
+
+    # Сервер поднимается самим прогоном (gunicorn, LM_BACKEND=synthetic, задержка LLM 800 ± 200 мс)
+    python -m benchmarks.load --spawn --workers 2 --latency-ms 800 --jitter-ms 200
+
+    # Уже запущенный сервер, открытая нагрузка 0.5, 1 и 2 запроса в секунду
+    python -m benchmarks.load --url http://localhost:5000 --rate 0.5,1,2
+
+Нагрузка подается ступенями: по умолчанию - фиксированное число одновременных клиентов
+(--concurrency 1,2,4,...), с --rate - поток запросов с пуассоновскими интервалами (время
+ответа считается от запланированного момента запроса, поэтому очередь на клиенте тоже видна).
+Тексты берутся из validation_testset.json в случайном порядке, то есть с тем же распределением
+длины, что и в тестовом наборе.
+
+Для каждой ступени - пропускная способность, p50/p95/p99 времени ответа, доли ошибок и
+таймаутов; для /process/stream - еще время до первого события. Точка перегиба - первая
+ступень, на которой p95 вырос больше чем в --knee-factor раз относительно первой ступени
+или появились ошибки: нагрузка перед ней - предел, под который подбираются число воркеров
+и deploy.resources.
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+VALIDATION_TESTSET_PATH = os.path.join(PROJECT_ROOT, 'validation_testset.json')
+DEFAULT_OUTPUT = 'tmp/load.json'
+
+ENDPOINTS = {
+    'process': '/process',
+    'batch': '/process/batch',
+    'stream': '/process/stream',
+}
+
+
+def load_texts(path, fallback_count=20):
+    """Тексты тестового набора; без файла - синтетические тексты разной длины."""
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8-sig') as f:
+            texts = json.load(f).get('validation_testset', [])
+        if texts:
+            return texts
+    print(f"⚠️  {path} не найден - используются синтетические тексты")
+    rng = random.Random(0)
+    sentence = 'Участник {} применяет подход {} к задаче {}, и результат меняется.'
+    return [
+        ' '.join(sentence.format(i, i % 7, i % 11) for i in range(rng.choice((8, 30, 90))))
+        for _ in range(fallback_count)
+    ]
+
+
+def percentile(values, p):
+    """Перцентиль p (0..100) по ближайшему рангу."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(p / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+class LoadClient:
+    """Отправляет запросы к эндпоинту; у каждого потока свое HTTP-соединение."""
+
+    def __init__(self, url, endpoint, texts, timeout, batch_size=4, use_cache=False, seed=0):
+        self.url = url.rstrip('/') + ENDPOINTS[endpoint]
+        self.endpoint = endpoint
+        self.texts = texts
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self.use_cache = use_cache
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self._local = threading.local()
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def _payload(self):
+        with self._rng_lock:
+            texts = [self._rng.choice(self.texts) for _ in range(self.batch_size if self.endpoint == 'batch' else 1)]
+        if self.endpoint == 'batch':
+            return {'items': [{'text': text} for text in texts], 'use_cache': self.use_cache}, sum(map(len, texts))
+        return {'text': texts[0], 'use_cache': self.use_cache}, len(texts[0])
+
+    def _check(self, response):
+        """Ошибка в ответе (None - успех)."""
+        if response.status_code != 200:
+            return f'HTTP {response.status_code}'
+        body = response.json()
+        if self.endpoint == 'batch':
+            failed = sum(1 for item in body.get('results', []) if not item.get('success'))
+            return f'{failed} элементов с ошибкой' if failed else None
+        return None if body.get('success') else body.get('message', 'success: false')
+
+    def _stream(self, session, payload, started):
+        """Читает поток событий; возвращает (ошибка, время до первого события)."""
+        first_event = None
+        last_event = None
+        with session.post(self.url, json=payload, stream=True, timeout=self.timeout) as response:
+            if response.status_code != 200:
+                return f'HTTP {response.status_code}', None
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                if first_event is None:
+                    first_event = time.perf_counter() - started
+                last_event = json.loads(line).get('event')
+                if time.perf_counter() - started > self.timeout:
+                    raise requests.Timeout('поток дольше таймаута')
+        if last_event != 'summary':
+            return f'поток завершился событием {last_event}', first_event
+        return None, first_event
+
+    def send(self, scheduled=None):
+        """
+        Один запрос. scheduled - запланированный момент отправки (perf_counter): время ответа
+        считается от него. Возвращает словарь с результатом.
+        """
+        payload, chars = self._payload()
+        started = scheduled if scheduled is not None else time.perf_counter()
+        result = {'chars': chars, 'error': None, 'timeout': False, 'first_event': None}
+        session = self._session()
+        try:
+            if self.endpoint == 'stream':
+                result['error'], result['first_event'] = self._stream(session, payload, started)
+            else:
+                result['error'] = self._check(session.post(self.url, json=payload, timeout=self.timeout))
+        except requests.Timeout:
+            result['timeout'] = True
+        except (requests.RequestException, ValueError) as e:
+            result['error'] = f'{type(e).__name__}: {e}'
+        result['seconds'] = time.perf_counter() - started
+        return result
+
+
+def run_closed(client, concurrency, duration):
+    """concurrency клиентов отправляют запросы друг за другом в течение duration секунд."""
+    results = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker():
+        while time.perf_counter() < deadline:
+            result = client.send()
+            with lock:
+                results.append(result)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - started
+
+
+def run_open(client, rate, duration, max_in_flight, seed=0):
+    """Запросы с пуассоновскими интервалами (rate в секунду) в течение duration секунд."""
+    rng = random.Random(seed)
+    futures = []
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        scheduled = started
+        while True:
+            scheduled += rng.expovariate(rate)
+            if scheduled - started > duration:
+                break
+            time.sleep(max(0.0, scheduled - time.perf_counter()))
+            futures.append(executor.submit(client.send, scheduled))
+        results = [future.result() for future in futures]
+    return results, time.perf_counter() - started
+
+
+def summarize(level, results, elapsed):
+    """Показатели одной ступени нагрузки."""
+    ok = [r for r in results if r['error'] is None and not r['timeout']]
+    latencies = [r['seconds'] for r in ok]
+    first_events = [r['first_event'] for r in ok if r['first_event'] is not None]
+    errors = [r['error'] for r in results if r['error'] is not None]
+    total = len(results) or 1
+
+    def rounded(value):
+        return round(value, 3) if value is not None else None
+
+    summary = {
+        'level': level,
+        'requests': len(results),
+        'succeeded': len(ok),
+        'throughput_rps': round(len(ok) / elapsed, 3) if elapsed else 0.0,
+        'p50_seconds': rounded(percentile(latencies, 50)),
+        'p95_seconds': rounded(percentile(latencies, 95)),
+        'p99_seconds': rounded(percentile(latencies, 99)),
+        'mean_seconds': rounded(statistics.fmean(latencies)) if latencies else None,
+        'max_seconds': rounded(max(latencies)) if latencies else None,
+        'error_rate': round(len(errors) / total, 4),
+        'timeout_rate': round(sum(r['timeout'] for r in results) / total, 4),
+        'mean_text_chars': round(statistics.fmean(r['chars'] for r in results)) if results else 0,
+    }
+    if first_events:
+        summary['first_event_p50_seconds'] = rounded(percentile(first_events, 50))
+        summary['first_event_p95_seconds'] = rounded(percentile(first_events, 95))
+    if errors:
+        summary['error_examples'] = sorted(set(errors))[:5]
+    return summary
+
+
+def find_knee(levels, factor, max_error_rate=0.01):
+    """
+    Первая ступень, на которой p95 вырос больше чем в factor раз относительно первой ступени
+    или доля ошибок и таймаутов превысила max_error_rate. Возвращает (предел, ступень перегиба).
+    """
+    base = next((level['p95_seconds'] for level in levels if level['p95_seconds']), None)
+    healthy = None
+    for level in levels:
+        failures = level['error_rate'] + level['timeout_rate']
+        p95 = level['p95_seconds']
+        if failures > max_error_rate or p95 is None or (base and p95 > factor * base):
+            return healthy, level['level']
+        healthy = level['level']
+    return healthy, None
+
+
+def spawn_server(args, port):
+    """Запускает сервер на синтетической LM и ждет /health."""
+    env = dict(
+        os.environ,
+        LM_BACKEND='synthetic',
+        LM_REPLAY_LATENCY_MS=str(args.latency_ms),
+        LM_REPLAY_JITTER_MS=str(args.jitter_ms),
+        LM_SYNTHETIC_TRIPLETS=str(args.triplets),
+    )
+    if args.asgi:
+        command = [sys.executable, '-m', 'uvicorn', 'server.asgi:app', '--host', '127.0.0.1',
+                   '--port', str(port), '--workers', str(args.workers)]
+    else:
+        command = [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}', '--workers', str(args.workers),
+                   '--threads', str(args.threads), '--timeout', '120', 'server.app:app']
+    print(f"🚀 {' '.join(command)}")
+    process = subprocess.Popen(command, cwd=PROJECT_ROOT, env=env)
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Сервер завершился с кодом {process.returncode}")
+        try:
+            if requests.get(f'{url}/health', timeout=2).status_code == 200:
+                return process, url
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError("Сервер не ответил на /health за 60 секунд")
+
+
+def _levels(value, cast):
+    return [cast(item) for item in value.split(',') if item.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP load test for the text processing server.")
+    parser.add_argument("--url", default="http://localhost:5000", help="Server URL (ignored with --spawn).")
+    parser.add_argument("--endpoint", choices=sorted(ENDPOINTS), default="process", help="Endpoint to load.")
+    parser.add_argument("--concurrency", default="1,2,4,8,16", help="Closed-loop steps: concurrent clients.")
+    parser.add_argument("--rate", help="Open-loop steps instead: arrival rates, requests per second.")
+    parser.add_argument("--max-in-flight", type=int, default=64, help="Open-loop cap on requests in flight.")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds per step.")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Request timeout, seconds.")
+    parser.add_argument("--batch-size", type=int, default=4, help="Texts per /process/batch request.")
+    parser.add_argument("--use-cache", action="store_true", help="Allow result and LM caches (off by default).")
+    parser.add_argument("--texts", default=VALIDATION_TESTSET_PATH, help="Texts JSON (validation_testset format).")
+    parser.add_argument("--knee-factor", type=float, default=2.0, help="p95 growth that marks the knee.")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="Where to save the results JSON.")
+    parser.add_argument("--spawn", action="store_true", help="Start a local server on the synthetic LM.")
+    parser.add_argument("--asgi", action="store_true", help="With --spawn: uvicorn + server/asgi.py.")
+    parser.add_argument("--port", type=int, default=5055, help="With --spawn: port to bind.")
+    parser.add_argument("--workers", type=int, default=2, help="With --spawn: server worker processes.")
+    parser.add_argument("--threads", type=int, default=1, help="With --spawn: gunicorn threads per worker.")
+    parser.add_argument("--latency-ms", type=float, default=800.0, help="With --spawn: synthetic LM latency.")
+    parser.add_argument("--jitter-ms", type=float, default=200.0, help="With --spawn: synthetic LM jitter.")
+    parser.add_argument("--triplets", type=int, default=5, help="With --spawn: triplets per extraction.")
+    args = parser.parse_args()
+
+    texts = load_texts(args.texts)
+    server = None
+    url = args.url
+    if args.spawn:
+        server, url = spawn_server(args, args.port)
+
+    open_loop = args.rate is not None
+    steps = _levels(args.rate, float) if open_loop else _levels(args.concurrency, int)
+    client = LoadClient(url, args.endpoint, texts, args.timeout, args.batch_size, args.use_cache)
+    levels = []
+    try:
+        for step in steps:
+            if open_loop:
+                results, elapsed = run_open(client, step, args.duration, args.max_in_flight)
+            else:
+                results, elapsed = run_closed(client, step, args.duration)
+            summary = summarize(step, results, elapsed)
+            levels.append(summary)
+            print(f"{'rate' if open_loop else 'concurrency'}={step}: {summary['throughput_rps']} rps, "
+                  f"p50 {summary['p50_seconds']} с, p95 {summary['p95_seconds']} с, p99 {summary['p99_seconds']} с, "
+                  f"ошибок {summary['error_rate']:.1%}, таймаутов {summary['timeout_rate']:.1%}")
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+
+    healthy, knee = find_knee(levels, args.knee_factor)
+    report = {
+        'settings': {
+            'url': url,
+            'endpoint': args.endpoint,
+            'mode': 'open' if open_loop else 'closed',
+            'duration': args.duration,
+            'timeout': args.timeout,
+            'texts': len(texts),
+            'spawn': {
+                'asgi': args.asgi,
+                'workers': args.workers,
+                'threads': args.threads,
+                'latency_ms': args.latency_ms,
+                'jitter_ms': args.jitter_ms,
+                'triplets': args.triplets,
+            } if args.spawn else None,
+        },
+        'levels': levels,
+        'max_healthy_level': healthy,
+        'knee_level': knee,
+    }
+
+    directory = os.path.dirname(args.output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    unit = 'rps' if open_loop else 'одновременных запросов'
+    if knee is None:
+        print(f"\nПерегиба не найдено: время ответа стабильно до {healthy} {unit}")
+    else:
+        print(f"\nПерегиб на {knee} {unit}: предел - {healthy} {unit}")
+    print(f"Результаты сохранены в {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
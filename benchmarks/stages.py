@@ -0,0 +1,268 @@
+"""
+Бенчмарки стадий пайплайна на синтетической LM (LM_BACKEND=synthetic, без сети и API ключа).
+
+    python -m benchmarks.stages                       # полная сетка, результаты в tmp/benchmarks.json
+    python -m benchmarks.stages --quick               # укороченная сетка
+    python -m benchmarks.stages --save-baseline       # записать результаты как базовые
+    python -m benchmarks.stages --baseline benchmarks/baseline.json --threshold 0.2
+
+Наборы: BanalAssessor, banal_metric, process_text и путь запроса Flask-сервера (POST /process).
+Сетка - число связок, длина текста и число одновременных запросов. Для каждого случая
+измеряются время (медиана повторов), число вызовов LLM, вызовы на связку и токены на запрос.
+
+При сравнении с базовыми результатами регрессия - рост показателя больше чем на threshold
+(число вызовов и токены детерминированы, поэтому лишний запрос к LLM виден сразу);
+при регрессии код выхода 1.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+# Синтетическая LM должна быть выбрана до импорта config
+os.environ.setdefault('LM_BACKEND', 'synthetic')
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dspy
+from dspy.utils.usage_tracker import UsageTracker
+
+import config
+from metrics.assess_banal import BanalAssessor, banal_metric
+from modules.extract import TransformationExtractor
+from modules.lm import SyntheticLM
+from modules.parallel import parallel_map
+from modules.process import process_text
+
+DEFAULT_OUTPUT = 'tmp/benchmarks.json'
+DEFAULT_BASELINE = 'benchmarks/baseline.json'
+
+# Показатели, которые сравниваются с базовыми (рост - регрессия)
+COMPARED_METRICS = ('wall_seconds', 'llm_calls', 'llm_calls_per_triplet', 'tokens_per_request')
+
+FULL_GRID = {
+    'triplets': [1, 5, 10],
+    'text_chars': [1000, 8000, 24000],
+    'concurrency': [1, 4],
+}
+QUICK_GRID = {
+    'triplets': [1, 5],
+    'text_chars': [1000],
+    'concurrency': [1, 4],
+}
+
+
+def configure_lms(triplets, latency, jitter):
+    """Синтетические основная и banal LM с задержкой latency ± jitter секунд."""
+    def lm(model):
+        return SyntheticLM(model, triplets=triplets, latency=latency, jitter=jitter, cache=False)
+
+    dspy.configure(lm=lm(config.MAIN_MODEL), banal_lm=lm(config.BANAL_MODEL))
+
+
+def synthetic_text(chars):
+    sentences = []
+    while sum(len(s) + 1 for s in sentences) < chars:
+        i = len(sentences)
+        sentences.append(f'Участник {i} применяет подход {i % 7} к задаче {i % 11}, и результат меняется.')
+    return ' '.join(sentences)
+
+
+def _usage(tracker):
+    calls = sum(len(entries) for entries in tracker.usage_data.values())
+    totals = tracker.get_total_tokens().values()
+    tokens = sum(t.get('prompt_tokens', 0) + t.get('completion_tokens', 0) for t in totals)
+    return calls, tokens
+
+
+def measure(run, repeats):
+    """
+    Выполняет run() repeats раз. run возвращает (число связок, число запросов).
+    Время - медиана повторов, вызовы LLM и токены - последнего повтора.
+    """
+    times = []
+    for _ in range(repeats):
+        tracker = UsageTracker()
+        with dspy.context(usage_tracker=tracker):
+            started = time.perf_counter()
+            triplets, requests = run()
+            times.append(time.perf_counter() - started)
+    calls, tokens = _usage(tracker)
+    return {
+        'wall_seconds': round(statistics.median(times), 4),
+        'triplets': triplets,
+        'llm_calls': calls,
+        'llm_calls_per_triplet': round(calls / triplets, 3) if triplets else None,
+        'tokens_per_request': round(tokens / requests, 1),
+    }
+
+
+def _sample_triplets(count):
+    """Связки, извлеченные синтетической LM (различные, не банальные для локального фильтра)."""
+    return TransformationExtractor()(initial_text=synthetic_text(1000)).transformations[:count]
+
+
+def bench_banal_assessor(grid, repeats, latency, jitter):
+    results = {}
+    configure_lms(1, latency, jitter)
+    triplet = _sample_triplets(1)[0]
+    for batch_compare in (True, False):
+        assessor = BanalAssessor(n=3, batch_compare=batch_compare)
+
+        def run():
+            with dspy.context(lm=dspy.settings.banal_lm):
+                assessor(**triplet)
+            return 1, 1
+
+        results[f'banal_assessor[batch_compare={batch_compare}]'] = measure(run, repeats)
+    return results
+
+
+def bench_banal_metric(grid, repeats, latency, jitter):
+    results = {}
+    for triplets in grid['triplets']:
+        configure_lms(triplets, latency, jitter)
+        pred = dspy.Prediction(transformations=_sample_triplets(triplets))
+
+        def run():
+            banal_metric(pred)
+            return len(pred.transformations), 1
+
+        results[f'banal_metric[triplets={triplets}]'] = measure(run, repeats)
+    return results
+
+
+def bench_process_text(grid, repeats, latency, jitter):
+    results = {}
+    cases = [(t, grid['text_chars'][0], c) for t in grid['triplets'] for c in grid['concurrency']]
+    cases += [(grid['triplets'][-1], chars, grid['concurrency'][-1]) for chars in grid['text_chars'][1:]]
+    extractor = TransformationExtractor()
+    for triplets, chars, concurrency in cases:
+        configure_lms(triplets, latency, jitter)
+        text = synthetic_text(chars)
+
+        def run():
+            _, unfiltered, _ = process_text(extractor, text, max_concurrency=concurrency)
+            return len(unfiltered), 1
+
+        key = f'process_text[triplets={triplets},text_chars={chars},concurrency={concurrency}]'
+        results[key] = measure(run, repeats)
+    return results
+
+
+def bench_server(grid, repeats, latency, jitter):
+    """POST /process через тестовый клиент Flask: requests одновременных запросов без кэшей."""
+    import server.app as server_app
+
+    server_app.extractor = TransformationExtractor()
+    client = server_app.app.test_client()
+    results = {}
+    triplets = grid['triplets'][-1]
+    configure_lms(triplets, latency, jitter)
+    for requests in grid['concurrency']:
+        def post(i):
+            response = client.post('/process', json={'text': synthetic_text(grid['text_chars'][0]) + f' {i}',
+                                                     'use_cache': False})
+            return len(response.get_json().get('unfiltered_triplets', []))
+
+        def run():
+            counts = parallel_map(post, range(requests), max_workers=requests)
+            return sum(counts), requests
+
+        results[f'server_process[triplets={triplets},requests={requests}]'] = measure(run, repeats)
+    return results
+
+
+SUITES = {
+    'banal_assessor': bench_banal_assessor,
+    'banal_metric': bench_banal_metric,
+    'process_text': bench_process_text,
+    'server': bench_server,
+}
+
+
+def compare(results, baseline, threshold):
+    """Регрессии относительно базовых результатов: список (случай, показатель, было, стало)."""
+    regressions = []
+    for key, current in results['results'].items():
+        base = baseline['results'].get(key)
+        if base is None:
+            continue
+        for metric in COMPARED_METRICS:
+            before, after = base.get(metric), current.get(metric)
+            if before and after is not None and (after - before) / before > threshold:
+                regressions.append((key, metric, before, after))
+    return regressions
+
+
+def _write_json(path, data):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stage-level benchmarks on a synthetic LM.")
+    parser.add_argument("--suite", action="append", choices=sorted(SUITES), help="Run only these suites.")
+    parser.add_argument("--quick", action="store_true", help="Use the reduced parameter grid.")
+    parser.add_argument("--repeats", type=int, default=3, help="Repeats per case (median wall time).")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="Synthetic LM latency per call.")
+    parser.add_argument("--jitter-ms", type=float, default=10.0, help="Synthetic LM latency jitter.")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="Where to save the results JSON.")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline results JSON to compare with.")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed relative growth of a metric.")
+    parser.add_argument("--save-baseline", action="store_true", help="Save the results as the new baseline.")
+    args = parser.parse_args()
+
+    grid = QUICK_GRID if args.quick else FULL_GRID
+    latency, jitter = args.latency_ms / 1000, args.jitter_ms / 1000
+    settings = {
+        'latency_ms': args.latency_ms,
+        'jitter_ms': args.jitter_ms,
+        'repeats': args.repeats,
+        'grid': grid,
+        'llm_max_concurrency': config.LLM_MAX_CONCURRENCY,
+    }
+
+    results = {'settings': settings, 'results': {}}
+    for name in args.suite or SUITES:
+        print(f"=== {name} ===")
+        suite_results = SUITES[name](grid, args.repeats, latency, jitter)
+        for key, metrics in suite_results.items():
+            print(f"{key}: {metrics['wall_seconds']:.3f} с, вызовов LLM {metrics['llm_calls']} "
+                  f"({metrics['llm_calls_per_triplet']} на связку), токенов на запрос {metrics['tokens_per_request']}")
+        results['results'].update(suite_results)
+
+    _write_json(args.output, results)
+    print(f"\nРезультаты сохранены в {args.output}")
+
+    if args.save_baseline:
+        _write_json(args.baseline, results)
+        print(f"Базовые результаты сохранены в {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"Базовых результатов нет ({args.baseline}); сохраните их с --save-baseline")
+        return 0
+
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    if baseline.get('settings', {}).get('latency_ms') != args.latency_ms:
+        print("Внимание: задержка синтетической LM отличается от базовой, время несравнимо")
+
+    regressions = compare(results, baseline, args.threshold)
+    if not regressions:
+        print(f"Регрессий нет (порог {args.threshold:.0%})")
+        return 0
+    print(f"Регрессии (рост больше {args.threshold:.0%}):")
+    for key, metric, before, after in regressions:
+        print(f"  {key} {metric}: {before} -> {after}")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,140 @@
+"""
+Отчет о времени запуска сервера: импорт модулей и этапы прогрева (настройка DSPy, импорт
+LiteLLM, загрузка экстрактора), как при WARM_START=preload.
+
+    python -m benchmarks.startup                      # отчет, результаты в tmp/startup.json
+    python -m benchmarks.startup --save-baseline      # записать результаты как базовые
+    python -m benchmarks.startup --baseline benchmarks/startup_baseline.json --threshold 0.2
+
+Каждый замер - отдельный процесс с python -X importtime; время - медиана повторов. Самые
+дорогие импорты показываются по пакетам верхнего уровня (время импорта пакета вместе с
+его зависимостями). Рост времени больше чем на threshold относительно базового - регрессия,
+код выхода 1.
+"""
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_OUTPUT = 'tmp/startup.json'
+DEFAULT_BASELINE = 'benchmarks/startup_baseline.json'
+
+_PROBE = (
+    "import json\n"
+    "import server.app as app\n"
+    "app.warm_start()\n"
+    "from modules import startup\n"
+    "print('STARTUP ' + json.dumps(startup.report()))\n"
+)
+_IMPORT_RE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)$')
+
+
+def probe(env):
+    """Один запуск: (время процесса, этапы прогрева, время импорта пакетов верхнего уровня)."""
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', _PROBE],
+        cwd=PROJECT_ROOT, env=env, capture_output=True, text=True,
+    )
+    seconds = time.perf_counter() - started
+    if result.returncode != 0:
+        errors = '\n'.join(line for line in result.stderr.splitlines() if not line.startswith('import time:'))
+        raise RuntimeError(f"Запуск завершился с ошибкой:\n{errors[-2000:]}")
+
+    report = next(json.loads(line[len('STARTUP '):]) for line in result.stdout.splitlines()
+                  if line.startswith('STARTUP '))
+    packages = {}
+    for line in result.stderr.splitlines():
+        match = _IMPORT_RE.match(line)
+        if match and '.' not in match.group(4):
+            name = match.group(4)
+            packages[name] = packages.get(name, 0) + int(match.group(2)) / 1e6
+    return seconds, report['phases'], packages
+
+
+def measure(repeats, env):
+    runs = [probe(env) for _ in range(repeats)]
+    phases = {name: round(statistics.median(run[1].get(name, 0.0) for run in runs), 3) for name in runs[0][1]}
+    packages = {}
+    for name in runs[0][2]:
+        packages[name] = round(statistics.median(run[2].get(name, 0.0) for run in runs), 3)
+    return {
+        'process_seconds': round(statistics.median(run[0] for run in runs), 3),
+        'phases': phases,
+        'imports': dict(sorted(packages.items(), key=lambda item: -item[1])),
+    }
+
+
+def compare(results, baseline, threshold, min_seconds=0.05):
+    """Регрессии: (показатель, было, стало); этапы короче min_seconds не сравниваются."""
+    pairs = [('process_seconds', baseline.get('process_seconds'), results['process_seconds'])]
+    pairs += [(f'phases.{name}', baseline.get('phases', {}).get(name), seconds)
+              for name, seconds in results['phases'].items()]
+    return [
+        (name, before, after) for name, before, after in pairs
+        if before is not None and max(before, after) >= min_seconds and (after - before) / max(before, 1e-9) > threshold
+    ]
+
+
+def _write_json(path, data):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Server import and warm-start time report.")
+    parser.add_argument("--repeats", type=int, default=3, help="Process launches (median).")
+    parser.add_argument("--top", type=int, default=15, help="How many of the slowest packages to show.")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="Where to save the results JSON.")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline results JSON to compare with.")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed relative growth of a phase.")
+    parser.add_argument("--save-baseline", action="store_true", help="Save the results as the new baseline.")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    # Прогрев не обращается к провайдеру, ключ нужен только для проверки в config
+    env.setdefault('OPENROUTER_API_KEY', 'startup-report')
+    results = measure(args.repeats, env)
+    results['lm_backend'] = env.get('LM_BACKEND', 'openrouter')
+
+    print(f"Запуск процесса до готовности: {results['process_seconds']:.2f} с (LM_BACKEND={results['lm_backend']})")
+    for name, seconds in results['phases'].items():
+        print(f"  {name}: {seconds:.3f} с")
+    print("Самые долгие импорты (пакет вместе с зависимостями):")
+    for name, seconds in list(results['imports'].items())[:args.top]:
+        print(f"  {name}: {seconds:.3f} с")
+
+    _write_json(args.output, results)
+    print(f"\nРезультаты сохранены в {args.output}")
+
+    if args.save_baseline:
+        _write_json(args.baseline, results)
+        print(f"Базовые результаты сохранены в {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"Базовых результатов нет ({args.baseline}); сохраните их с --save-baseline")
+        return 0
+
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold)
+    if not regressions:
+        print(f"Регрессий нет (порог {args.threshold:.0%})")
+        return 0
+    print(f"Регрессии (рост больше {args.threshold:.0%}):")
+    for name, before, after in regressions:
+        print(f"  {name}: {before} -> {after} с")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
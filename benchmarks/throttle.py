@@ -0,0 +1,120 @@
+"""
+Проверка лимитера запросов к LLM (modules.limiter) против локального провайдера с
+искусственным ограничением (benchmarks.fake_provider): PipelineLM шлет запросы одновременно,
+провайдер отвечает 429 сверх --max-concurrency одновременных запросов или --rps в секунду.
+
+    python -m benchmarks.throttle --requests 200 --concurrency 32 --max-concurrency 4 --retry-after 0.5
+
+Печатает, сколько запросов завершилось успешно после повторов, сколько раз провайдер
+ответил 429/503, и как менялся адаптивный лимит одновременных запросов модели. Результаты -
+в tmp/throttle.json; если хотя бы один запрос не удался, код выхода 1.
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+from benchmarks.fake_provider import ProviderState, start_server
+from modules.limiter import get_model_limiter
+from modules.lm import PipelineLM
+from modules.parallel import parallel_map
+
+DEFAULT_OUTPUT = 'tmp/throttle.json'
+
+
+def sample_limits(limiter, interval, stop, samples):
+    """Каждые interval секунд записывает (время, лимит, запросов в работе) до stop."""
+    started = time.perf_counter()
+    while not stop.is_set():
+        snapshot = limiter.snapshot()
+        samples.append((round(time.perf_counter() - started, 2), snapshot['limit'], snapshot['in_flight']))
+        stop.wait(interval)
+
+
+def run(lm, requests, concurrency):
+    """Отправляет requests запросов, не более concurrency одновременно; возвращает список ошибок."""
+    def call(index):
+        try:
+            lm(messages=[{'role': 'user', 'content': f'Запрос {index}'}])
+            return None
+        except Exception as e:
+            return f'{type(e).__name__}: {e}'
+
+    return [error for error in parallel_map(call, range(requests), max_workers=concurrency) if error]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the LLM rate limiter against a throttling fake provider.")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32, help="Client threads sending requests.")
+    parser.add_argument("--model", default="openai/throttle-test")
+    parser.add_argument("--max-concurrency", type=int, default=4, help="Provider: 429 above this many in flight.")
+    parser.add_argument("--rps", type=float, default=0.0, help="Provider: 429 above this many requests per second.")
+    parser.add_argument("--error-rate", type=float, default=0.02, help="Provider: share of 503 responses.")
+    parser.add_argument("--retry-after", type=float, help="Provider: Retry-After seconds sent with 429.")
+    parser.add_argument("--latency-ms", type=float, default=100.0)
+    parser.add_argument("--jitter-ms", type=float, default=20.0)
+    parser.add_argument("--sample-interval", type=float, default=0.25, help="Seconds between limit samples.")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    args = parser.parse_args()
+
+    state = ProviderState(
+        max_concurrency=args.max_concurrency, rps=args.rps, error_rate=args.error_rate,
+        retry_after=args.retry_after, latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000,
+    )
+    server, url = start_server(state)
+    lm = PipelineLM(model=args.model, api_key='fake', api_base=url, max_tokens=1000, cache=False)
+    limiter = get_model_limiter(args.model)
+
+    samples = []
+    stop = threading.Event()
+    sampler = threading.Thread(target=sample_limits, args=(limiter, args.sample_interval, stop, samples), daemon=True)
+    sampler.start()
+    started = time.perf_counter()
+    try:
+        errors = run(lm, args.requests, args.concurrency)
+    finally:
+        stop.set()
+        sampler.join()
+        server.shutdown()
+    seconds = time.perf_counter() - started
+
+    limits = [limit for _, limit, _ in samples]
+    results = {
+        'requests': args.requests,
+        'succeeded': args.requests - len(errors),
+        'failed': len(errors),
+        'seconds': round(seconds, 2),
+        'provider': state.snapshot(),
+        'limiter': limiter.snapshot(),
+        'limit': {'min': min(limits), 'max': max(limits), 'final': limits[-1]} if limits else None,
+        'samples': samples,
+        'errors': errors[:10],
+    }
+
+    provider = results['provider']
+    print(f"Запросов: {args.requests}, успешно: {results['succeeded']}, с ошибкой: {results['failed']} "
+          f"({seconds:.1f} с)")
+    print(f"Ответы провайдера: 200 - {provider['200']}, 429 - {provider['429']}, 503 - {provider['503']}; "
+          f"максимум одновременных запросов {provider['max_in_flight']}")
+    if results['limit']:
+        print(f"Лимит одновременных запросов: от {results['limit']['min']} до {results['limit']['max']}, "
+              f"в конце {results['limit']['final']}")
+    print(f"Сигналы перегрузки: {results['limiter']['throttled']}")
+    for error in results['errors']:
+        print(f"  {error}")
+
+    directory = os.path.dirname(args.output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"\nРезультаты сохранены в {args.output}")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -12,6 +12,19 @@ MAIN_MODEL = os.getenv('MAIN_MODEL', 'openrouter/openai/gpt-4.1')
 BANAL_MODEL = os.getenv('BANAL_MODEL', 'openrouter/google/gemini-2.0-flash-001')
 ASSESSMENT_MODEL = os.getenv('ASSESSMENT_MODEL', 'openrouter/openai/gpt-4.1-mini')
 
+# Источник ответов LM: openrouter - запросы к провайдеру; record - то же с записью ответов
+# в кассету LM_CASSETTE_PATH; replay - ответы из кассеты, без сети и API ключа, с синтетической
+# задержкой LM_REPLAY_LATENCY_MS ± LM_REPLAY_JITTER_MS (recorded - записанное время ответа);
+# synthetic - сгенерированные ответы нужной формы (извлечение - LM_SYNTHETIC_TRIPLETS связок)
+# с той же задержкой, для бенчмарков и нагрузочных прогонов
+LM_BACKENDS = ('openrouter', 'record', 'replay', 'synthetic')
+LM_BACKEND = os.getenv('LM_BACKEND', 'openrouter').lower()
+LM_CASSETTE_PATH = os.getenv('LM_CASSETTE_PATH', 'tmp/lm_cassette.jsonl')
+_replay_latency = os.getenv('LM_REPLAY_LATENCY_MS', '0')
+LM_REPLAY_LATENCY_MS = None if _replay_latency == 'recorded' else float(_replay_latency)
+LM_REPLAY_JITTER_MS = float(os.getenv('LM_REPLAY_JITTER_MS', '0'))
+LM_SYNTHETIC_TRIPLETS = int(os.getenv('LM_SYNTHETIC_TRIPLETS', '5'))
+
 # Настройки основной модели
 MAIN_MODEL_MAX_TOKENS = 4000
 MAIN_MODEL_TEMPERATURE = 0.0
@@ -19,8 +32,167 @@ MAIN_MODEL_TEMPERATURE = 0.0
 # Пороги
 BANAL_THRESHOLD = float(os.getenv('BANAL_THRESHOLD', '0.6'))
 
-# Проверка наличия API ключа
-if not OPENROUTER_API_KEY:
+# Сравнение с банальными преобразованиями одним вызовом LLM вместо n отдельных
+BANAL_BATCH_COMPARE = os.getenv('BANAL_BATCH_COMPARE', 'true').lower() == 'true'
+
+# Движок сходства для оценки банальности:
+#   llm    - все сравнения выполняет LLM
+#   local  - только локальное TF-IDF сходство символьных n-грамм (без вызовов LLM)
+#   hybrid - локальная оценка, LLM только для оценок внутри неоднозначного диапазона
+BANAL_SIMILARITY_BACKEND = os.getenv('BANAL_SIMILARITY_BACKEND', 'llm')
+BANAL_LOCAL_AMBIGUOUS_LOW = float(os.getenv('BANAL_LOCAL_AMBIGUOUS_LOW', '0.3'))
+BANAL_LOCAL_AMBIGUOUS_HIGH = float(os.getenv('BANAL_LOCAL_AMBIGUOUS_HIGH', '0.7'))
+
+# Совмещенная оценка банальности: генерация банальных преобразований, оценки сходства с ними и
+# (при CAUSAL_CHECK_ENABLED) проверка каузальности - один вызов banal-модели на связку вместо
+# 1 + n (+1). BANAL_SIMILARITY_BACKEND при этом не используется; если оценки сходства из ответа
+# не разобраны, сравнение выполняется еще одним пакетным вызовом
+BANAL_FUSED_ASSESSMENT = os.getenv('BANAL_FUSED_ASSESSMENT', 'false').lower() == 'true'
+
+# Локальный предварительный фильтр банальности (без вызовов LLM): связка банальна, если
+# преобразование пересказывает начальное состояние и результат - доля его содержательных
+# слов из них не ниже BANAL_PREFILTER_BANAL_OVERLAP. Связка принимается без LLM, если доля
+# не выше BANAL_PREFILTER_ACCEPT_OVERLAP, а слов не меньше BANAL_PREFILTER_ACCEPT_MIN_WORDS
+# (-1 - не принимать локально). Выключен по умолчанию: включать после проверки согласия с LLM
+# (python main.py --eval-prefilter). Фильтр выполняется отдельной стадией каскада
+BANAL_PREFILTER_ENABLED = os.getenv('BANAL_PREFILTER_ENABLED', 'false').lower() == 'true'
+BANAL_PREFILTER_BANAL_OVERLAP = float(os.getenv('BANAL_PREFILTER_BANAL_OVERLAP', '0.8'))
+BANAL_PREFILTER_ACCEPT_OVERLAP = float(os.getenv('BANAL_PREFILTER_ACCEPT_OVERLAP', '-1'))
+BANAL_PREFILTER_ACCEPT_MIN_WORDS = int(os.getenv('BANAL_PREFILTER_ACCEPT_MIN_WORDS', '8'))
+
+# Проверка причинно-следственной связи (CausalRelationship на основной модели).
+# Выключена по умолчанию; если включена, выполняется параллельно с оценкой банальности
+CAUSAL_CHECK_ENABLED = os.getenv('CAUSAL_CHECK_ENABLED', 'false').lower() == 'true'
+
+# Уровневая оценка связок (modules.tiers): связку сначала оценивает дешевый уровень, а следующий
+# (более сильный) - только если оценка попала в полосу ±TIER_ESCALATION_BAND около порога:
+# порога банальности запроса или, для воспроизводимости, TIER_REPRODUCIBILITY_THRESHOLD.
+# Уровни перечисляются через запятую по возрастанию стоимости: имя модели (все вызовы стадии
+# на ней) или local - локальное сходство с банальными преобразованиями, сгенерированными
+# BANAL_MODEL (только для банальности). Экономия и изменившиеся решения: python main.py --eval-tiers
+TIERED_ASSESSMENT = os.getenv('TIERED_ASSESSMENT', 'false').lower() == 'true'
+BANAL_TIERS = [t.strip() for t in os.getenv('BANAL_TIERS', f'local,{BANAL_MODEL}').split(',') if t.strip()]
+REPRODUCIBILITY_TIERS = [
+    t.strip() for t in os.getenv('REPRODUCIBILITY_TIERS', f'{BANAL_MODEL},{MAIN_MODEL}').split(',') if t.strip()
+]
+TIER_ESCALATION_BAND = float(os.getenv('TIER_ESCALATION_BAND', '0.15'))
+TIER_REPRODUCIBILITY_THRESHOLD = float(os.getenv('TIER_REPRODUCIBILITY_THRESHOLD', '0.7'))
+
+# Каскад стадий оценки связки: ранняя остановка сравнений с банальными преобразованиями,
+# как только связка заведомо не проходит порог банальности, и порядок стадий по стоимости
+# и измеренной доле отсева (после CASCADE_MIN_RUNS запусков стадии). Ранняя остановка экономит
+# вызовы только при попарном сравнении (BANAL_BATCH_COMPARE=false или неразобранный пакетный
+# ответ): тогда пары сравниваются по очереди и в асинхронном режиме
+CASCADE_EARLY_STOP = os.getenv('CASCADE_EARLY_STOP', 'true').lower() == 'true'
+CASCADE_ADAPTIVE_ORDER = os.getenv('CASCADE_ADAPTIVE_ORDER', 'true').lower() == 'true'
+CASCADE_MIN_RUNS = int(os.getenv('CASCADE_MIN_RUNS', '50'))
+
+# Срок обработки запроса в секундах (0 - без срока): поле deadline_seconds или заголовок
+# X-Deadline-Seconds, по умолчанию REQUEST_DEADLINE_SECONDS. Стадии, которые не успевают до срока
+# (за вычетом DEADLINE_RESERVE_SECONDS на сборку ответа), упрощаются или пропускаются, а связки
+# помечаются как оцененные частично. Время стадии - среднее по статистике каскада, до ее
+# накопления - DEADLINE_LLM_CALL_SECONDS на каждый вызов LLM
+REQUEST_DEADLINE_SECONDS = float(os.getenv('REQUEST_DEADLINE_SECONDS', '0'))
+DEADLINE_RESERVE_SECONDS = float(os.getenv('DEADLINE_RESERVE_SECONDS', '2'))
+DEADLINE_LLM_CALL_SECONDS = float(os.getenv('DEADLINE_LLM_CALL_SECONDS', '3'))
+
+# Параллелизм: сколько связок оценивается одновременно (1 - последовательно)
+MAX_CONCURRENCY = int(os.getenv('MAX_CONCURRENCY', '4'))
+
+# Сколько запросов к LLM процесс выполняет одновременно - общий лимит для всех запросов,
+# текстов пакета и связок (0 - без ограничения). Подбирается под лимит провайдера
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', '16'))
+
+# Лимиты запросов к провайдеру по моделям (общие для всех запросов процесса):
+# токен-бакет - не больше *_RPS запросов в секунду (0 - без ограничения), до LLM_RATE_BURST подряд;
+# адаптивный лимит одновременных запросов (AIMD) - уменьшается в LLM_BACKOFF_FACTOR раз при 429,
+# 5xx, таймаутах и всплесках времени ответа (больше LLM_LATENCY_SPIKE_FACTOR средних, 0 - не учитывать),
+# растет на 1 за каждые «лимит» успешных запросов, от LLM_MIN_CONCURRENCY до LLM_MAX_CONCURRENCY.
+# Повторы при ограничении (LLM_MAX_RETRIES) выполняет лимитер с учетом Retry-After
+MAIN_MODEL_RPS = float(os.getenv('MAIN_MODEL_RPS', '0'))
+BANAL_MODEL_RPS = float(os.getenv('BANAL_MODEL_RPS', '0'))
+ASSESSMENT_MODEL_RPS = float(os.getenv('ASSESSMENT_MODEL_RPS', '0'))
+LLM_RATE_BURST = int(os.getenv('LLM_RATE_BURST', '4'))
+LLM_ADAPTIVE_CONCURRENCY = os.getenv('LLM_ADAPTIVE_CONCURRENCY', 'true').lower() == 'true'
+LLM_MIN_CONCURRENCY = int(os.getenv('LLM_MIN_CONCURRENCY', '1'))
+LLM_BACKOFF_FACTOR = float(os.getenv('LLM_BACKOFF_FACTOR', '0.5'))
+LLM_LATENCY_SPIKE_FACTOR = float(os.getenv('LLM_LATENCY_SPIKE_FACTOR', '3'))
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', '3'))
+# Базовый URL OpenAI-совместимого API (например, локальный benchmarks/fake_provider.py)
+LM_API_BASE = os.getenv('LM_API_BASE', 'https://openrouter.ai/api/v1')
+
+# Пакетная обработка (POST /process/batch, process_texts): максимальный размер пакета
+# и сколько текстов пакета обрабатывается одновременно
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', '100'))
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', '8'))
+
+# Извлечение из длинных текстов по фрагментам: текст длиннее CHUNK_MAX_CHARS разбивается
+# по абзацам и предложениям с перекрытием CHUNK_OVERLAP_CHARS, фрагменты обрабатываются
+# параллельно, повторы связок из разных фрагментов объединяются до оценки банальности
+CHUNKING_ENABLED = os.getenv('CHUNKING_ENABLED', 'false').lower() == 'true'
+CHUNK_MAX_CHARS = int(os.getenv('CHUNK_MAX_CHARS', '6000'))
+CHUNK_OVERLAP_CHARS = int(os.getenv('CHUNK_OVERLAP_CHARS', '500'))
+
+# Схлопывание почти одинаковых связок после извлечения: связки со сходством формулировок
+# (среднее по полям пересечение множеств слов) не ниже порога оцениваются один раз. Выключено
+# по умолчанию: схлопнутые связки не попадают в unfiltered_triplets (они в merged_duplicates)
+DEDUP_ENABLED = os.getenv('DEDUP_ENABLED', 'false').lower() == 'true'
+# Порог сходства; им же (и при выключенном DEDUP_ENABLED) объединяются переформулированные
+# повторы связок из перекрытия соседних фрагментов (CHUNKING_ENABLED)
+DEDUP_SIMILARITY_THRESHOLD = float(os.getenv('DEDUP_SIMILARITY_THRESHOLD', '0.8'))
+
+# Дисковый кэш ответов LM, общий для всех воркеров (SQLite)
+LM_CACHE_ENABLED = os.getenv('LM_CACHE_ENABLED', 'true').lower() == 'true'
+LM_CACHE_PATH = os.getenv('LM_CACHE_PATH', 'tmp/lm_cache.sqlite')
+LM_CACHE_MAX_MB = int(os.getenv('LM_CACHE_MAX_MB', '256'))
+LM_CACHE_TTL_SECONDS = int(os.getenv('LM_CACHE_TTL_SECONDS', str(7 * 24 * 3600)))
+
+# Кэш результатов /process (оценки связок по нормализованному тексту) и объединение одинаковых запросов
+RESULT_CACHE_ENABLED = os.getenv('RESULT_CACHE_ENABLED', 'true').lower() == 'true'
+RESULT_CACHE_PATH = os.getenv('RESULT_CACHE_PATH', 'tmp/result_cache.sqlite')
+RESULT_CACHE_MAX_MB = int(os.getenv('RESULT_CACHE_MAX_MB', '64'))
+RESULT_CACHE_TTL_SECONDS = int(os.getenv('RESULT_CACHE_TTL_SECONDS', str(24 * 3600)))
+# Сколько ждать параллельный запрос с тем же текстом, прежде чем считать самому (больше таймаута gunicorn)
+RESULT_CACHE_LEASE_SECONDS = int(os.getenv('RESULT_CACHE_LEASE_SECONDS', '130'))
+
+# Асинхронные задания (POST /jobs): хранилище очереди, число фоновых воркеров на процесс,
+# время жизни завершенных заданий и срок аренды: пока задание выполняется, воркер продлевает
+# аренду (раз в треть срока), а задание, аренду которого не продлевали дольше срока (процесс
+# упал), берет другой воркер
+JOB_STORE_BACKEND = os.getenv('JOB_STORE_BACKEND', 'sqlite')
+JOB_STORE_PATH = os.getenv('JOB_STORE_PATH', 'tmp/jobs.sqlite')
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '2'))
+JOB_TTL_SECONDS = int(os.getenv('JOB_TTL_SECONDS', str(24 * 3600)))
+JOB_LEASE_SECONDS = int(os.getenv('JOB_LEASE_SECONDS', '600'))
+
+# Трассировки запросов (заголовок X-Trace: store), сохраненные для скачивания через GET /traces/<trace_id>
+TRACE_STORE_PATH = os.getenv('TRACE_STORE_PATH', 'tmp/traces.sqlite')
+TRACE_STORE_MAX_MB = int(os.getenv('TRACE_STORE_MAX_MB', '64'))
+TRACE_TTL_SECONDS = int(os.getenv('TRACE_TTL_SECONDS', str(24 * 3600)))
+
+# Валидационный прогон (main.py --validate): сколько текстов обрабатывается одновременно
+# и файл JSONL с результатами, он же контрольная точка для продолжения прерванного прогона
+VALIDATION_WORKERS = int(os.getenv('VALIDATION_WORKERS', '4'))
+VALIDATION_RESULTS_PATH = os.getenv('VALIDATION_RESULTS_PATH', 'tmp/validation_results.jsonl')
+
+# Прогрев сервера (настройка DSPy, импорт LiteLLM, загрузка экстрактора):
+# preload - один раз в мастер-процессе gunicorn до запуска воркеров, воркеры разделяют
+# загруженное копированием при записи; worker - каждым воркером в фоне сразу после запуска;
+# lazy - при первом запросе. Готовность - GET /ready
+WARM_START_MODES = ('preload', 'worker', 'lazy')
+WARM_START = os.getenv('WARM_START', 'preload').lower()
+
+if LM_BACKEND not in LM_BACKENDS:
+    raise ValueError(f"LM_BACKEND должен быть одним из: {', '.join(LM_BACKENDS)}")
+
+if WARM_START not in WARM_START_MODES:
+    raise ValueError(f"WARM_START должен быть одним из: {', '.join(WARM_START_MODES)}")
+
+if not BANAL_TIERS or not REPRODUCIBILITY_TIERS or 'local' in REPRODUCIBILITY_TIERS:
+    raise ValueError("BANAL_TIERS и REPRODUCIBILITY_TIERS должны быть непустыми; local - только в BANAL_TIERS")
+
+# Проверка наличия API ключа (воспроизведение из кассеты и синтетические ответы обходятся без него)
+if not OPENROUTER_API_KEY and LM_BACKEND not in ('replay', 'synthetic'):
     raise ValueError(
         "OPENROUTER_API_KEY не найден в переменных окружения. "
         "Создайте файл .env и добавьте: OPENROUTER_API_KEY=ваш_ключ"
@@ -0,0 +1,50 @@
+"""
+Настройки gunicorn. Файл подхватывается автоматически при запуске из корня проекта;
+параметры командной строки (см. CMD в Dockerfile) дополняют его.
+"""
+
+import os
+import shutil
+import threading
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# WARM_START=preload: приложение импортируется и прогревается (DSPy, LiteLLM, экстрактор)
+# в мастер-процессе, воркеры получают его готовым и разделяют память копированием при записи
+WARM_START = os.environ.get('WARM_START', 'preload').lower()
+preload_app = WARM_START == 'preload'
+
+
+def on_starting(server):
+    """Очищает каталог метрик Prometheus от файлов прошлого запуска."""
+    directory = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if directory:
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory, exist_ok=True)
+
+
+def when_ready(server):
+    """Прогрев в мастер-процессе до запуска воркеров (WARM_START=preload)."""
+    if preload_app:
+        from server.app import warm_start
+        warm_start()
+
+
+def post_worker_init(worker):
+    """
+    Запускает воркеры заданий (потоки не переживают fork, поэтому - в каждом воркере) и при
+    WARM_START=worker прогревает воркер в фоне: /live отвечает сразу, /ready - после прогрева.
+    """
+    if WARM_START == 'lazy':
+        return
+    from server.app import initialize
+    threading.Thread(target=initialize, name='warm-start', daemon=True).start()
+
+
+def child_exit(server, worker):
+    """Исключает gauge-метрики завершившегося воркера из суммы по процессам."""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
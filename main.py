@@ -10,11 +10,18 @@ import logging
 logging.getLogger("dspy").setLevel(logging.WARNING)
 
 from dspy.teleprompt import BootstrapFewShot
+from dspy.utils.usage_tracker import UsageTracker
 
 import config
 from modules.extract import TransformationExtractor
+from modules.lm import create_lm
 from modules.merge import TransformationMerger
-from modules.process import process_text
+from modules.parallel import parallel_map
+from modules.enrich import TripletEnricher
+from modules.process import assess_reproducibility, extract_triplets, process_text
+from modules.validation import run_validation, summarize
+from metrics.assess_banal import assess_triplet_banality
+from metrics.banal_prefilter import BANAL, prefilter_triplet
 from metrics.combined import combined_metric
 
 
@@ -29,18 +36,14 @@ load_dotenv()
 
 def setup_dspy():
     """Configures the DSPy language models."""
-    main_lm = dspy.LM(
-        model=config.MAIN_MODEL,
-        api_key=config.OPENROUTER_API_KEY,
-        api_base='https://openrouter.ai/api/v1',
+    main_lm = create_lm(
+        config.MAIN_MODEL,
         max_tokens=config.MAIN_MODEL_MAX_TOKENS,
         temperature=config.MAIN_MODEL_TEMPERATURE
     )
     
-    banal_lm = dspy.LM(
-        model=config.BANAL_MODEL,
-        api_key=config.OPENROUTER_API_KEY,
-        api_base='https://openrouter.ai/api/v1',
+    banal_lm = create_lm(
+        config.BANAL_MODEL,
         max_tokens=500, # As it was in assess_banal.py
         temperature=0.0
     )
@@ -82,23 +85,167 @@ def load_or_train_extractor(extractor_path, demonstrations_path):
         print("Сохранение завершено.")
     return optimized_extractor
 
-def run_validation_testset(optimized_extractor):
+def load_validation_texts():
+    """Загружает тексты из validation_testset.json."""
+    with open(VALIDATION_TESTSET_PATH, 'r', encoding='utf-8-sig') as f:
+        data = json.load(f)
+    return data.get("validation_testset", [])
+
+def run_validation_testset(optimized_extractor, output_path=config.VALIDATION_RESULTS_PATH,
+                           workers=config.VALIDATION_WORKERS, resume=True):
     """
     Прогоняет все тексты из validation_testset.json через полный цикл обработки.
+    Тексты обрабатываются одновременно (workers), результаты пишутся в output_path (JSONL)
+    по мере готовности; при resume=True уже обработанные тексты пропускаются.
     """
-    with open(VALIDATION_TESTSET_PATH, 'r', encoding='utf-8-sig') as f:
-        data = json.load(f)
-    test_texts = data.get("validation_testset", [])
-    print(f"\n=== Валидационный тестовый сет: {len(test_texts)} текстов ===\n")
-    for idx, text in enumerate(test_texts, 1):
-        print(f"\n--- Текст {idx} ---")
-        print(text[:300] + ("..." if len(text) > 300 else ""))
-        
-        final, unfiltered, failed = process_text(optimized_extractor, text)
-        print(f"  Извлечено {len(unfiltered)} связок, прошло фильтры: {len(final)}.")
-        if failed:
-            print("  Детали отфильтрованных связок:")
-            print(failed)
+    test_texts = load_validation_texts()
+    print(f"\n=== Валидационный тестовый сет: {len(test_texts)} текстов, результаты в {output_path} ===\n")
+
+    def on_result(record):
+        label = f"Текст {record['index'] + 1}"
+        if not record['success']:
+            print(f"  {label}: ошибка - {record['error']}")
+            return
+        funnel = record['funnel']
+        print(f"  {label}: извлечено {funnel['unique']} связок, прошло фильтры: {funnel['accepted']} "
+              f"({record['seconds']:.1f} с, вызовов LLM: {record['llm_calls']})")
+
+    records = run_validation(
+        optimized_extractor, test_texts, output_path=output_path, workers=workers, resume=resume, on_result=on_result
+    )
+    summary = summarize(records)
+
+    print(f"\n=== Итог: обработано {summary['succeeded']} из {len(test_texts)} текстов, ошибок: {summary['failed']} ===")
+    funnel = summary['funnel']
+    print(f"Воронка связок: извлечено {funnel['extracted']}, уникальных {funnel['unique']}, "
+          f"прошли банальность {funnel['banality_passed']}, приняты {funnel['accepted']}")
+    if 'seconds' in summary:
+        seconds = summary['seconds']
+        print(f"Время на текст: среднее {seconds['mean']:.1f} с, p50 {seconds['p50']:.1f} с, "
+              f"p95 {seconds['p95']:.1f} с, максимум {seconds['max']:.1f} с")
+        print(f"Вызовов LLM: {summary['llm_calls']} ({summary['llm_calls_per_text']} на текст), "
+              f"токенов: {summary['prompt_tokens']} в промптах, {summary['completion_tokens']} в ответах")
+
+def run_prefilter_evaluation(optimized_extractor, banal_threshold=config.BANAL_THRESHOLD):
+    """
+    Сравнивает решения локального фильтра банальности с оценкой LLM на связках,
+    извлеченных из validation_testset.json. LLM оценивает все связки (фильтр при этом выключен).
+    """
+    test_texts = load_validation_texts()
+    triplets = []
+    for text in test_texts:
+        triplets.extend(extract_triplets(optimized_extractor, text)['triplets'])
+    print(f"\n=== Оценка локального фильтра банальности: {len(test_texts)} текстов, {len(triplets)} связок ===\n")
+    if not triplets:
+        return
+
+    decisions = [prefilter_triplet(t) for t in triplets]
+    llm_details = parallel_map(
+        lambda t: assess_triplet_banality(t, prefilter=False), triplets, max_workers=config.MAX_CONCURRENCY
+    )
+
+    decided = agreed = llm_banal = 0
+    disagreements = []
+    for triplet, decision, details in zip(triplets, decisions, llm_details):
+        is_llm_banal = details['non_banality_score'] <= banal_threshold
+        llm_banal += is_llm_banal
+        if decision['decision'] is None:
+            continue
+        decided += 1
+        if (decision['decision'] == BANAL) == is_llm_banal:
+            agreed += 1
+        else:
+            disagreements.append((triplet, decision, details['non_banality_score']))
+
+    print(f"Банальных по LLM (небанальность <= {banal_threshold}): {llm_banal} из {len(triplets)}")
+    print(f"Решено локально (без вызовов LLM): {decided} из {len(triplets)} ({decided / len(triplets):.0%})")
+    if decided:
+        print(f"Согласие с LLM среди решенных локально: {agreed} из {decided} ({agreed / decided:.0%})")
+    for triplet, decision, non_banality_score in disagreements:
+        print(f"  Расхождение: {triplet.get('initial_state')} -> {triplet.get('transformation')} -> {triplet.get('result')}")
+        print(f"    фильтр: {decision['decision']} ({decision['reason']}), небанальность по LLM: {non_banality_score:.2f}")
+
+def _tracked_map(function, items):
+    """Вызывает function для каждого элемента без кэша ответов LM; возвращает (результаты, вызовы и токены по моделям)."""
+    tracker = UsageTracker()
+    with dspy.context(usage_tracker=tracker, lm_cache_bypass=True):
+        results = parallel_map(function, items, max_workers=config.MAX_CONCURRENCY)
+    usage = {}
+    for model, entries in tracker.usage_data.items():
+        usage[model] = {
+            'calls': len(entries),
+            'tokens': sum((entry.get('prompt_tokens') or 0) + (entry.get('completion_tokens') or 0) for entry in entries),
+        }
+    return results, usage
+
+def _print_tier_report(name, baseline_usage, tiered_usage, tiers, changed, total):
+    """Печатает вызовы и токены по моделям без уровней и с уровнями, решившие уровни и изменившиеся решения."""
+    print(f"\n--- {name} ---")
+    for model in sorted(set(baseline_usage) | set(tiered_usage)):
+        before = baseline_usage.get(model, {'calls': 0, 'tokens': 0})
+        after = tiered_usage.get(model, {'calls': 0, 'tokens': 0})
+        print(f"  {model}: вызовов {before['calls']} -> {after['calls']}, токенов {before['tokens']} -> {after['tokens']}")
+    calls = [sum(u['calls'] for u in usage.values()) for usage in (baseline_usage, tiered_usage)]
+    tokens = [sum(u['tokens'] for u in usage.values()) for usage in (baseline_usage, tiered_usage)]
+    print(f"  Сэкономлено: {calls[0] - calls[1]} вызовов LLM из {calls[0]}, {tokens[0] - tokens[1]} токенов из {tokens[0]}")
+    counts = ", ".join(f"{tier} - {tiers.count(tier)}" for tier in dict.fromkeys(tiers))
+    print(f"  Решивший уровень: {counts}")
+    print(f"  Изменившиеся решения: {len(changed)} из {total}")
+    for triplet, before, after, path in changed:
+        scores = ", ".join(f"{step['tier']} {step['score']:.2f}" for step in path)
+        print(f"    {triplet.get('initial_state')} -> {triplet.get('transformation')} -> {triplet.get('result')}")
+        print(f"      без уровней: {before:.2f}, с уровнями: {after:.2f} ({scores})")
+
+def run_tier_evaluation(optimized_extractor, banal_threshold=config.BANAL_THRESHOLD,
+                        reproducibility_threshold=config.TIER_REPRODUCIBILITY_THRESHOLD):
+    """
+    Сравнивает уровневую оценку (config.BANAL_TIERS, config.REPRODUCIBILITY_TIERS) с оценкой
+    без уровней на связках, извлеченных из validation_testset.json: сколько вызовов LLM и токенов
+    сэкономлено, какой уровень решил каждую связку и чьи решения изменились. Обе оценки - без
+    кэша ответов LM и без локального фильтра; воспроизводимость - для связок, небанальных по
+    оценке без уровней.
+    """
+    test_texts = load_validation_texts()
+    items = []
+    for text in test_texts:
+        items.extend((text, triplet) for triplet in extract_triplets(optimized_extractor, text)['triplets'])
+    triplets = [triplet for _, triplet in items]
+    print(f"\n=== Уровневая оценка: {len(test_texts)} текстов, {len(triplets)} связок ===")
+    if not triplets:
+        return
+
+    baseline, baseline_usage = _tracked_map(lambda t: assess_triplet_banality(t, prefilter=False, tiers=()), triplets)
+    tiered, tiered_usage = _tracked_map(
+        lambda t: assess_triplet_banality(t, prefilter=False, tiers=config.BANAL_TIERS, threshold=banal_threshold),
+        triplets
+    )
+    changed = [
+        (triplet, before['non_banality_score'], after['non_banality_score'], after['tier_scores'])
+        for triplet, before, after in zip(triplets, baseline, tiered)
+        if (before['non_banality_score'] > banal_threshold) != (after['non_banality_score'] > banal_threshold)
+    ]
+    _print_tier_report(f"Банальность (порог {banal_threshold}, уровни {', '.join(config.BANAL_TIERS)})",
+                       baseline_usage, tiered_usage, [d.get('tier') for d in tiered], changed, len(triplets))
+
+    passed = [item for item, details in zip(items, baseline) if details['non_banality_score'] > banal_threshold]
+    if not passed:
+        return
+    enricher = TripletEnricher()
+    enriched = parallel_map(
+        lambda item: enricher(initial_text=item[0], transformation_triplet=item[1]), passed,
+        max_workers=config.MAX_CONCURRENCY
+    )
+    baseline, baseline_usage = _tracked_map(lambda t: assess_reproducibility(t, tiers=()), enriched)
+    tiered, tiered_usage = _tracked_map(lambda t: assess_reproducibility(t, tiers=config.REPRODUCIBILITY_TIERS), enriched)
+    changed = [
+        (triplet, before, after, path)
+        for triplet, (before, _), (after, path) in zip(enriched, baseline, tiered)
+        if (before >= reproducibility_threshold) != (after >= reproducibility_threshold)
+    ]
+    _print_tier_report(
+        f"Воспроизводимость (порог {reproducibility_threshold}, уровни {', '.join(config.REPRODUCIBILITY_TIERS)})",
+        baseline_usage, tiered_usage, [path[-1]['tier'] for _, path in tiered], changed, len(enriched)
+    )
 
 def main():
     parser = argparse.ArgumentParser(description="Run transformation extractor.")
@@ -107,9 +254,42 @@ def main():
         action="store_true",
         help="Run validation on the testset instead of the default text."
     )
+    parser.add_argument(
+        "--eval-prefilter",
+        action="store_true",
+        help="Compare the local banality pre-filter with the LLM assessment on the validation testset."
+    )
+    parser.add_argument(
+        "--eval-tiers",
+        action="store_true",
+        help="Compare tiered assessment with the single-model assessment on the validation testset."
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=config.VALIDATION_WORKERS,
+        help="Texts processed concurrently during --validate."
+    )
+    parser.add_argument(
+        "--output",
+        default=config.VALIDATION_RESULTS_PATH,
+        help="JSONL file with --validate results; also the checkpoint for resuming."
+    )
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="Start --validate from scratch instead of resuming from --output."
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Bypass the shared LM response cache."
+    )
     args = parser.parse_args()
     
     setup_dspy()
+    if args.no_cache:
+        dspy.configure(lm_cache_bypass=True)
     
     optimized_extractor = load_or_train_extractor(
         OPTIMIZED_EXTRACTOR_PATH,
@@ -117,7 +297,15 @@ def main():
     )
 
     if args.validate:
-        run_validation_testset(optimized_extractor)
+        run_validation_testset(optimized_extractor, args.output, workers=args.workers, resume=not args.restart)
+        return
+
+    if args.eval_prefilter:
+        run_prefilter_evaluation(optimized_extractor)
+        return
+
+    if args.eval_tiers:
+        run_tier_evaluation(optimized_extractor)
         return
 
     initial_text = """
@@ -1,7 +1,19 @@
+import asyncio
 import dspy
 import json
+import logging
+import re
+from dspy.utils.exceptions import AdapterParseError
 from typing import List, Tuple, Union
 import config
+from metrics import local_similarity
+from metrics.banal_prefilter import NON_BANAL, prefilter_triplet
+from modules import telemetry, tracing
+from modules.deadline import DeadlineExceeded
+from modules.parallel import run_concurrently
+from modules.tiers import LOCAL, aroute, route, tier_lm
+
+logger = logging.getLogger(__name__)
 
 class GenerateBanalTransformations(dspy.Signature):
     """Generate multiple possible transformations given an initial state and a result."""
@@ -16,6 +28,12 @@ class CompareTransformations(dspy.Signature):
     transformation_two: str = dspy.InputField(desc="The second transformation description.")
     similarity_score: float = dspy.OutputField(desc="A score from 0.0 (not at all similar) to 1.0 (semantically identical). Respond with ONLY the floating point number.")
 
+class CompareTransformationsBatch(dspy.Signature):
+    """Assess the semantic similarity between one transformation description and each of several candidate descriptions."""
+    transformation_one: str = dspy.InputField(desc="The transformation description to compare.")
+    candidates: List[str] = dspy.InputField(desc="The candidate transformation descriptions.")
+    similarity_scores: List[float] = dspy.OutputField(desc="One score per candidate, in the same order, from 0.0 (not at all similar) to 1.0 (semantically identical).")
+
 class CausalRelationship(dspy.Signature):
     """Determine if result is a direct logical consequence of initial_state"""
     initial_state: str = dspy.InputField(desc="The initial state.")
@@ -23,66 +41,675 @@ class CausalRelationship(dspy.Signature):
     reasoning: str = dspy.OutputField(desc="Explain your reasoning.")
     is_causal: bool = dspy.OutputField(desc="True if there is a clear causal relationship, False otherwise. Respond with ONLY 'True' or 'False'.")
 
+class AssessTripletFused(dspy.Signature):
+    """Generate multiple possible banal transformations given an initial state and a result, assess the semantic similarity between the given transformation and each generated one, and determine if result is a direct logical consequence of initial_state."""
+    initial_state: str = dspy.InputField(desc="The initial state.")
+    transformation: str = dspy.InputField(desc="The transformation description to assess.")
+    result: str = dspy.InputField(desc="The resulting state.")
+    n: int = dspy.InputField(desc="The number of distinct banal transformations to generate.")
+    generated_transformations: List[str] = dspy.OutputField(desc="A JSON list of generated banal transformation strings.")
+    similarity_scores: List[float] = dspy.OutputField(desc="One score per generated transformation, in the same order, from 0.0 (not at all similar to the given transformation) to 1.0 (semantically identical).")
+    reasoning: str = dspy.OutputField(desc="Explain whether result is a direct logical consequence of initial_state.")
+    is_causal: bool = dspy.OutputField(desc="True if there is a clear causal relationship between initial_state and result, False otherwise.")
+
+# Совмещенная оценка без проверки каузальности (CAUSAL_CHECK_ENABLED выключена)
+AssessTripletFusedNoCausal = AssessTripletFused.delete('reasoning').delete('is_causal').with_instructions(
+    "Generate multiple possible banal transformations given an initial state and a result, and assess the semantic "
+    "similarity between the given transformation and each generated one."
+)
+
+# Заголовок раздела поля в ответе ChatAdapter
+_FIELD_HEADER_RE = re.compile(r'\[\[ ## (\w+) ## \]\]')
+
+def _parse_batch_scores(comparison_result, expected_count):
+    """Оценки из ответа CompareTransformationsBatch или None, если их не удалось разобрать."""
+    try:
+        scores = comparison_result.similarity_scores
+        if isinstance(scores, str):
+            scores = json.loads(scores)
+        scores = [float(score) for score in scores]
+    except (ValueError, TypeError, AttributeError, json.JSONDecodeError):
+        return None
+    if len(scores) != expected_count:
+        return None
+    return scores
+
+def _ambiguous_indices(local_scores):
+    """Индексы локальных оценок, попавших в неоднозначный диапазон (их уточняет LLM)."""
+    return [
+        i for i, score in enumerate(local_scores)
+        if config.BANAL_LOCAL_AMBIGUOUS_LOW <= score <= config.BANAL_LOCAL_AMBIGUOUS_HIGH
+    ]
+
 class BanalAssessor(dspy.Module):
     """
     A module to assess the banality of a transformation.
     It works by generating a set of 'banal' transformations from the initial_state and result,
     and then checking if the provided transformation is similar to any of them.
     """
-    def __init__(self, n=3):
+    def __init__(self, n=3, batch_compare=config.BANAL_BATCH_COMPARE,
+                 similarity_backend=config.BANAL_SIMILARITY_BACKEND):
         super().__init__()
         self.n = n
+        self.batch_compare = batch_compare
+        self.similarity_backend = similarity_backend
         self.generate = dspy.ChainOfThought(GenerateBanalTransformations)
         self.compare = dspy.Predict(CompareTransformations)
+        self.compare_batch = dspy.Predict(CompareTransformationsBatch)
 
-    def forward(self, initial_state, transformation, result):
-        # Step 1: Generate banal transformations
-        generated_result = self.generate(initial_state=initial_state, result=result, n=self.n)
-        
+    def _compare_batched(self, transformation, generated_list):
+        """
+        Сравнивает преобразование со всеми сгенерированными за один вызов LLM.
+        Возвращает список оценок или None, если ответ не удалось разобрать (в том числе если
+        его не разобрал адаптер DSPy, например оценки словами).
+        """
         try:
-            generated_list = generated_result.generated_transformations
-            if isinstance(generated_list, str):
-                generated_list = json.loads(generated_list)
-        except (AttributeError, json.JSONDecodeError, TypeError):
-            #print(f"[DEBUG] Failed to generate or parse transformations. Output: {generated_result}")
-            return dspy.Prediction(assessment=0.0, generated_transformations=[], similarity_scores=[])
+            comparison_result = self.compare_batch(transformation_one=transformation, candidates=generated_list)
+        except AdapterParseError:
+            return None
+        return _parse_batch_scores(comparison_result, len(generated_list))
 
-        # Step 2: Compare the provided transformation with each generated one.
-        max_similarity = 0.0
-        similarity_scores = []  # Сохраняем все оценки сходства
-        
+    def _compare_pairwise(self, transformation, generated_list, stop_at=None):
+        """
+        Сравнивает преобразование с каждым сгенерированным отдельным вызовом LLM.
+        Как только оценка достигает stop_at, остальные пары не сравниваются (их оценки - None).
+        """
+        scores = []
         for gen_trans in generated_list:
             comparison_result = self.compare(transformation_one=transformation, transformation_two=gen_trans)
-            
             try:
-                similarity = float(comparison_result.similarity_score)
-                similarity_scores.append({
-                    'generated_transformation': gen_trans,
-                    'similarity_score': similarity
-                })
-                if similarity > max_similarity:
-                    max_similarity = similarity
+                scores.append(float(comparison_result.similarity_score))
             except (ValueError, TypeError, AttributeError):
                 #print(f"[DEBUG] Could not convert similarity score '{getattr(comparison_result, 'similarity_score', 'N/A')}' to float.")
-                similarity_scores.append({
-                    'generated_transformation': gen_trans,
-                    'similarity_score': 0.0
-                })
-                continue
+                scores.append(0.0)
+            if stop_at is not None and scores[-1] >= stop_at:
+                break
+        return scores + [None] * (len(generated_list) - len(scores))
+
+    async def _acompare_batched(self, transformation, generated_list):
+        """Асинхронный вариант _compare_batched."""
+        try:
+            comparison_result = await self.compare_batch.acall(transformation_one=transformation, candidates=generated_list)
+        except AdapterParseError:
+            return None
+        return _parse_batch_scores(comparison_result, len(generated_list))
+
+    async def _acompare_pairwise(self, transformation, generated_list, stop_at=None):
+        """
+        Асинхронный вариант _compare_pairwise. С stop_at пары сравниваются по очереди, как в
+        _compare_pairwise: иначе к моменту ранней остановки все запросы уже отправлены и
+        оплачены. Без stop_at остановки нет, и пары сравниваются одновременно.
+        """
+        async def compare(gen_trans):
+            comparison_result = await self.compare.acall(transformation_one=transformation, transformation_two=gen_trans)
+            try:
+                return float(comparison_result.similarity_score)
+            except (ValueError, TypeError, AttributeError):
+                return 0.0
+
+        if stop_at is None:
+            return list(await asyncio.gather(*(compare(gen_trans) for gen_trans in generated_list)))
+
+        scores = []
+        for gen_trans in generated_list:
+            scores.append(await compare(gen_trans))
+            if scores[-1] >= stop_at:
+                break
+        return scores + [None] * (len(generated_list) - len(scores))
+
+    def _compare_llm(self, transformation, candidates, stop_at=None):
+        """
+        Оценивает сходство с помощью LLM: пакетно, а при неудаче - попарно (с ранней
+        остановкой по stop_at). Возвращает (оценки, название движка).
+        """
+        if self.batch_compare and candidates:
+            scores = self._compare_batched(transformation, candidates)
+            if scores is not None:
+                return scores, 'llm_batch'
+        return self._compare_pairwise(transformation, candidates, stop_at), 'llm'
+
+    async def _acompare_llm(self, transformation, candidates, stop_at=None):
+        """Асинхронный вариант _compare_llm."""
+        if self.batch_compare and candidates:
+            scores = await self._acompare_batched(transformation, candidates)
+            if scores is not None:
+                return scores, 'llm_batch'
+        return await self._acompare_pairwise(transformation, candidates, stop_at), 'llm'
+
+    def _local_results(self, transformation, generated_list, stop_at):
+        """
+        Локальные оценки и индексы, которые нужно уточнить у LLM (только для hybrid).
+        Если надежная локальная оценка уже достигла stop_at, уточнять нечего: неоднозначные
+        оценки помечаются как пропущенные (None).
+        """
+        local_scores = local_similarity.similarity_scores(transformation, generated_list)
+        results = [(score, 'local') for score in local_scores]
+        if self.similarity_backend != 'hybrid':
+            return results, []
+
+        # Уточняем у LLM только оценки из неоднозначного диапазона
+        ambiguous = _ambiguous_indices(local_scores)
+        decided = [score for i, score in enumerate(local_scores) if i not in ambiguous]
+        if ambiguous and stop_at is not None and max(decided, default=0.0) >= stop_at:
+            for i in ambiguous:
+                results[i] = (None, 'local')
+            return results, []
+        return results, ambiguous
+
+    def _compare(self, transformation, generated_list, stop_at=None):
+        """
+        Оценивает сходство преобразования с каждым сгенерированным выбранным движком.
+        Возвращает список пар (оценка, движок, который ее получил); оценка None - сравнение
+        пропущено, потому что другая оценка уже достигла stop_at.
+        """
+        if self.similarity_backend == 'llm':
+            scores, backend = self._compare_llm(transformation, generated_list, stop_at)
+            return [(score, backend) for score in scores]
+
+        results, ambiguous = self._local_results(transformation, generated_list, stop_at)
+        if ambiguous:
+            llm_scores, backend = self._compare_llm(transformation, [generated_list[i] for i in ambiguous], stop_at)
+            for i, score in zip(ambiguous, llm_scores):
+                results[i] = (score, backend)
+        return results
+
+    async def _acompare(self, transformation, generated_list, stop_at=None):
+        """Асинхронный вариант _compare."""
+        if self.similarity_backend == 'llm':
+            scores, backend = await self._acompare_llm(transformation, generated_list, stop_at)
+            return [(score, backend) for score in scores]
+
+        results, ambiguous = self._local_results(transformation, generated_list, stop_at)
+        if ambiguous:
+            llm_scores, backend = await self._acompare_llm(
+                transformation, [generated_list[i] for i in ambiguous], stop_at
+            )
+            for i, score in zip(ambiguous, llm_scores):
+                results[i] = (score, backend)
+        return results
+
+    def _parse_generated(self, generated_result):
+        """Список сгенерированных банальных преобразований или None, если ответ не разобран."""
+        try:
+            generated_list = generated_result.generated_transformations
+            if isinstance(generated_list, str):
+                generated_list = json.loads(generated_list)
+        except (AttributeError, json.JSONDecodeError, TypeError):
+            #print(f"[DEBUG] Failed to generate or parse transformations. Output: {generated_result}")
+            return None
+        return generated_list
+
+    def _prediction(self, generated_list, compared):
+        similarity_scores = [  # Сохраняем все полученные оценки сходства и движок, который их получил
+            {'generated_transformation': gen_trans, 'similarity_score': similarity, 'backend': backend}
+            for gen_trans, (similarity, backend) in zip(generated_list, compared)
+            if similarity is not None
+        ]
+        max_similarity = max([0.0] + [s['similarity_score'] for s in similarity_scores])
         
         return dspy.Prediction(
             assessment=max_similarity, 
             generated_transformations=generated_list,
-            similarity_scores=similarity_scores
+            similarity_scores=similarity_scores,
+            early_stopped=len(similarity_scores) < len(compared)
+        )
+
+    def forward(self, initial_state, transformation, result, stop_at=None, generated=None):
+        """
+        stop_at - порог сходства, при достижении которого тройка заведомо банальна: оставшиеся
+        сравнения не выполняются, а assessment - нижняя граница максимального сходства.
+        generated - уже сгенерированные банальные преобразования (генерация не повторяется).
+        """
+        # Step 1: Generate banal transformations
+        if generated:
+            generated_list = generated
+        else:
+            with telemetry.stage_timer('banal_generate'), tracing.span('banal_generate'):
+                generated_result = self.generate(initial_state=initial_state, result=result, n=self.n)
+            generated_list = self._parse_generated(generated_result)
+        if generated_list is None:
+            return dspy.Prediction(assessment=0.0, generated_transformations=[], similarity_scores=[])
+
+        # Step 2: Compare the provided transformation with each generated one.
+        with telemetry.stage_timer('banal_compare'), tracing.span('banal_compare'):
+            compared = self._compare(transformation, generated_list, stop_at)
+        return self._prediction(generated_list, compared)
+
+    async def aforward(self, initial_state, transformation, result, stop_at=None, generated=None):
+        if generated:
+            generated_list = generated
+        else:
+            with telemetry.stage_timer('banal_generate'), tracing.span('banal_generate'):
+                generated_result = await self.generate.acall(initial_state=initial_state, result=result, n=self.n)
+            generated_list = self._parse_generated(generated_result)
+        if generated_list is None:
+            return dspy.Prediction(assessment=0.0, generated_transformations=[], similarity_scores=[])
+
+        with telemetry.stage_timer('banal_compare'), tracing.span('banal_compare'):
+            compared = await self._acompare(transformation, generated_list, stop_at)
+        return self._prediction(generated_list, compared)
+
+def _partial_fields(error) -> dict:
+    """
+    Поля, которые удалось выделить из ответа, не разобранного адаптером DSPy (AdapterParseError):
+    JSON-объект (JSONAdapter) или разделы [[ ## поле ## ]] (ChatAdapter). Значения не разбираются.
+    """
+    response = str(getattr(error, 'lm_response', '') or '')
+    try:
+        fields = json.loads(response[response.find('{'):response.rfind('}') + 1])
+        if isinstance(fields, dict):
+            return fields
+    except ValueError:
+        pass
+    sections = _FIELD_HEADER_RE.split(response)
+    return {name: value.strip() for name, value in zip(sections[1::2], sections[2::2])}
+
+class FusedBanalAssessor(BanalAssessor):
+    """
+    BanalAssessor с совмещенной оценкой (config.BANAL_FUSED_ASSESSMENT): генерация банальных
+    преобразований, оценки сходства с ними и, если causal_check, проверка каузальности - один
+    вызов LLM вместо 1 + n (+1). Если адаптер не разобрал ответ, из него берутся поля, которые
+    разбираются: не разобранные оценки сходства получаются отдельным сравнением, как в
+    BanalAssessor (пакетно, при неудаче - попарно), проверка каузальности - отдельным вызовом, а
+    без сгенерированных преобразований выполняется несовмещенная оценка. С готовыми generated -
+    только сравнение. Результат проверки каузальности - в поле causal_check предсказания (None,
+    если она выключена).
+    """
+    def __init__(self, n=3, causal_check=False):
+        super().__init__(n=n, batch_compare=True, similarity_backend='llm')
+        self.causal_check = causal_check
+        self.fused = dspy.Predict(AssessTripletFused if causal_check else AssessTripletFusedNoCausal)
+        self.causal = dspy.ChainOfThought(CausalRelationship) if causal_check else None
+
+    def _fused_scores(self, fused_result, generated_list):
+        """Оценки сходства из совмещенного ответа или None, если их нужно получить отдельным вызовом."""
+        if generated_list is None:
+            return None
+        scores = _parse_batch_scores(fused_result, len(generated_list))
+        return None if scores is None else [(score, 'fused') for score in scores]
+
+    def _causal_answered(self, fused_result):
+        return str(getattr(fused_result, 'is_causal', '')).strip().lower() in ('true', 'false')
+
+    def _with_causal(self, prediction, causal_result):
+        prediction.causal_check = _causal_details(causal_result) if self.causal_check else None
+        return prediction
+
+    def forward(self, initial_state, transformation, result, stop_at=None, generated=None):
+        if generated:
+            return super().forward(initial_state, transformation, result, stop_at, generated)
+        with telemetry.stage_timer('banal_fused'), tracing.span('banal_fused'):
+            try:
+                fused_result = self.fused(initial_state=initial_state, transformation=transformation, result=result, n=self.n)
+            except AdapterParseError as e:
+                fused_result = dspy.Prediction(**_partial_fields(e))
+
+        causal_result = fused_result
+        if self.causal_check and not self._causal_answered(fused_result):
+            with tracing.span('causal_check'):
+                causal_result = self.causal(initial_state=initial_state, result=result)
+
+        generated_list = self._parse_generated(fused_result)
+        if not generated_list:
+            prediction = super().forward(initial_state, transformation, result, stop_at)
+            return self._with_causal(prediction, causal_result)
+        compared = self._fused_scores(fused_result, generated_list)
+        if compared is None:
+            with telemetry.stage_timer('banal_compare'), tracing.span('banal_compare'):
+                compared = self._compare(transformation, generated_list, stop_at)
+        return self._with_causal(self._prediction(generated_list, compared), causal_result)
+
+    async def aforward(self, initial_state, transformation, result, stop_at=None, generated=None):
+        if generated:
+            return await super().aforward(initial_state, transformation, result, stop_at, generated)
+        with telemetry.stage_timer('banal_fused'), tracing.span('banal_fused'):
+            try:
+                fused_result = await self.fused.acall(
+                    initial_state=initial_state, transformation=transformation, result=result, n=self.n
+                )
+            except AdapterParseError as e:
+                fused_result = dspy.Prediction(**_partial_fields(e))
+
+        causal_result = fused_result
+        if self.causal_check and not self._causal_answered(fused_result):
+            with tracing.span('causal_check'):
+                causal_result = await self.causal.acall(initial_state=initial_state, result=result)
+
+        generated_list = self._parse_generated(fused_result)
+        if not generated_list:
+            prediction = await super().aforward(initial_state, transformation, result, stop_at)
+            return self._with_causal(prediction, causal_result)
+        compared = self._fused_scores(fused_result, generated_list)
+        if compared is None:
+            with telemetry.stage_timer('banal_compare'), tracing.span('banal_compare'):
+                compared = await self._acompare(transformation, generated_list, stop_at)
+        return self._with_causal(self._prediction(generated_list, compared), causal_result)
+
+def _causal_details(causal_result) -> dict:
+    try:
+        is_causal = str(causal_result.is_causal).strip().lower() == 'true'
+    except AttributeError:
+        is_causal = None
+    return {
+        'is_causal': is_causal,
+        'reasoning': getattr(causal_result, 'reasoning', '')
+    }
+
+def _check_causality(p, causal_predictor, causal_lm) -> dict:
+    """Проверяет, является ли result прямым следствием initial_state (на основной модели)."""
+    with dspy.context(lm=causal_lm), tracing.span('causal_check'):
+        causal_result = causal_predictor(
+            initial_state=p['initial_state'],
+            result=p['result']
+        )
+    return _causal_details(causal_result)
+
+async def _acheck_causality(p, causal_predictor, causal_lm) -> dict:
+    """Асинхронный вариант _check_causality."""
+    with dspy.context(lm=causal_lm), tracing.span('causal_check'):
+        causal_result = await causal_predictor.acall(
+            initial_state=p['initial_state'],
+            result=p['result']
+        )
+    return _causal_details(causal_result)
+
+def _assess_triplet(p, assess_banality, causal_predictor=None, causal_lm=None, stop_at=None, generated=None) -> dict:
+    """
+    Оценивает банальность одной тройки. Должна вызываться в контексте banal_lm.
+    Возвращает словарь с теми же ключами, что и элементы списка провалившихся троек banal_metric.
+
+    Если передан causal_predictor, параллельно с оценкой банальности выполняется проверка
+    причинно-следственной связи на модели causal_lm; ее результат - в ключе 'causal_check'.
+    stop_at - порог сходства для ранней остановки сравнений (см. BanalAssessor.forward).
+    generated - уже сгенерированные банальные преобразования (см. BanalAssessor.forward).
+    """
+    def assess():
+        # Используем специализированную модель (banal_lm) для оценки банальности
+        return assess_banality(
+            initial_state=p['initial_state'],
+            transformation=p['transformation'],
+            result=p['result'],
+            stop_at=stop_at,
+            generated=generated
         )
 
+    # === ОЦЕНКА БАНАЛЬНОСТИ И ПРИЧИННО-СЛЕДСТВЕННОЙ СВЯЗИ ===
+    if causal_predictor is not None:
+        result, causal_check = run_concurrently(assess, lambda: _check_causality(p, causal_predictor, causal_lm))
+    else:
+        result, causal_check = assess(), None
+
+    return _triplet_details(p, result, causal_check)
+
+async def _aassess_triplet(p, assess_banality, causal_predictor=None, causal_lm=None, stop_at=None,
+                           generated=None) -> dict:
+    """Асинхронный вариант _assess_triplet: генерация, сравнения и проверка каузальности без блокировок."""
+    assess = assess_banality.acall(
+        initial_state=p['initial_state'],
+        transformation=p['transformation'],
+        result=p['result'],
+        stop_at=stop_at,
+        generated=generated
+    )
+    if causal_predictor is not None:
+        result, causal_check = await asyncio.gather(assess, _acheck_causality(p, causal_predictor, causal_lm))
+    else:
+        result, causal_check = await assess, None
+
+    return _triplet_details(p, result, causal_check)
+
+def _triplet_details(p, result, causal_check) -> dict:
+    """Словарь с подробностями оценки тройки по результату BanalAssessor."""
+    if causal_check is None:
+        # FusedBanalAssessor проверяет каузальность в том же вызове
+        causal_check = getattr(result, 'causal_check', None)
+    assessment_value = result.assessment
+    banality_score = float(assessment_value) if not isinstance(assessment_value, str) else float(assessment_value.strip())
+
+    # Преобразуем оценку банальности в оценку небанальности (инвертируем)
+    # banality_score: 0.0 = не банально, 1.0 = очень банально
+    # non_banality_score: 1.0 = не банально, 0.0 = очень банально
+    non_banality_score = 1.0 - banality_score
+
+    return {
+        'initial_state': p['initial_state'],
+        'transformation': p['transformation'],
+        'result': p['result'],
+        'non_banality_score': non_banality_score,
+        'banality_score': banality_score,
+        'generated_banal_transformations': getattr(result, 'generated_transformations', []),
+        'similarity_scores': getattr(result, 'similarity_scores', []),
+        'max_similarity_score': banality_score,  # Это и есть максимальная схожесть
+        'causal_check': causal_check,
+        'decision_path': 'llm',
+        # Сравнения остановлены досрочно: banality_score - нижняя граница максимального сходства
+        'early_stopped': bool(getattr(result, 'early_stopped', False))
+    }
+
+def _banality_assessor(n, causal_predictor, causal_lm, similarity_backend=None):
+    """
+    Оценщик банальности и параметры отдельной проверки каузальности для _assess_triplet. При
+    config.BANAL_FUSED_ASSESSMENT - FusedBanalAssessor, проверяющий каузальность в том же вызове
+    (на banal-модели), поэтому отдельной проверки нет. Явно заданный similarity_backend
+    отключает совмещенную оценку.
+    """
+    if similarity_backend is not None:
+        return BanalAssessor(n=n, similarity_backend=similarity_backend), causal_predictor, causal_lm
+    if config.BANAL_FUSED_ASSESSMENT:
+        return FusedBanalAssessor(n=n, causal_check=causal_predictor is not None), None, None
+    return BanalAssessor(n=n), causal_predictor, causal_lm
+
+def _banal_tiers(tiers=None):
+    """Уровни оценки банальности (config.BANAL_TIERS) или None, если уровневая оценка выключена."""
+    if tiers is None and config.TIERED_ASSESSMENT:
+        tiers = config.BANAL_TIERS
+    return tiers or None
+
+def _tier_setup(tier, n, first, causal_predictor, causal_lm):
+    """
+    Оценщик, LM и параметры вызова уровня: LOCAL - генерация на banal_lm и локальное сходство,
+    модель - генерация и сравнения на ней. Каузальность проверяется только на первом уровне.
+    """
+    causal = (causal_predictor, causal_lm) if first else (None, None)
+    if tier == LOCAL:
+        return BanalAssessor(n=n, similarity_backend='local'), dspy.settings.banal_lm, causal
+    if config.BANAL_FUSED_ASSESSMENT:
+        return FusedBanalAssessor(n=n, causal_check=causal[0] is not None), tier_lm(tier), (None, None)
+    return BanalAssessor(n=n, similarity_backend='llm'), tier_lm(tier), causal
+
+def _tier_step(previous, lm, stop_at, threshold, last):
+    """
+    Порог ранней остановки и переиспользуемые банальные преобразования уровня. Не последний
+    уровень останавливается, только когда связка банальна с запасом в полосу эскалации;
+    генерация переиспользуется, если ее выполнила та же модель.
+    """
+    if stop_at is not None and not last:
+        stop_at = min(1.0, 1.0 - threshold + config.TIER_ESCALATION_BAND)
+    generated = None
+    if previous is not None and previous[1] == lm.model:
+        generated = previous[0]['generated_banal_transformations'] or None
+    return stop_at, generated
+
+def _assess_tiered(triplet, n, tiers, threshold, stop_at, causal_predictor, causal_lm) -> dict:
+    """
+    Уровневая оценка банальности (modules.tiers): следующий уровень вызывается, только если
+    небанальность попала в полосу около threshold. В подробностях 'tier' - решивший уровень,
+    'tier_scores' - небанальность на каждом выполненном уровне.
+    """
+    def assess(tier, previous):
+        last = tier == tiers[-1]
+        assessor, lm, causal = _tier_setup(tier, n, previous is None, causal_predictor, causal_lm)
+        tier_stop_at, generated = _tier_step(previous, lm, stop_at, threshold, last)
+        with dspy.context(lm=lm):
+            details = _assess_triplet(triplet, assessor, *causal, tier_stop_at, generated)
+        if previous is not None:
+            details['causal_check'] = previous[0]['causal_check']
+        return details, lm.model
+
+    (details, _), path = route('banality', tiers, assess, lambda result: result[0]['non_banality_score'], threshold)
+    return dict(details, tier=path[-1]['tier'], tier_scores=path)
+
+async def _aassess_tiered(triplet, n, tiers, threshold, stop_at, causal_predictor, causal_lm) -> dict:
+    """Асинхронный вариант _assess_tiered."""
+    async def assess(tier, previous):
+        last = tier == tiers[-1]
+        assessor, lm, causal = _tier_setup(tier, n, previous is None, causal_predictor, causal_lm)
+        tier_stop_at, generated = _tier_step(previous, lm, stop_at, threshold, last)
+        with dspy.context(lm=lm):
+            details = await _aassess_triplet(triplet, assessor, *causal, tier_stop_at, generated)
+        if previous is not None:
+            details['causal_check'] = previous[0]['causal_check']
+        return details, lm.model
+
+    (details, _), path = await aroute(
+        'banality', tiers, assess, lambda result: result[0]['non_banality_score'], threshold
+    )
+    return dict(details, tier=path[-1]['tier'], tier_scores=path)
+
+def _prefilter(triplet, enabled=None):
+    """Решение локального фильтра (prefilter_triplet) или None, если фильтр выключен."""
+    if enabled is None:
+        enabled = config.BANAL_PREFILTER_ENABLED
+    return prefilter_triplet(triplet) if enabled else None
+
+def _prefiltered_details(triplet, prefilter) -> dict:
+    """Подробности для тройки, решение по которой принял локальный фильтр (без вызовов LLM)."""
+    banality_score = 0.0 if prefilter['decision'] == NON_BANAL else 1.0
+    return {
+        'initial_state': triplet.get('initial_state'),
+        'transformation': triplet.get('transformation'),
+        'result': triplet.get('result'),
+        'non_banality_score': 1.0 - banality_score,
+        'banality_score': banality_score,
+        'generated_banal_transformations': [],
+        'similarity_scores': [],
+        'max_similarity_score': banality_score,
+        'causal_check': None,
+        'decision_path': 'prefilter',
+        'early_stopped': False,
+        'prefilter': prefilter
+    }
+
+def _causal_stage(enabled=None):
+    """Предиктор и модель (основная) для проверки каузальности или (None, None), если стадия выключена."""
+    if enabled is None:
+        enabled = config.CAUSAL_CHECK_ENABLED
+    if not enabled:
+        return None, None
+    return dspy.ChainOfThought(CausalRelationship), dspy.settings.lm
+
+def _failed_details(triplet, error) -> dict:
+    logger.warning('Оценка банальности не удалась, небанальность 0.0: %s', error)
+    return {
+        'initial_state': triplet.get('initial_state'),
+        'transformation': triplet.get('transformation'),
+        'result': triplet.get('result'),
+        'non_banality_score': 0.0,
+        'banality_score': 1.0,
+        'generated_banal_transformations': [],
+        'similarity_scores': [],
+        'max_similarity_score': 1.0,
+        'causal_check': None,
+        'decision_path': 'llm',
+        'early_stopped': False,
+        'error': str(error)
+    }
+
+def prefilter_banality(triplet, decision=None):
+    """
+    Подробности оценки локальным фильтром или None, если случай неочевиден или фильтр выключен.
+    decision - уже полученное решение фильтра (prefilter_triplet), чтобы не проверять тройку повторно.
+    """
+    if decision is None:
+        decision = _prefilter(triplet)
+    if decision is None or decision['decision'] is None:
+        return None
+    return _prefiltered_details(triplet, decision)
+
+def assess_triplet_banality(triplet, n=3, prefilter=None, stop_at=None, causal_check=None, threshold=None,
+                            tiers=None, similarity_backend=None) -> dict:
+    """
+    Оценивает банальность одной тройки и возвращает подробности независимо от результата.
+
+    Ключи результата совпадают с элементами списка провалившихся троек banal_metric(return_details=True).
+    Если оценить тройку не удалось, небанальность считается равной 0.0, а причина
+    сохраняется в ключе 'error'.
+
+    Сначала тройку проверяет локальный фильтр (prefilter, по умолчанию config.BANAL_PREFILTER_ENABLED):
+    очевидные случаи получают оценку 0.0 или 1.0 без вызовов LLM. Кто принял решение,
+    записано в 'decision_path' ('prefilter' или 'llm') и 'prefilter'.
+
+    stop_at - порог сходства, начиная с которого тройка заведомо банальна (1 - порог банальности):
+    оставшиеся сравнения не выполняются, а в подробностях выставляется 'early_stopped'.
+    causal_check - проверять ли причинно-следственную связь (по умолчанию config.CAUSAL_CHECK_ENABLED).
+
+    tiers - уровни оценки (по умолчанию config.BANAL_TIERS, если включена config.TIERED_ASSESSMENT):
+    следующий уровень вызывается, только если небанальность ближе config.TIER_ESCALATION_BAND к
+    threshold (по умолчанию config.BANAL_THRESHOLD); пустой список - без уровней. Решивший
+    уровень - в 'tier', небанальность на каждом уровне - в 'tier_scores'.
+
+    similarity_backend - движок сходства вместо config.BANAL_SIMILARITY_BACKEND (и вместо
+    совмещенной оценки config.BANAL_FUSED_ASSESSMENT), например 'local' для упрощенной оценки.
+
+    DeadlineExceeded (оценка не успевает до срока запроса) пробрасывается: тройка не оценена,
+    а не банальна.
+    """
+    decision = _prefilter(triplet, prefilter)
+    if decision is not None and decision['decision'] is not None:
+        return _prefiltered_details(triplet, decision)
+
+    causal_predictor, causal_lm = _causal_stage(causal_check)
+    tiers = _banal_tiers(tiers)
+    threshold = config.BANAL_THRESHOLD if threshold is None else threshold
+    try:
+        if tiers:
+            details = _assess_tiered(triplet, n, tiers, threshold, stop_at, causal_predictor, causal_lm)
+        else:
+            with dspy.context(lm=dspy.settings.banal_lm):
+                details = _assess_triplet(
+                    triplet, *_banality_assessor(n, causal_predictor, causal_lm, similarity_backend), stop_at
+                )
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        details = _failed_details(triplet, e)
+    return dict(details, prefilter=decision)
+
+async def aassess_triplet_banality(triplet, n=3, prefilter=None, stop_at=None, causal_check=None, threshold=None,
+                                  tiers=None, similarity_backend=None) -> dict:
+    """Асинхронный вариант assess_triplet_banality (через асинхронные вызовы LM в DSPy)."""
+    decision = _prefilter(triplet, prefilter)
+    if decision is not None and decision['decision'] is not None:
+        return _prefiltered_details(triplet, decision)
+
+    causal_predictor, causal_lm = _causal_stage(causal_check)
+    tiers = _banal_tiers(tiers)
+    threshold = config.BANAL_THRESHOLD if threshold is None else threshold
+    try:
+        if tiers:
+            details = await _aassess_tiered(triplet, n, tiers, threshold, stop_at, causal_predictor, causal_lm)
+        else:
+            with dspy.context(lm=dspy.settings.banal_lm):
+                details = await _aassess_triplet(
+                    triplet, *_banality_assessor(n, causal_predictor, causal_lm, similarity_backend), stop_at
+                )
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        details = _failed_details(triplet, e)
+    return dict(details, prefilter=decision)
+
 def banal_metric(pred, trace=None, return_details=False) -> Union[float, Tuple[float, List[dict]]]:
     """
     Проверяет, что преобразования не являются банальными, используя языковую модель.
     
     Функция оценивает каждое преобразование на предмет банальности, сравнивая его с 
-    автоматически сгенерированными "банальными" преобразованиями. Также проводится
-    оценка причинно-следственных связей.
+    автоматически сгенерированными "банальными" преобразованиями. Если включена
+    config.CAUSAL_CHECK_ENABLED, параллельно проводится оценка причинно-следственных связей.
+    При config.BANAL_FUSED_ASSESSMENT генерация, сравнения и проверка каузальности выполняются
+    одним вызовом LLM на тройку (FusedBanalAssessor) с теми же подробностями результата.
+    Если включена config.TIERED_ASSESSMENT, тройку сначала оценивает дешевый уровень
+    (config.BANAL_TIERS), а сильный - только при оценке около config.BANAL_THRESHOLD.
     
     Args:
         pred: Объект Prediction, содержащий список преобразований
@@ -96,7 +723,10 @@ def banal_metric(pred, trace=None, return_details=False) -> Union[float, Tuple[f
              - Если return_details=True: кортеж (средняя_оценка, список_провалившихся_троек)
                где список_провалившихся_троек содержит словари с ключами:
                'initial_state', 'transformation', 'result', 'non_banality_score', 'banality_score',
-               'generated_banal_transformations', 'similarity_scores', 'max_similarity_score'
+               'generated_banal_transformations', 'similarity_scores', 'max_similarity_score',
+               'causal_check' (None, если проверка каузальности выключена),
+               'decision_path' ('prefilter' или 'llm') и 'prefilter' (решение локального фильтра или None);
+               при уровневой оценке также 'tier' и 'tier_scores'
     
     Note:
         Функция совместима с DSPy при использовании с параметром return_details=False (по умолчанию).
@@ -123,11 +753,14 @@ def banal_metric(pred, trace=None, return_details=False) -> Union[float, Tuple[f
     # Предполагается, что LM настроена глобально, например в main.py
     # dspy.configure(lm=dspy.LM(model=..., api_key=...))
     
-    # Оценка причинно-следственной связи с помощью основной модели (вне контекста banal_lm)
-    causal_predictor = dspy.ChainOfThought(CausalRelationship)
+    # Оценка причинно-следственной связи с помощью основной модели (вне контекста banal_lm),
+    # только если стадия включена (config.CAUSAL_CHECK_ENABLED)
+    causal_predictor, causal_lm = _causal_stage()
+    tiers = _banal_tiers()
     
     with dspy.context(lm=dspy.settings.banal_lm):
-        assess_banality = BanalAssessor(n=3)
+        # При config.BANAL_FUSED_ASSESSMENT каузальность проверяется в вызове assess_banality
+        assess_banality, assess_causal, assess_causal_lm = _banality_assessor(3, causal_predictor, causal_lm)
         total_non_banality = 0.0
         num_items = 0
         failed_triplets = []  # Список троек, не прошедших порог банальности
@@ -140,39 +773,18 @@ def banal_metric(pred, trace=None, return_details=False) -> Union[float, Tuple[f
                 
                 num_items += 1
                 
-                # === ОЦЕНКА ПРИЧИННО-СЛЕДСТВЕННОЙ СВЯЗИ ===
-                # Используем основную модель (вне контекста banal_lm) для оценки каузальности
-                causal_result = causal_predictor(
-                    initial_state=p['initial_state'],
-                    result=p['result']
-                )
-
-                """
-                try:
-                    is_causal_bool = (str(causal_result.is_causal).lower() == 'true')
-                    if is_causal_bool:
-                        print(f"✅ Causal (MAIN_MODEL): {p['transformation']} (Reason: {causal_result.reasoning})")
-                    else:
-                        print(f"❌ Not Causal (MAIN_MODEL): {p['transformation']} (Reason: {causal_result.reasoning})")
-                except (ValueError, TypeError, AttributeError):
-                    print(f"[DEBUG] Could not parse causal result: {getattr(causal_result, 'is_causal', 'N/A')}")
-                """
-
-                # === ОЦЕНКА БАНАЛЬНОСТИ ===
-                # Используем специализированную модель (banal_lm) для оценки банальности
-                result = assess_banality(
-                    initial_state=p['initial_state'],
-                    transformation=p['transformation'],
-                    result=p['result']
-                )
-
-                assessment_value = result.assessment
-                banality_score = float(assessment_value) if not isinstance(assessment_value, str) else float(assessment_value.strip())
-
-                # Преобразуем оценку банальности в оценку небанальности (инвертируем)
-                # banality_score: 0.0 = не банально, 1.0 = очень банально
-                # non_banality_score: 1.0 = не банально, 0.0 = очень банально
-                non_banality_score = 1.0 - banality_score
+                # Очевидные случаи решает локальный фильтр, без вызовов LLM
+                prefilter = _prefilter(p)
+                if prefilter is not None and prefilter['decision'] is not None:
+                    details = _prefiltered_details(p, prefilter)
+                elif tiers:
+                    details = dict(
+                        _assess_tiered(p, 3, tiers, config.BANAL_THRESHOLD, None, causal_predictor, causal_lm),
+                        prefilter=prefilter
+                    )
+                else:
+                    details = dict(_assess_triplet(p, assess_banality, assess_causal, assess_causal_lm), prefilter=prefilter)
+                non_banality_score = details['non_banality_score']
                 total_non_banality += non_banality_score
 
                 # === ОБРАБОТКА РЕЗУЛЬТАТОВ ===
@@ -183,25 +795,13 @@ def banal_metric(pred, trace=None, return_details=False) -> Union[float, Tuple[f
                     print("Transformation: ", p['transformation'])
                     print("Result: ", p['result'])
                     print(f"######### [НЕБАНАЛЬНОСТЬ > 0.6] Transformation: {p['transformation']} (небанальность: {non_banality_score:.2f})")
-                else:
-                    # Тройка НЕ прошла проверку на банальность
-                    # Если запрошены детали, сохраняем информацию о провалившейся тройке
-                    if return_details:
-                        # Извлекаем информацию о сгенерированных банальных преобразованиях
-                        generated_transformations = getattr(result, 'generated_transformations', [])
-                        similarity_scores = getattr(result, 'similarity_scores', [])
-                        
-                        failed_triplets.append({
-                            'initial_state': p['initial_state'],
-                            'transformation': p['transformation'],
-                            'result': p['result'],
-                            'non_banality_score': non_banality_score,
-                            'banality_score': banality_score,
-                            'generated_banal_transformations': generated_transformations,
-                            'similarity_scores': similarity_scores,
-                            'max_similarity_score': banality_score  # Это и есть максимальная схожесть
-                        })
+                elif return_details:
+                    # Тройка НЕ прошла проверку на банальность - сохраняем информацию о ней
+                    failed_triplets.append(details)
                         
+            except DeadlineExceeded:
+                # Тройка не оценена до срока запроса, а не банальна
+                raise
             except (ValueError, TypeError, AttributeError, Exception) as e:
                 print(f"[DEBUG] An exception occurred in the banality assessment loop: {e}. Assigning 0.0 non-banality.")
                 total_non_banality += 0.0
@@ -243,7 +843,13 @@ def get_banal_metric_with_details(pred, trace=None) -> Tuple[float, List[dict]]:
                 * 'banality_score': оценка банальности (0.0-1.0)
                 * 'generated_banal_transformations': список сгенерированных банальных преобразований
                 * 'similarity_scores': список с оценками сходства для каждого сгенерированного преобразования
+                  и движком, который получил оценку ('backend': 'local', 'llm', 'llm_batch' или 'fused')
                 * 'max_similarity_score': максимальная оценка сходства (= banality_score)
+                * 'causal_check': {'is_causal', 'reasoning'} или None, если проверка выключена
+                * 'decision_path': 'prefilter', если оценку без LLM поставил локальный фильтр, иначе 'llm'
+                * 'prefilter': {'decision', 'restatement_score', 'reason'} или None, если фильтр выключен
+                * 'tier', 'tier_scores': решивший уровень и [{'tier', 'score'}] по уровням
+                  (только при config.TIERED_ASSESSMENT)
     
     Example:
         >>> score, failed = get_banal_metric_with_details(prediction)
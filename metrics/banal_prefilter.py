@@ -0,0 +1,83 @@
+"""
+Дешевый локальный предварительный фильтр банальности.
+
+Очевидно банальные связки - те, где преобразование в основном пересказывает слова
+начального состояния и результата - отсеиваются без вызовов LLM. Неочевидные случаи
+передаются BanalAssessor.
+"""
+
+import re
+
+import config
+from modules.dedup import STEM_LENGTH
+
+_WORD_RE = re.compile(r'\w+')
+
+# Служебные слова и глаголы изменения не считаются содержательными
+_STOPWORDS = frozenset("""
+и в во не что он на я с со как а то все она так его но да ты к у же вы за бы по только ее мне было
+вот от меня еще нет о из ему теперь когда даже ну вдруг ли если уже или ни быть был него до вас
+нибудь опять уж вам ведь там потом себя ничего ей может они тут где есть надо ней для мы тебя их
+чем была сам чтоб без будто чего раз тоже себе под будет ж тогда кто этот того потому этого какой
+совсем ним здесь этом один почти мой тем чтобы нее сейчас были куда зачем всех никогда можно при
+наконец два об другой хоть после над больше тот через эти нас про всего них какая много разве три
+эту моя впрочем хорошо свою этой перед иногда лучше чуть том нельзя такой им более всегда конечно
+всю между это также свой своей свои своих является являются
+the a an of to in on for and or is are was were be by with as at from that this it its into
+становится становятся стал стала стало стали станет станут превращается превращаются
+меняется меняются изменяется изменяются becomes become became turns changes
+""".split())
+
+# Решения фильтра
+BANAL = 'banal'
+NON_BANAL = 'non_banal'
+
+
+def content_stems(value):
+    """Содержательные слова текста, сокращенные до первых STEM_LENGTH букв."""
+    return frozenset(
+        word[:STEM_LENGTH] for word in _WORD_RE.findall(str(value).lower())
+        if word not in _STOPWORDS and not word.isdigit()
+    )
+
+
+def restatement_score(triplet):
+    """
+    Доля содержательных слов преобразования, которые уже есть в начальном состоянии или
+    результате (1.0 - преобразование целиком пересказывает их; пустое преобразование - 1.0).
+    """
+    transformation = content_stems(triplet.get('transformation', ''))
+    if not transformation:
+        return 1.0
+    context = content_stems(triplet.get('initial_state', '')) | content_stems(triplet.get('result', ''))
+    return len(transformation & context) / len(transformation)
+
+
+def prefilter_triplet(triplet,
+                      banal_overlap=config.BANAL_PREFILTER_BANAL_OVERLAP,
+                      accept_overlap=config.BANAL_PREFILTER_ACCEPT_OVERLAP,
+                      accept_min_words=config.BANAL_PREFILTER_ACCEPT_MIN_WORDS):
+    """
+    Локальное решение по связке: {'decision', 'restatement_score', 'reason'}.
+
+    decision:
+    - 'banal' - доля пересказа не ниже banal_overlap;
+    - 'non_banal' - доля пересказа не выше accept_overlap, а в преобразовании не меньше
+      accept_min_words содержательных слов (accept_overlap < 0 отключает это правило);
+    - None - случай неочевидный, решает LLM.
+    """
+    score = restatement_score(triplet)
+    if score >= banal_overlap:
+        return {
+            'decision': BANAL,
+            'restatement_score': score,
+            'reason': f'преобразование пересказывает начальное состояние и результат ({score:.2f} >= {banal_overlap})'
+        }
+    words = len(content_stems(triplet.get('transformation', '')))
+    if score <= accept_overlap and words >= accept_min_words:
+        return {
+            'decision': NON_BANAL,
+            'restatement_score': score,
+            'reason': f'развернутое преобразование ({words} слов) без пересказа ({score:.2f} <= {accept_overlap})'
+        }
+    return {'decision': None, 'restatement_score': score, 'reason': 'неочевидный случай'}
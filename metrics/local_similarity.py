@@ -0,0 +1,57 @@
+import re
+import zlib
+from typing import List
+
+import numpy as np
+
+# Размерность хешированного пространства символьных n-грамм
+HASH_DIM = 2 ** 14
+NGRAM_RANGE = (3, 5)
+
+
+def _char_ngrams(text: str, ngram_range=NGRAM_RANGE) -> List[str]:
+    """Символьные n-граммы нормализованного текста (с границами слов)."""
+    normalized = " " + re.sub(r"\s+", " ", text.lower()).strip() + " "
+    low, high = ngram_range
+    return [
+        normalized[i:i + n]
+        for n in range(low, high + 1)
+        for i in range(len(normalized) - n + 1)
+    ]
+
+
+def _hashed_counts(texts: List[str]) -> np.ndarray:
+    """Матрица частот хешированных n-грамм: строка на текст."""
+    matrix = np.zeros((len(texts), HASH_DIM), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for ngram in _char_ngrams(text):
+            # crc32 вместо hash(): результат не зависит от PYTHONHASHSEED и одинаков во всех воркерах
+            matrix[row, zlib.crc32(ngram.encode("utf-8")) % HASH_DIM] += 1.0
+    return matrix
+
+
+def tfidf_matrix(texts: List[str]) -> np.ndarray:
+    """
+    TF-IDF векторы символьных n-грамм для набора текстов, нормированные по L2.
+    IDF считается по самому набору (сглаженный, как в scikit-learn).
+    """
+    counts = _hashed_counts(texts)
+    tf = np.log1p(counts)
+    df = np.count_nonzero(counts, axis=0)
+    idf = np.log((1.0 + len(texts)) / (1.0 + df)) + 1.0
+    weighted = tf * idf
+    norms = np.linalg.norm(weighted, axis=1, keepdims=True)
+    norms[norms == 0.0] = 1.0
+    return weighted / norms
+
+
+def similarity_scores(transformation: str, candidates: List[str]) -> List[float]:
+    """
+    Косинусное сходство transformation с каждым из candidates (от 0.0 до 1.0).
+    Все векторы строятся одной матрицей, сходства - одним матричным умножением.
+    """
+    if not candidates:
+        return []
+    vectors = tfidf_matrix([transformation] + list(candidates))
+    scores = vectors[1:] @ vectors[0]
+    return [float(min(max(score, 0.0), 1.0)) for score in scores]
@@ -0,0 +1,249 @@
+"""
+Каскад стадий фильтрации с ранней остановкой.
+
+Стадия описывается оценкой стоимости (в вызовах LLM) и предикатом отсева. Каскад выполняет
+стадии по возрастанию стоимости на единицу вероятности отсева (дешевые и избирательные -
+раньше), с учетом зависимостей между стадиями, и останавливается на первой стадии, которая
+отсеяла элемент. Для каждой стадии ведется статистика запусков, отсевов и времени; при
+достаточном числе запусков порядок строится по измеренной доле отсева.
+
+Если задан срок (modules.deadline), стадия, которая по оценке времени не успевает до него,
+заменяется упрощенным вариантом (если он есть) или не выполняется вместе со всеми
+следующими: каскад возвращает состояние без отсева, а невыполненные стадии видны по done.
+Упрощенный вариант годится только для отсева: если он элемент не отсеял, следующие стадии
+не выполняются (их результат опирался бы на неполную оценку).
+"""
+
+import math
+import threading
+import time
+
+import config
+from modules import telemetry, tracing
+from modules.deadline import DeadlineExceeded
+
+# Суффикс имени упрощенного варианта стадии в статистике, метриках и трассировке
+DEGRADED_SUFFIX = '_degraded'
+
+
+class Stage:
+    """
+    Стадия каскада.
+
+    - run(state) -> новое состояние; arun - асинхронный вариант (если None, вызывается run)
+    - cost - оценка стоимости стадии (в вызовах LLM)
+    - rejects(state) -> True, если после стадии элемент отсеян (None - стадия не отсеивает)
+    - done(state) -> True, если стадия уже выполнена (например, в ранее полученном отчете)
+    - requires - имена стадий, которые должны выполниться раньше
+    - rejection_rate - ожидаемая доля отсева до накопления статистики
+    - degraded, adegraded, degraded_cost - упрощенный вариант стадии, который выполняется
+      вместо нее, если до срока запроса не успевает полная стадия
+    """
+
+    def __init__(self, name, run, cost, rejects=None, done=None, requires=(), rejection_rate=0.0, arun=None,
+                 degraded=None, adegraded=None, degraded_cost=None):
+        self.name = name
+        self.run = run
+        self.arun = arun
+        self.cost = cost
+        self.rejects = rejects
+        self.done = done
+        self.requires = tuple(requires)
+        self.rejection_rate = rejection_rate
+        self.degraded = degraded
+        self.adegraded = adegraded
+        self.degraded_cost = degraded_cost
+
+    def is_done(self, state):
+        return self.done is not None and self.done(state)
+
+    def is_rejected(self, state):
+        return self.rejects is not None and self.rejects(state)
+
+
+class CascadeStats:
+    """Потокобезопасная статистика стадий: запуски, отсевы, суммарное время."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+
+    def record(self, name, rejected, seconds):
+        with self._lock:
+            stage = self._stages.setdefault(name, {'runs': 0, 'rejections': 0, 'seconds': 0.0})
+            stage['runs'] += 1
+            stage['rejections'] += int(rejected)
+            stage['seconds'] += seconds
+
+    def rejection_rate(self, name, min_runs):
+        """Измеренная доля отсева или None, если запусков меньше min_runs."""
+        with self._lock:
+            stage = self._stages.get(name)
+            if stage is None or stage['runs'] < min_runs:
+                return None
+            return stage['rejections'] / stage['runs']
+
+    def mean_seconds(self, name, min_runs):
+        """Среднее время стадии или None, если запусков меньше min_runs."""
+        with self._lock:
+            stage = self._stages.get(name)
+            if stage is None or stage['runs'] < min_runs:
+                return None
+            return stage['seconds'] / stage['runs']
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                name: {
+                    'runs': stage['runs'],
+                    'rejections': stage['rejections'],
+                    'rejection_rate': stage['rejections'] / stage['runs'],
+                    'mean_seconds': stage['seconds'] / stage['runs'],
+                }
+                for name, stage in self._stages.items()
+            }
+
+
+_cascade_stats = CascadeStats()
+
+
+def get_cascade_stats():
+    """Общая для процесса статистика стадий каскада."""
+    return _cascade_stats
+
+
+def order_stages(stages, stats=None, min_runs=config.CASCADE_MIN_RUNS):
+    """
+    Порядок выполнения: из стадий, зависимости которых уже выполнены, следующей берется
+    стадия с наименьшим cost / доля отсева (стадии без отсева - в конце, в исходном порядке).
+    """
+    def rank(stage):
+        rate = stats.rejection_rate(stage.name, min_runs) if stats is not None else None
+        if rate is None:
+            rate = stage.rejection_rate
+        if stage.rejects is None or rate <= 0:
+            return math.inf
+        return stage.cost / rate
+
+    remaining = list(stages)
+    ordered = []
+    placed = set()
+    while remaining:
+        ready = [s for s in remaining if all(r in placed for r in s.requires)]
+        if not ready:
+            raise ValueError(f"Циклические или неизвестные зависимости стадий: {[s.name for s in remaining]}")
+        best = min(ready, key=lambda s: (rank(s), remaining.index(s)))
+        ordered.append(best)
+        placed.add(best.name)
+        remaining.remove(best)
+    return ordered
+
+
+class Cascade:
+    """
+    Выполняет стадии над состоянием до первого отсева.
+
+    run() и arun() возвращают (состояние, имя отсеявшей стадии или None). before_stage(name)
+    вызывается перед каждой выполняемой стадией (например, для отмены), after_stage(name, state) -
+    после нее. Уже выполненные стадии (done) не запускаются, но их отсев учитывается.
+
+    deadline (modules.deadline.Deadline) - срок: стадии, не успевающие до него, упрощаются или
+    пропускаются вместе со следующими (как и стадия, прерванная DeadlineExceeded). После
+    упрощенного варианта, не отсеявшего элемент, каскад останавливается.
+    """
+
+    def __init__(self, stages, stats=None):
+        self.stages = order_stages(stages, stats if config.CASCADE_ADAPTIVE_ORDER else None)
+        self.stats = stats
+
+    @staticmethod
+    def _annotate(span, stage, state):
+        if span is not None:
+            span.set(rejected=stage.is_rejected(state))
+
+    def _finish(self, name, stage, state, started):
+        rejected = stage.is_rejected(state)
+        seconds = time.perf_counter() - started
+        if self.stats is not None:
+            self.stats.record(name, rejected, seconds)
+        telemetry.record_stage(name, seconds, rejected)
+        return rejected
+
+    def estimate(self, name, cost):
+        """Ожидаемое время стадии: среднее по статистике или cost вызовов LLM по DEADLINE_LLM_CALL_SECONDS."""
+        seconds = self.stats.mean_seconds(name, config.CASCADE_MIN_RUNS) if self.stats is not None else None
+        return seconds if seconds is not None else cost * config.DEADLINE_LLM_CALL_SECONDS
+
+    def _plan(self, stage, deadline):
+        """
+        Что выполнить в пределах срока: (имя, run, arun) полной стадии или ее упрощенного
+        варианта; None - не успевает ни то, ни другое.
+        """
+        if deadline is None or deadline.allows(self.estimate(stage.name, stage.cost)):
+            return stage.name, stage.run, stage.arun
+        name = stage.name + DEGRADED_SUFFIX
+        if stage.degraded is not None and deadline.allows(self.estimate(name, stage.degraded_cost)):
+            telemetry.record_stage_deadline(stage.name, 'degraded')
+            return name, stage.degraded, stage.adegraded
+        telemetry.record_stage_deadline(stage.name, 'skipped')
+        return None
+
+    def run(self, state, before_stage=None, after_stage=None, deadline=None):
+        for stage in self.stages:
+            if stage.is_done(state):
+                if stage.is_rejected(state):
+                    return state, stage.name
+                continue
+            plan = self._plan(stage, deadline)
+            if plan is None:
+                return state, None
+            name, run, _ = plan
+            if before_stage is not None:
+                before_stage(stage.name)
+            started = time.perf_counter()
+            try:
+                with tracing.span(name) as span:
+                    state = run(state)
+                    self._annotate(span, stage, state)
+            except DeadlineExceeded:
+                telemetry.record_stage_deadline(stage.name, 'skipped')
+                return state, None
+            rejected = self._finish(name, stage, state, started)
+            if after_stage is not None:
+                after_stage(stage.name, state)
+            if rejected:
+                return state, stage.name
+            if name != stage.name:
+                # Упрощенный вариант не отсеял элемент: решения нет, дальше не идем
+                return state, None
+        return state, None
+
+    async def arun(self, state, before_stage=None, after_stage=None, deadline=None):
+        for stage in self.stages:
+            if stage.is_done(state):
+                if stage.is_rejected(state):
+                    return state, stage.name
+                continue
+            plan = self._plan(stage, deadline)
+            if plan is None:
+                return state, None
+            name, run, arun = plan
+            if before_stage is not None:
+                before_stage(stage.name)
+            started = time.perf_counter()
+            try:
+                with tracing.span(name) as span:
+                    state = await arun(state) if arun is not None else run(state)
+                    self._annotate(span, stage, state)
+            except DeadlineExceeded:
+                telemetry.record_stage_deadline(stage.name, 'skipped')
+                return state, None
+            rejected = self._finish(name, stage, state, started)
+            if after_stage is not None:
+                after_stage(stage.name, state)
+            if rejected:
+                return state, stage.name
+            if name != stage.name:
+                # Упрощенный вариант не отсеял элемент: решения нет, дальше не идем
+                return state, None
+        return state, None
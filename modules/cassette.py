@@ -0,0 +1,69 @@
+"""
+Кассета ответов LM для записи и воспроизведения без сети (LM_BACKEND=record | replay).
+
+Кассета - файл JSONL: одна строка на запрос {'key', 'model', 'outputs', 'usage', 'seconds'},
+где key - тот же ключ, что и у общего кэша ответов (модель, параметры генерации и сообщения).
+При повторной записи того же ключа действует последняя строка.
+"""
+
+import json
+import os
+import threading
+
+
+class CassetteMissError(LookupError):
+    """В кассете нет ответа на запрос (воспроизведение без записи этого запроса)."""
+
+
+class Cassette:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = None
+
+    def _load(self):
+        entries = {}
+        if os.path.exists(self.path):
+            with open(self.path, encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        entry = json.loads(line)
+                        entries[entry['key']] = entry
+        return entries
+
+    def _loaded(self):
+        with self._lock:
+            if self._entries is None:
+                self._entries = self._load()
+            return self._entries
+
+    def __len__(self):
+        return len(self._loaded())
+
+    def get(self, key):
+        """Запись для ключа; CassetteMissError, если запрос не записывался."""
+        entry = self._loaded().get(key)
+        if entry is None:
+            raise CassetteMissError(
+                f"В кассете {self.path} нет ответа на запрос {key[:12]}. "
+                "Запишите его с LM_BACKEND=record"
+            )
+        return entry
+
+    def record(self, key, model, outputs, usage=None, seconds=None):
+        entry = {'key': key, 'model': model, 'outputs': outputs, 'usage': usage or {}, 'seconds': seconds}
+        line = json.dumps(entry, ensure_ascii=False, default=str) + '\n'
+        entries = self._loaded()
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Одна запись строки в режиме добавления - строки воркеров не перемешиваются
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+            entries[key] = entry
+
+    def __deepcopy__(self, memo):
+        # Кассета разделяется, а не копируется (например, при копировании LM в DSPy)
+        return self
@@ -0,0 +1,151 @@
+"""
+Разбиение длинных текстов на фрагменты для параллельного извлечения связок и
+объединение связок, извлеченных из разных фрагментов.
+"""
+
+import re
+
+import config
+from modules.dedup import TRIPLET_FIELDS, triplet_similarity
+
+_PARAGRAPH_RE = re.compile(r'\n\s*\n')
+_SENTENCE_RE = re.compile(r'(?<=[.!?…])\s+')
+_PUNCTUATION_RE = re.compile(r'^[\W_]+|[\W_]+$')
+
+
+def _spans(text, pattern, start, end):
+    """Границы (start, end) частей text[start:end], разделенных pattern (без разделителей)."""
+    spans = []
+    pos = start
+    for match in pattern.finditer(text, start, end):
+        if match.start() > pos:
+            spans.append((pos, match.start()))
+        pos = match.end()
+    if pos < end:
+        spans.append((pos, end))
+    return spans
+
+
+def _units(text, max_chars):
+    """
+    Неделимые единицы разбиения - предложения (предложения длиннее max_chars режутся по
+    max_chars символов). Возвращает список (start, end, конец абзаца).
+    """
+    units = []
+    for paragraph in _spans(text, _PARAGRAPH_RE, 0, len(text)):
+        sentences = []
+        for sentence in _spans(text, _SENTENCE_RE, *paragraph):
+            sentences.extend(
+                (pos, min(pos + max_chars, sentence[1])) for pos in range(sentence[0], sentence[1], max_chars)
+            )
+        units.extend((start, end, i == len(sentences) - 1) for i, (start, end) in enumerate(sentences))
+    return units
+
+
+def split_text(text, max_chars=config.CHUNK_MAX_CHARS, overlap_chars=config.CHUNK_OVERLAP_CHARS):
+    """
+    Разбивает текст на фрагменты не длиннее max_chars по границам предложений, по возможности -
+    по границам абзацев (если абзац заканчивается во второй половине фрагмента).
+
+    Соседние фрагменты перекрываются последними предложениями предыдущего фрагмента общей
+    длиной не более overlap_chars, чтобы связка на границе целиком попала хотя бы в один фрагмент.
+
+    Возвращает список словарей {'index', 'start', 'end', 'text'}, где start и end -
+    смещения фрагмента в исходном тексте.
+    """
+    units = _units(text, max_chars)
+    chunks = []
+    first = 0
+    while first < len(units):
+        last = first
+        while last + 1 < len(units) and units[last + 1][1] - units[first][0] <= max_chars:
+            last += 1
+
+        # Предпочитаем закончить фрагмент на границе абзаца
+        if last + 1 < len(units):
+            for candidate in range(last, first, -1):
+                if units[candidate][1] - units[first][0] < max_chars / 2:
+                    break
+                if units[candidate][2]:
+                    last = candidate
+                    break
+
+        start, end = units[first][0], units[last][1]
+        chunks.append({'index': len(chunks), 'start': start, 'end': end, 'text': text[start:end]})
+        if last + 1 == len(units):
+            break
+
+        # Перекрытие: следующий фрагмент начинается с хвоста текущего, но обязательно
+        # вмещает следующее предложение, иначе разбиение не продвинется
+        next_first = last + 1
+        while (
+            next_first - 1 > first
+            and end - units[next_first - 1][0] <= overlap_chars
+            and units[last + 1][1] - units[next_first - 1][0] <= max_chars
+        ):
+            next_first -= 1
+        first = next_first
+
+    return chunks
+
+
+def chunk_boundaries(chunk):
+    """Границы фрагмента без его текста - для отчета и ответа API."""
+    return {'index': chunk['index'], 'start': chunk['start'], 'end': chunk['end']}
+
+
+def _normalize_field(value):
+    value = re.sub(r'\s+', ' ', str(value)).strip().lower()
+    return _PUNCTUATION_RE.sub('', value)
+
+
+def triplet_key(triplet):
+    """Ключ связки для поиска точных повторов: поля без учета регистра, пробелов и крайней пунктуации."""
+    return tuple(_normalize_field(triplet.get(field, '')) for field in TRIPLET_FIELDS)
+
+
+def _overlap_match(triplet, triplets, sources, chunk_index, threshold):
+    """
+    Позиция связки предыдущего фрагмента, которую triplet повторяет другими словами (сходство
+    modules.dedup не ниже threshold), или None. Каждая связка предыдущего фрагмента сопоставляется
+    не более чем одной связке текущего.
+    """
+    best_position, best_similarity = None, threshold
+    for position, candidate in enumerate(triplets):
+        if chunk_index - 1 not in sources[position] or chunk_index in sources[position]:
+            continue
+        similarity = triplet_similarity(triplet, candidate)
+        if similarity >= best_similarity:
+            best_position, best_similarity = position, similarity
+    return best_position
+
+
+def merge_chunk_triplets(chunk_triplets, chunks=None, threshold=config.DEDUP_SIMILARITY_THRESHOLD):
+    """
+    Объединяет связки, извлеченные из фрагментов (список списков в порядке фрагментов).
+
+    Повторы одной связки из перекрытия соседних фрагментов сводятся к первому вхождению:
+    точные повторы (triplet_key) - сразу, а переформулированные при повторном извлечении -
+    по сходству modules.dedup не ниже threshold, и только со связками предыдущего фрагмента,
+    если он перекрывается с текущим (chunks - границы фрагментов; None - перекрываются все
+    соседние). Возвращает (связки, источники), где источники[i] - индексы фрагментов,
+    из которых извлечена i-я связка.
+    """
+    triplets = []
+    sources = []
+    positions = {}
+    for chunk_index, extracted in enumerate(chunk_triplets):
+        overlaps = chunk_index > 0 and (chunks is None or chunks[chunk_index]['start'] < chunks[chunk_index - 1]['end'])
+        for triplet in extracted:
+            key = triplet_key(triplet)
+            position = positions.get(key)
+            if position is None and overlaps:
+                position = _overlap_match(triplet, triplets, sources, chunk_index, threshold)
+            if position is not None:
+                if chunk_index not in sources[position]:
+                    sources[position].append(chunk_index)
+                continue
+            positions[key] = len(triplets)
+            triplets.append(triplet)
+            sources.append([chunk_index])
+    return triplets, sources
@@ -0,0 +1,53 @@
+"""
+Срок обработки запроса. Срок передается через dspy.context(deadline=...), поэтому доступен
+всем стадиям, в том числе в рабочих потоках parallel_map и в корутинах. Каскад стадий
+(modules.cascade) по нему пропускает или упрощает стадии, которые не успеют завершиться,
+а PipelineLM не повторяет запросы к провайдеру, если ожидание выходит за срок.
+"""
+
+import time
+
+import dspy
+
+import config
+
+
+class DeadlineExceeded(Exception):
+    """Стадия не может завершиться до срока запроса (например, повтор запроса к LLM не успевает)."""
+
+
+class Deadline:
+    """Срок через seconds секунд; reserve секунд перед сроком оставляются на сборку ответа."""
+
+    def __init__(self, seconds, reserve=None):
+        self.seconds = seconds
+        self.reserve = config.DEADLINE_RESERVE_SECONDS if reserve is None else reserve
+        self.at = time.monotonic() + seconds
+
+    def remaining(self):
+        """Сколько секунд осталось до срока (без запаса на ответ)."""
+        return max(0.0, self.at - time.monotonic() - self.reserve)
+
+    def allows(self, seconds):
+        """Успеет ли до срока работа, занимающая seconds секунд."""
+        return time.monotonic() + seconds <= self.at - self.reserve
+
+    def expired(self):
+        return not self.allows(0.0)
+
+
+def start_deadline(*budgets, parent=None):
+    """
+    Срок по наименьшему из бюджетов в секундах (None и 0 - бюджет не задан). Если срок
+    parent наступает раньше, возвращается он. Без бюджетов и parent - None.
+    """
+    budgets = [budget for budget in budgets if budget]
+    deadline = Deadline(min(budgets)) if budgets else None
+    if parent is not None and (deadline is None or parent.at <= deadline.at):
+        return parent
+    return deadline
+
+
+def current_deadline():
+    """Срок текущего запроса (dspy.context(deadline=...)) или None."""
+    return dspy.settings.config.get('deadline')
@@ -0,0 +1,71 @@
+"""
+Схлопывание почти одинаковых связок сразу после извлечения, до стадий с вызовами LLM.
+"""
+
+import re
+
+import config
+
+TRIPLET_FIELDS = ('initial_state', 'transformation', 'result')
+
+_WORD_RE = re.compile(r'\w+')
+
+# Слова сравниваются по первым буквам: грубая замена стемминга, чтобы формы одного слова
+# ("изменяет", "изменяют", "изменение") совпадали
+STEM_LENGTH = 5
+
+
+def _tokens(value):
+    return frozenset(word[:STEM_LENGTH] for word in _WORD_RE.findall(str(value).lower()))
+
+
+def _signature(triplet):
+    return [_tokens(triplet.get(field, '')) for field in TRIPLET_FIELDS]
+
+
+def _jaccard(a, b):
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def _signature_similarity(a, b):
+    return sum(_jaccard(x, y) for x, y in zip(a, b)) / len(TRIPLET_FIELDS)
+
+
+def triplet_similarity(a, b):
+    """
+    Сходство связок от 0 до 1: среднее по полям initial_state, transformation и result
+    коэффициента Жаккара множеств нормализованных слов.
+    """
+    return _signature_similarity(_signature(a), _signature(b))
+
+
+def collapse_duplicates(triplets, threshold=config.DEDUP_SIMILARITY_THRESHOLD):
+    """
+    Группирует связки со сходством не ниже threshold и оставляет по одной на группу -
+    первую по порядку извлечения.
+
+    Возвращает (kept, duplicates): kept - индексы оставленных связок, duplicates - список
+    {'index', 'triplet', 'duplicate_of', 'similarity'} для схлопнутых, где duplicate_of -
+    позиция оставленной связки в kept.
+    """
+    signatures = [_signature(t) for t in triplets]
+    kept = []
+    duplicates = []
+    for index, signature in enumerate(signatures):
+        best_position, best_similarity = None, threshold
+        for position, kept_index in enumerate(kept):
+            similarity = _signature_similarity(signature, signatures[kept_index])
+            if similarity >= best_similarity:
+                best_position, best_similarity = position, similarity
+        if best_position is None:
+            kept.append(index)
+        else:
+            duplicates.append({
+                'index': index,
+                'triplet': triplets[index],
+                'duplicate_of': best_position,
+                'similarity': round(best_similarity, 4),
+            })
+    return kept, duplicates
@@ -12,4 +12,7 @@ class TransformationExtractor(dspy.Module):
         self.extractor = dspy.ChainOfThought(ExtractTransformations)
 
     def forward(self, initial_text):
-        return self.extractor(initial_text=initial_text)
\ No newline at end of file
+        return self.extractor(initial_text=initial_text)
+
+    async def aforward(self, initial_text):
+        return await self.extractor.acall(initial_text=initial_text)
@@ -0,0 +1,378 @@
+import asyncio
+import collections
+import email.utils
+import random
+import threading
+import time
+
+import config
+from modules import telemetry
+
+# Исходы запроса к провайдеру для адаптивного лимита
+SUCCESS = 'success'
+RATE_LIMITED = 'rate_limited'
+UNAVAILABLE = 'unavailable'
+TIMEOUT = 'timeout'
+LATENCY = 'latency'
+# Сигналы перегрузки: лимит уменьшается, запрос можно повторить
+OVERLOAD_OUTCOMES = (RATE_LIMITED, UNAVAILABLE, TIMEOUT)
+
+
+class _Waiter:
+    __slots__ = ('loop', 'future', 'woken')
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.future = loop.create_future()
+        self.woken = False
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class _AsyncWaiters:
+    """
+    Очередь (FIFO) корутин, ждущих места в лимите, общем с потоками: корутина ждет future
+    своего цикла событий, а освобождение места из любого потока будит первую в очереди.
+    add, discard и wake вызываются под блокировкой лимитера.
+    """
+
+    def __init__(self):
+        self._queue = collections.deque()
+
+    def __len__(self):
+        return len(self._queue)
+
+    def add(self, first=False):
+        """Ставит текущую корутину в очередь (first - в начало: разбуженная, но не успевшая занять место)."""
+        waiter = _Waiter(asyncio.get_running_loop())
+        if first:
+            self._queue.appendleft(waiter)
+        else:
+            self._queue.append(waiter)
+        return waiter
+
+    def discard(self, waiter):
+        try:
+            self._queue.remove(waiter)
+        except ValueError:
+            pass
+
+    def wake(self):
+        """Будит первую в очереди корутину, цикл событий которой еще работает."""
+        while self._queue:
+            waiter = self._queue.popleft()
+            try:
+                waiter.loop.call_soon_threadsafe(_resolve, waiter.future)
+            except RuntimeError:  # Цикл событий закрыт
+                continue
+            waiter.woken = True
+            return
+
+    async def wait(self, waiter, lock, timeout=None):
+        """Ждет пробуждения waiter, но не дольше timeout секунд (None - без ограничения)."""
+        try:
+            await asyncio.wait((waiter.future,), timeout=timeout)
+        except asyncio.CancelledError:
+            with lock:
+                if waiter.woken:
+                    # Пробуждение не должно потеряться: место достается следующей
+                    self.wake()
+                else:
+                    self.discard(waiter)
+            raise
+        with lock:
+            if not waiter.woken:
+                self.discard(waiter)
+
+
+class ConcurrencyLimiter:
+    """
+    Ограничение числа одновременных запросов к LLM в пределах процесса.
+
+    Используется и из потоков (with limiter), и из корутин (async with limiter); все
+    запросы процесса - тексты пакета, связки, стадии - делят один лимит, поэтому
+    нагрузка на провайдера определяется лимитом, а не числом запросов и потоков.
+    limit <= 0 - без ограничения.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._semaphore = threading.BoundedSemaphore(limit) if limit > 0 else None
+        self._lock = threading.Lock()
+        self._waiters = _AsyncWaiters()
+
+    def __enter__(self):
+        if self._semaphore is not None:
+            self._semaphore.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._semaphore is not None:
+            with self._lock:
+                self._semaphore.release()
+                self._waiters.wake()
+
+    async def __aenter__(self):
+        # Семафор общий с потоками: корутины ждут в очереди, не блокируя цикл событий
+        if self._semaphore is None:
+            return self
+        woken = False
+        while True:
+            with self._lock:
+                if (woken or not self._waiters) and self._semaphore.acquire(blocking=False):
+                    return self
+                waiter = self._waiters.add(first=woken)
+            await self._waiters.wait(waiter, self._lock)
+            woken = True
+
+    async def __aexit__(self, *exc_info):
+        self.__exit__(*exc_info)
+
+
+class TokenBucket:
+    """Токен-бакет: в среднем rate запросов в секунду, не больше burst подряд (rate <= 0 - без ограничения)."""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Берет токен (при необходимости в долг) и возвращает, сколько секунд ждать до его появления."""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return max(0.0, -self._tokens / self.rate)
+
+
+class AdaptiveLimiter:
+    """
+    Лимит запросов к одной модели: токен-бакет и адаптивное число одновременных запросов (AIMD).
+
+    При сигнале перегрузки (429, 5xx, таймаут, время ответа больше latency_factor средних)
+    лимит умножается на decrease. Сигналы запросов, начатых до предыдущего снижения, его не
+    повторяют: иначе пачка ошибок одновременных запросов обнулила бы лимит. После каждого успешного запроса лимит растет на
+    1/лимит, то есть на 1 за «окно» успешных запросов. Retry-After провайдера приостанавливает
+    выдачу новых запросов к модели до указанного момента.
+
+    Используется и из потоков (acquire/release), и из корутин (aacquire/release).
+    """
+
+    def __init__(self, model, rate=0.0, burst=1, maximum=16, minimum=1, adaptive=True,
+                 decrease=0.5, latency_factor=3.0):
+        self.model = model
+        self.bucket = TokenBucket(rate, burst)
+        self.maximum = max(1, maximum)
+        self.minimum = max(1, min(minimum, self.maximum))
+        self.adaptive = adaptive
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.limit = float(self.maximum)
+        self._in_flight = 0
+        self._blocked_until = 0.0
+        self._last_decrease = 0.0
+        self._latency = None
+        self._samples = 0
+        self._throttled = {}
+        self._cond = threading.Condition()
+        self._waiters = _AsyncWaiters()
+
+    def _try_acquire(self):
+        """(True, 0) - место занято; (False, секунд до Retry-After или None - ждать освобождения места)."""
+        now = time.monotonic()
+        if now < self._blocked_until:
+            return False, self._blocked_until - now
+        if self._in_flight >= int(self.limit):
+            return False, None
+        self._in_flight += 1
+        return True, 0.0
+
+    def _wake_next(self):
+        """Будит следующую корутину, если в лимите еще есть место."""
+        if self._in_flight < int(self.limit) and time.monotonic() >= self._blocked_until:
+            self._waiters.wake()
+
+    def _publish(self):
+        telemetry.record_limiter_state(self.model, self.limit, self._in_flight)
+
+    def _acquired(self, started):
+        self._publish()
+        telemetry.record_limiter_wait(self.model, time.monotonic() - started)
+
+    def acquire(self):
+        """Ждет места в лимите модели и токена бакета."""
+        started = time.monotonic()
+        with self._cond:
+            while True:
+                acquired, wait = self._try_acquire()
+                if acquired:
+                    break
+                self._cond.wait(wait)
+        delay = self.bucket.reserve()
+        if delay:
+            time.sleep(delay)
+        self._acquired(started)
+
+    async def aacquire(self):
+        # Состояние общее с потоками: корутины ждут в очереди освобождения места (или конца
+        # Retry-After), не блокируя цикл событий
+        started = time.monotonic()
+        woken = False
+        while True:
+            with self._cond:
+                acquired, wait = self._try_acquire() if woken or not self._waiters else (False, None)
+                if acquired:
+                    self._wake_next()
+                    break
+                waiter = self._waiters.add(first=woken)
+            await self._waiters.wait(waiter, self._cond, wait)
+            woken = True
+        delay = self.bucket.reserve()
+        if delay:
+            await asyncio.sleep(delay)
+        self._acquired(started)
+
+    def _reduce(self, now, seconds, reason):
+        self._throttled[reason] = self._throttled.get(reason, 0) + 1
+        telemetry.record_llm_throttle(self.model, reason)
+        if self.adaptive and (seconds is None or now - seconds >= self._last_decrease):
+            self.limit = max(self.minimum, self.limit * self.decrease)
+            self._last_decrease = now
+
+    def _is_spike(self, seconds):
+        return (self.latency_factor > 0 and self._samples >= 10
+                and seconds > self.latency_factor * self._latency)
+
+    def release(self, outcome=SUCCESS, seconds=None, retry_after=None):
+        """
+        Освобождает место. outcome - исход запроса (SUCCESS, сигнал перегрузки или None -
+        ошибка, не связанная с нагрузкой), seconds - время запроса к провайдеру (без ожидания
+        лимитов процесса),
+        retry_after - Retry-After провайдера в секундах.
+        """
+        with self._cond:
+            self._in_flight -= 1
+            now = time.monotonic()
+            if retry_after:
+                self._blocked_until = max(self._blocked_until, now + retry_after)
+            if outcome in OVERLOAD_OUTCOMES:
+                self._reduce(now, seconds, outcome)
+            elif outcome == SUCCESS and seconds is not None:
+                if self._is_spike(seconds):
+                    self._reduce(now, seconds, LATENCY)
+                elif self.adaptive:
+                    self.limit = min(self.maximum, self.limit + 1 / self.limit)
+                # Скользящее среднее времени ответа для поиска всплесков
+                self._latency = seconds if self._latency is None else 0.9 * self._latency + 0.1 * seconds
+                self._samples += 1
+            self._cond.notify_all()
+            self._waiters.wake()
+        self._publish()
+
+    def snapshot(self):
+        """Состояние для /health."""
+        with self._cond:
+            return {
+                'limit': round(self.limit, 2),
+                'in_flight': self._in_flight,
+                'rate_per_second': self.bucket.rate or None,
+                'blocked_seconds': round(max(0.0, self._blocked_until - time.monotonic()), 2),
+                'mean_latency_seconds': round(self._latency, 3) if self._latency is not None else None,
+                'throttled': dict(self._throttled),
+            }
+
+
+def _parse_retry_after(value):
+    """Retry-After: число секунд или HTTP-дата."""
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(str(value)).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def classify_error(error):
+    """
+    Исход запроса, завершившегося ошибкой, и Retry-After в секундах. Исход None - ошибка не
+    связана с нагрузкой (неверный запрос, ключ, разбор ответа), такой запрос не повторяется.
+    """
+    status = getattr(error, 'status', None) or getattr(error, 'status_code', None)
+    name = type(error).__name__
+    retry_after = getattr(error, 'retry_after', None)
+    if retry_after is None:
+        headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+        retry_after = _parse_retry_after(headers.get('retry-after') or headers.get('Retry-After'))
+    if status == 429 or 'RateLimit' in name:
+        return RATE_LIMITED, retry_after
+    if ((isinstance(status, int) and status >= 500) or 'ServerError' in name or 'ServiceUnavailable' in name
+            or 'Transport' in name or 'Connection' in name):
+        return UNAVAILABLE, retry_after
+    if 'Timeout' in name:
+        return TIMEOUT, retry_after
+    return None, None
+
+
+def backoff_delay(attempt, base=0.5, cap=30.0):
+    """Пауза перед повтором без Retry-After: экспоненциальная, со случайным разбросом."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+# Создается при импорте, а не лениво: два экземпляра, созданные разными потоками, удвоили бы лимит
+_llm_limiter = ConcurrencyLimiter(config.LLM_MAX_CONCURRENCY)
+
+_model_limiters = {}
+_model_limiters_lock = threading.Lock()
+
+
+def get_llm_limiter():
+    """Общий для процесса лимитер запросов к LLM (config.LLM_MAX_CONCURRENCY)."""
+    return _llm_limiter
+
+
+def _model_rate(model):
+    """Лимит запросов в секунду для модели; если модель задана в нескольких ролях - самый строгий."""
+    rates = [rate for role_model, rate in (
+        (config.MAIN_MODEL, config.MAIN_MODEL_RPS),
+        (config.BANAL_MODEL, config.BANAL_MODEL_RPS),
+        (config.ASSESSMENT_MODEL, config.ASSESSMENT_MODEL_RPS),
+    ) if role_model == model and rate > 0]
+    return min(rates) if rates else 0.0
+
+
+def get_model_limiter(model):
+    """Общий для процесса лимитер запросов к модели (см. AdaptiveLimiter и настройки LLM_* в config)."""
+    with _model_limiters_lock:
+        limiter = _model_limiters.get(model)
+        if limiter is None:
+            limiter = _model_limiters[model] = AdaptiveLimiter(
+                model,
+                rate=_model_rate(model),
+                burst=config.LLM_RATE_BURST,
+                maximum=config.LLM_MAX_CONCURRENCY if config.LLM_MAX_CONCURRENCY > 0 else 64,
+                minimum=config.LLM_MIN_CONCURRENCY,
+                adaptive=config.LLM_ADAPTIVE_CONCURRENCY,
+                decrease=config.LLM_BACKOFF_FACTOR,
+                latency_factor=config.LLM_LATENCY_SPIKE_FACTOR,
+            )
+        return limiter
+
+
+def model_limiters_snapshot():
+    """Состояние лимитеров моделей этого процесса."""
+    with _model_limiters_lock:
+        limiters = dict(_model_limiters)
+    return {model: limiter.snapshot() for model, limiter in limiters.items()}
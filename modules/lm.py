@@ -0,0 +1,398 @@
+import asyncio
+import random
+import time
+
+import dspy
+from dspy.utils.usage_tracker import UsageTracker
+
+import config
+from modules import telemetry, tracing
+from modules.cassette import Cassette
+from modules.deadline import DeadlineExceeded, current_deadline
+from modules.limiter import SUCCESS, backoff_delay, classify_error, get_llm_limiter, get_model_limiter
+from modules.sqlite_cache import SQLiteCache, make_key
+from modules.synthetic_lm import estimate_tokens, synthetic_response
+
+# Параметры вызова, которые не влияют на ответ модели и не входят в ключ кэша
+_NON_KEY_KWARGS = ('api_key', 'api_base')
+
+_response_cache = None
+_cassette = None
+
+
+def get_response_cache():
+    """Общий для процесса дисковый кэш ответов LM (None, если кэш выключен)."""
+    global _response_cache
+    if _response_cache is None and config.LM_CACHE_ENABLED:
+        _response_cache = SQLiteCache(
+            config.LM_CACHE_PATH,
+            table='lm_responses',
+            max_bytes=config.LM_CACHE_MAX_MB * 1024 * 1024,
+            ttl_seconds=config.LM_CACHE_TTL_SECONDS,
+        )
+    return _response_cache
+
+
+def get_cassette():
+    """Кассета ответов LM для LM_BACKEND=record | replay."""
+    global _cassette
+    if _cassette is None:
+        _cassette = Cassette(config.LM_CASSETTE_PATH)
+    return _cassette
+
+
+class _CallUsageTracker(UsageTracker):
+    """Учет токенов одного запроса; записи передаются и внешнему трекеру, если он был."""
+
+    def __init__(self, outer=None):
+        super().__init__()
+        self.outer = outer
+
+    def add_usage(self, lm, usage_entry):
+        super().add_usage(lm, usage_entry)
+        if self.outer is not None:
+            self.outer.add_usage(lm, usage_entry)
+
+
+class PipelineLM(dspy.LM):
+    """
+    dspy.LM с дисковым кэшем ответов, общим для всех воркеров, и общим лимитом
+    одновременных запросов к провайдеру (get_llm_limiter). Каждая модель дополнительно
+    ограничена своим адаптивным лимитером (get_model_limiter): он снижает нагрузку при 429,
+    5xx и всплесках времени ответа и повторяет такие запросы с учетом Retry-After - повторы
+    DSPy поэтому выключены (num_retries=0). Время, токены и попадания в кэш запросов
+    учитываются в метриках (modules.telemetry), а при трассировке запроса каждый вызов -
+    отдельный спан 'llm' (modules.tracing).
+
+    Ключ кэша - модель, параметры генерации и итоговые сообщения промпта. Сообщения,
+    собранные адаптером DSPy, включают сигнатуру, демонстрации и входные данные, поэтому
+    отдельно они не учитываются. Кэш можно обойти для запроса через
+    dspy.context(lm_cache_bypass=True).
+    """
+
+    def __init__(self, model, response_cache=None, **kwargs):
+        kwargs.setdefault('num_retries', 0)
+        super().__init__(model, **kwargs)
+        self.response_cache = response_cache
+
+    def _cache_for_call(self):
+        if self.response_cache is None or dspy.settings.config.get('lm_cache_bypass', False):
+            return None
+        return self.response_cache
+
+    def _cache_key(self, prompt, messages, kwargs):
+        merged_kwargs = {
+            k: v for k, v in {**self.kwargs, **kwargs}.items() if k not in _NON_KEY_KWARGS
+        }
+        return make_key(self.model, prompt, messages, merged_kwargs)
+
+    def _record_request(self, tracker, started, error):
+        """Учитывает запрос к провайдеру в метриках и трассировке; возвращает его время."""
+        seconds = time.perf_counter() - started
+        usage = tracker.get_total_tokens().get(self.model) or {}
+        telemetry.record_llm_request(self.model, seconds, usage, error=error)
+        tracing.annotate(**{
+            'gen_ai.usage.input_tokens': usage.get('prompt_tokens'),
+            'gen_ai.usage.output_tokens': usage.get('completion_tokens'),
+        })
+        return seconds
+
+    def _complete(self, prompt, messages, kwargs):
+        """Запрос к провайдеру через dspy.LM."""
+        return super().__call__(prompt=prompt, messages=messages, **kwargs)
+
+    async def _acomplete(self, prompt, messages, kwargs):
+        return await super().acall(prompt=prompt, messages=messages, **kwargs)
+
+    def _attempt(self, prompt, messages, kwargs, timing):
+        """
+        Одна попытка запроса к провайдеру в пределах общего лимита. В timing['seconds'] -
+        время самого запроса к провайдеру, без ожидания общего лимита (None, если до запроса
+        не дошло): по нему адаптивный лимит модели ищет всплески времени ответа.
+        """
+        timing['seconds'] = None
+        with get_llm_limiter():
+            tracker = _CallUsageTracker(dspy.settings.usage_tracker)
+            started = time.perf_counter()
+            error = True
+            try:
+                with dspy.context(usage_tracker=tracker):
+                    outputs = self._complete(prompt, messages, kwargs)
+                error = False
+                return outputs
+            finally:
+                timing['seconds'] = self._record_request(tracker, started, error)
+
+    async def _aattempt(self, prompt, messages, kwargs, timing):
+        timing['seconds'] = None
+        async with get_llm_limiter():
+            tracker = _CallUsageTracker(dspy.settings.usage_tracker)
+            started = time.perf_counter()
+            error = True
+            try:
+                with dspy.context(usage_tracker=tracker):
+                    outputs = await self._acomplete(prompt, messages, kwargs)
+                error = False
+                return outputs
+            finally:
+                timing['seconds'] = self._record_request(tracker, started, error)
+
+    def _failed(self, limiter, error, attempt, seconds):
+        """
+        Освобождает лимитер после ошибки и возвращает паузу перед повтором; None - ошибку
+        нужно пробросить (она не связана с нагрузкой или попытки кончились). Если повтор не
+        успевает до срока запроса, выбрасывает DeadlineExceeded.
+        """
+        outcome, retry_after = classify_error(error)
+        limiter.release(outcome, seconds=seconds, retry_after=retry_after)
+        if outcome is None or attempt >= config.LLM_MAX_RETRIES:
+            return None
+        delay = backoff_delay(attempt)
+        deadline = current_deadline()
+        if deadline is not None and not deadline.allows(retry_after or delay):
+            tracing.annotate(**{'llm.attempts': attempt + 1})
+            raise DeadlineExceeded(f'Повтор запроса к {self.model} не успевает до срока запроса') from error
+        telemetry.record_llm_retry(self.model, outcome)
+        # Retry-After уже приостановил лимитер модели, ждать сверх него не нужно
+        return 0.0 if retry_after else delay
+
+    def _request(self, prompt, messages, kwargs):
+        """Запрос к провайдеру в пределах лимита модели; повторяется при ограничении со стороны провайдера."""
+        limiter = get_model_limiter(self.model)
+        attempt = 0
+        while True:
+            limiter.acquire()
+            timing = {}
+            try:
+                outputs = self._attempt(prompt, messages, kwargs, timing)
+            except Exception as e:
+                delay = self._failed(limiter, e, attempt, timing['seconds'])
+                if delay is None:
+                    tracing.annotate(**{'llm.attempts': attempt + 1})
+                    raise
+                attempt += 1
+                time.sleep(delay)
+                continue
+            limiter.release(SUCCESS, seconds=timing['seconds'])
+            tracing.annotate(**{'llm.attempts': attempt + 1})
+            return outputs
+
+    async def _arequest(self, prompt, messages, kwargs):
+        limiter = get_model_limiter(self.model)
+        attempt = 0
+        while True:
+            await limiter.aacquire()
+            timing = {}
+            try:
+                outputs = await self._aattempt(prompt, messages, kwargs, timing)
+            except Exception as e:
+                delay = self._failed(limiter, e, attempt, timing['seconds'])
+                if delay is None:
+                    tracing.annotate(**{'llm.attempts': attempt + 1})
+                    raise
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+            limiter.release(SUCCESS, seconds=timing['seconds'])
+            tracing.annotate(**{'llm.attempts': attempt + 1})
+            return outputs
+
+    def _cached(self, cache, key):
+        cached = cache.get(key)
+        telemetry.record_lm_cache(self.model, cached is not None)
+        tracing.annotate(**{'llm.cache_hit': cached is not None})
+        return cached
+
+    def _call(self, prompt, messages, kwargs):
+        cache = self._cache_for_call()
+        if cache is None:
+            return self._request(prompt, messages, kwargs)
+
+        key = self._cache_key(prompt, messages, kwargs)
+        cached = self._cached(cache, key)
+        if cached is not None:
+            return cached
+
+        outputs = self._request(prompt, messages, kwargs)
+        cache.set(key, outputs)
+        return outputs
+
+    async def _acall(self, prompt, messages, kwargs):
+        cache = self._cache_for_call()
+        if cache is None:
+            return await self._arequest(prompt, messages, kwargs)
+
+        key = self._cache_key(prompt, messages, kwargs)
+        cached = self._cached(cache, key)
+        if cached is not None:
+            return cached
+
+        outputs = await self._arequest(prompt, messages, kwargs)
+        cache.set(key, outputs)
+        return outputs
+
+    def __call__(self, prompt=None, messages=None, **kwargs):
+        with tracing.span('llm', **{'gen_ai.request.model': self.model}):
+            return self._call(prompt, messages, kwargs)
+
+    async def acall(self, prompt=None, messages=None, **kwargs):
+        with tracing.span('llm', **{'gen_ai.request.model': self.model}):
+            return await self._acall(prompt, messages, kwargs)
+
+
+def _report_usage(model, usage):
+    """Передает токены ответа без запроса к провайдеру трекеру DSPy, как это делает dspy.LM."""
+    tracker = dspy.settings.usage_tracker
+    if tracker is not None and usage:
+        tracker.add_usage(model, usage)
+
+
+def _synthetic_delay(key, latency, jitter):
+    """latency ± jitter секунд; отклонение определяется ключом запроса, поэтому прогоны воспроизводимы."""
+    if jitter:
+        latency += random.Random(key).uniform(-jitter, jitter)
+    return max(0.0, latency)
+
+
+class CassetteLM(PipelineLM):
+    """
+    PipelineLM, который записывает ответы провайдера в кассету (mode='record') или отвечает
+    из кассеты без сети (mode='replay').
+
+    При воспроизведении ответ задерживается на latency ± jitter секунд (latency=None -
+    записанное время ответа провайдера); отклонение определяется ключом запроса, поэтому
+    прогоны воспроизводимы. Записанные токены учитываются так же, как при реальном запросе.
+    Лимит одновременных запросов, метрики и трассировка работают как у PipelineLM.
+    """
+
+    def __init__(self, model, cassette, mode, latency=0.0, jitter=0.0, **kwargs):
+        super().__init__(model, **kwargs)
+        self.cassette = cassette
+        self.mode = mode
+        self.latency = latency
+        self.jitter = jitter
+
+    def _replay(self, prompt, messages, kwargs):
+        """Записанный ответ и задержка перед ним."""
+        key = self._cache_key(prompt, messages, kwargs)
+        entry = self.cassette.get(key)
+        _report_usage(self.model, entry['usage'])
+        latency = (entry['seconds'] or 0.0) if self.latency is None else self.latency
+        return entry['outputs'], _synthetic_delay(key, latency, self.jitter)
+
+    def _record(self, prompt, messages, kwargs, outputs, started):
+        tracker = dspy.settings.usage_tracker
+        usage = tracker.get_total_tokens().get(self.model) if tracker is not None else None
+        self.cassette.record(
+            self._cache_key(prompt, messages, kwargs), self.model, outputs,
+            usage=usage, seconds=round(time.perf_counter() - started, 3)
+        )
+
+    def _complete(self, prompt, messages, kwargs):
+        if self.mode == 'replay':
+            outputs, latency = self._replay(prompt, messages, kwargs)
+            time.sleep(latency)
+            return outputs
+
+        started = time.perf_counter()
+        outputs = super()._complete(prompt, messages, kwargs)
+        self._record(prompt, messages, kwargs, outputs, started)
+        return outputs
+
+    async def _acomplete(self, prompt, messages, kwargs):
+        if self.mode == 'replay':
+            outputs, latency = self._replay(prompt, messages, kwargs)
+            await asyncio.sleep(latency)
+            return outputs
+
+        started = time.perf_counter()
+        outputs = await super()._acomplete(prompt, messages, kwargs)
+        self._record(prompt, messages, kwargs, outputs, started)
+        return outputs
+
+
+class SyntheticLM(PipelineLM):
+    """
+    PipelineLM без сети: ответ строится по промпту (modules.synthetic_lm) с задержкой
+    latency ± jitter секунд, токены оцениваются по длине промпта и ответа. Извлечение
+    возвращает triplets связок. Для бенчмарков и нагрузочных прогонов.
+    """
+
+    def __init__(self, model, triplets=5, latency=0.0, jitter=0.0, **kwargs):
+        super().__init__(model, **kwargs)
+        self.triplets = triplets
+        self.latency = latency
+        self.jitter = jitter
+
+    def _synthesize(self, prompt, messages, kwargs):
+        messages = messages or [{'role': 'user', 'content': prompt or ''}]
+        text = synthetic_response(messages, self.triplets)
+        _report_usage(self.model, {
+            'prompt_tokens': estimate_tokens(''.join(str(m['content']) for m in messages)),
+            'completion_tokens': estimate_tokens(text),
+        })
+        return [text], _synthetic_delay(self._cache_key(prompt, messages, kwargs), self.latency, self.jitter)
+
+    def _complete(self, prompt, messages, kwargs):
+        outputs, latency = self._synthesize(prompt, messages, kwargs)
+        time.sleep(latency)
+        return outputs
+
+    async def _acomplete(self, prompt, messages, kwargs):
+        outputs, latency = self._synthesize(prompt, messages, kwargs)
+        await asyncio.sleep(latency)
+        return outputs
+
+
+def create_lm(model, max_tokens, temperature):
+    """
+    Создает LM для OpenRouter (или другого OpenAI-совместимого API, config.LM_API_BASE) с общим кэшем ответов. При LM_BACKEND=record | replay - CassetteLM:
+    кассета заменяет кэш ответов, иначе повторные запросы не попали бы в запись;
+    при LM_BACKEND=synthetic - SyntheticLM без сети и кэша.
+    """
+    if config.LM_BACKEND == 'synthetic':
+        return SyntheticLM(
+            model=model,
+            triplets=config.LM_SYNTHETIC_TRIPLETS,
+            latency=(config.LM_REPLAY_LATENCY_MS or 0) / 1000,
+            jitter=config.LM_REPLAY_JITTER_MS / 1000,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            cache=False,
+        )
+
+    if config.LM_BACKEND in ('record', 'replay'):
+        latency = config.LM_REPLAY_LATENCY_MS
+        return CassetteLM(
+            model=model,
+            cassette=get_cassette(),
+            mode=config.LM_BACKEND,
+            latency=latency / 1000 if latency is not None else None,
+            jitter=config.LM_REPLAY_JITTER_MS / 1000,
+            api_key=config.OPENROUTER_API_KEY,
+            api_base=config.LM_API_BASE,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            cache=False,
+        )
+
+    response_cache = get_response_cache()
+    return PipelineLM(
+        model=model,
+        api_key=config.OPENROUTER_API_KEY,
+        api_base=config.LM_API_BASE,
+        max_tokens=max_tokens,
+        temperature=temperature,
+        # Встроенный кэш DSPy не нужен, если включен общий кэш
+        cache=response_cache is None,
+        response_cache=response_cache,
+    )
+
+
+def preload_client():
+    """
+    Импортирует LiteLLM заранее. DSPy импортирует его при первом запросе к провайдеру, а импорт
+    занимает несколько секунд и попал бы в время первого запроса каждого воркера.
+    """
+    if config.LM_BACKEND in ('openrouter', 'record'):
+        import litellm  # noqa: F401
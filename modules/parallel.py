@@ -0,0 +1,55 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import dspy
+
+
+def _settings_snapshot():
+    """
+    Снимок текущих настроек DSPy (включая переопределения из dspy.context),
+    который нужно восстановить в рабочем потоке.
+    """
+    snapshot = dict(dspy.settings.config)
+    # trace - изменяемый список, общий для потоков он быть не должен
+    snapshot.pop('trace', None)
+    return snapshot
+
+
+def parallel_map(func, items, max_workers=1):
+    """
+    Применяет func к каждому элементу items, выполняя не более max_workers вызовов одновременно.
+
+    Порядок результатов совпадает с порядком items. Настройки DSPy вызывающего потока
+    (dspy.context) переносятся в рабочие потоки. При max_workers <= 1 выполняется
+    последовательно в текущем потоке.
+    """
+    items = list(items)
+    if max_workers is None or max_workers <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+
+    snapshot = _settings_snapshot()
+
+    def run(item):
+        with dspy.context(**snapshot):
+            return func(item)
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        return list(executor.map(run, items))
+
+
+def run_concurrently(*funcs):
+    """Выполняет функции без аргументов одновременно и возвращает их результаты в том же порядке."""
+    return parallel_map(lambda func: func(), funcs, max_workers=len(funcs))
+
+
+def spawn(func):
+    """Запускает func в фоновом потоке с настройками DSPy текущего потока и возвращает поток."""
+    snapshot = _settings_snapshot()
+
+    def run():
+        with dspy.context(**snapshot):
+            func()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
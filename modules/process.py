@@ -1,55 +1,674 @@
+import asyncio
 import dspy
 import config
-from metrics.assess_banal import banal_metric
+from metrics.assess_banal import aassess_triplet_banality, assess_triplet_banality, prefilter_banality
 from metrics.assess_reproducibility import reproducibility_metric
+from metrics.banal_prefilter import prefilter_triplet
+from modules.cascade import Cascade, Stage, get_cascade_stats
+from modules.chunking import chunk_boundaries, merge_chunk_triplets, split_text
+from modules.deadline import current_deadline
+from modules.dedup import collapse_duplicates
 from modules.enrich import TripletEnricher
+from modules.parallel import parallel_map
+from modules.tiers import aroute, escalates, route, tier_lm
+from modules import telemetry, tracing
 
 
-def process_text(extractor, text, banal_threshold=config.BANAL_THRESHOLD, reproducibility_threshold=0.7):
-    """
-    Выполняет полный цикл: извлечение, фильтрация по банальности, обогащение и оценка воспроизводимости.
-    Возвращает отфильтрованные и неотфильтрованные связки, а также строку с информацией об отфильтрованных.
-    """
-    prediction = extractor(initial_text=text)
-
-    if not prediction.transformations:
-        return [], [], "Не удалось извлечь преобразования."
+NO_TRANSFORMATIONS_MESSAGE = "Не удалось извлечь преобразования."
 
-    unfiltered_triplets = prediction.transformations
-    non_banal_triplets = []
-    failed_triplets_details = []
+# Упрощенная оценка банальности, когда полная не успевает до срока запроса: один вызов LLM -
+# одно сгенерированное банальное преобразование вместо трех, сравнение с ним локальным
+# сходством, без проверки каузальности и без уровней
+DEGRADED_BANAL_GENERATIONS = 1
+DEGRADED_BANAL_SIMILARITY_BACKEND = 'local'
 
-    for t in unfiltered_triplets:
-        single_prediction = dspy.Prediction(transformations=[t])
-        banal_score, failed_triplets_info = banal_metric(single_prediction, return_details=True)
 
-        if banal_score > banal_threshold:
-            non_banal_triplets.append(t)
-        else:
-            for failed in failed_triplets_info:
-                details = f"""Отфильтрована по банальности:
+def _format_banal_failure(failed):
+    details = f"""Отфильтрована по банальности:
 Начальное состояние: {failed['initial_state']}
 Преобразование: {failed['transformation']}
 Результат: {failed['result']}
 Банальность: {failed['banality_score']:.2f}"""
-                details += f"\n Связки, сгенерированные LLM : {str(failed['generated_banal_transformations'])}"
-                details += f"\n --------------"
-                failed_triplets_details.append(details)
+    details += f"\n Связки, сгенерированные LLM : {str(failed['generated_banal_transformations'])}"
+    scores = ", ".join(
+        f"{s['similarity_score']:.2f} ({s.get('backend', 'llm')})" for s in failed.get('similarity_scores', [])
+    )
+    if scores:
+        details += f"\n Оценки сходства: {scores}"
+    prefilter = failed.get('prefilter')
+    if failed.get('decision_path') == 'prefilter':
+        details += f"\n Решение: локальный фильтр - {prefilter['reason']}"
+    elif prefilter is not None:
+        details += f"\n Решение: LLM (локальный фильтр: {prefilter['reason']}, пересказ {prefilter['restatement_score']:.2f})"
+    if failed.get('tier') is not None:
+        tiers = ", ".join(f"{t['tier']} {t['score']:.2f}" for t in failed['tier_scores'])
+        details += f"\n Уровень: {failed['tier']} (небанальность по уровням: {tiers})"
+    causal_check = failed.get('causal_check')
+    if causal_check is not None:
+        details += f"\n Причинно-следственная связь: {causal_check['is_causal']} ({causal_check['reasoning']})"
+    details += f"\n --------------"
+    return details
+
+
+def _format_reproducibility_failure(triplet, repro_score, tier=None):
+    details = f"Отфильтрована по воспроизводимости: {triplet.get('initial_state', 'N/A')} -> {triplet.get('transformation', 'N/A')} -> {triplet.get('result', 'N/A')} (Воспроизводимость: {repro_score:.2f})"
+    if tier is not None:
+        details += f" [уровень: {tier}]"
+    return details
+
+
+def _format_partial(assessment):
+    triplet = assessment['triplet']
+    partial = assessment.get('partial') or {}
+    stages = f"пропущены стадии: {', '.join(partial.get('skipped_stages', []))}"
+    if partial.get('degraded_stages'):
+        stages += f"; упрощены: {', '.join(partial['degraded_stages'])}"
+    return f"Оценена частично (не хватило времени, {stages}): {triplet.get('initial_state', 'N/A')} -> {triplet.get('transformation', 'N/A')} -> {triplet.get('result', 'N/A')}"
+
+
+def _banal_rejected(assessment, banal_threshold):
+    banality = assessment['banality']
+    return banality is not None and banality['non_banality_score'] <= banal_threshold
+
+
+def _banality_done(assessment, banal_threshold):
+    """
+    Есть ли оценка банальности, пригодная для порога. Досрочно остановленная (early_stopped)
+    и упрощенная из-за срока запроса (degraded) оценки годятся только для отсева: для более
+    мягкого порога или без срока их нужно повторить. Решение дешевого уровня уровневой оценки
+    не годится для порога, около которого оно неуверенно (его должен принять следующий уровень).
+    """
+    banality = assessment['banality']
+    if banality is None:
+        return False
+    tier = banality.get('tier')
+    if tier is not None and tier != config.BANAL_TIERS[-1] and escalates(banality['non_banality_score'], banal_threshold):
+        return False
+    incomplete = banality.get('early_stopped') or banality.get('degraded')
+    return not (incomplete and banality['non_banality_score'] > banal_threshold)
+
+
+def _needs_stages(assessment, banal_threshold):
+    return not _banality_done(assessment, banal_threshold) or (
+        not _banal_rejected(assessment, banal_threshold) and assessment['reproducibility_score'] is None
+    )
+
+
+def needs_assessment(report, banal_threshold):
+    """
+    Проверяет, требует ли ранее полученный отчет assess_text дополнительных вызовов LLM
+    для заданного порога банальности (т.е. есть ли связки, прошедшие порог, но еще не
+    обогащенные и не оцененные по воспроизводимости, или досрочно остановленные оценки
+    банальности, которые для этого порога нужно довести до конца).
+    """
+    return any(_needs_stages(a, banal_threshold) for a in report['assessments'])
+
+
+class ProcessingCancelled(Exception):
+    """Обработка прервана через cancel_event (например, клиент отключился от потока)."""
+
+
+def _check_cancelled(cancel_event):
+    if cancel_event is not None and cancel_event.is_set():
+        raise ProcessingCancelled()
+
+
+def _banality_cost(n=3, causal_check=config.CAUSAL_CHECK_ENABLED, similarity_backend=None):
+    """
+    Оценка стоимости стадии банальности в вызовах LLM: генерация, сравнения, проверка каузальности.
+    similarity_backend - движок сходства, если он задан явно (иначе config.BANAL_SIMILARITY_BACKEND
+    или совмещенная оценка при config.BANAL_FUSED_ASSESSMENT).
+    """
+    if similarity_backend is None:
+        if config.BANAL_FUSED_ASSESSMENT:
+            return 1
+        similarity_backend = config.BANAL_SIMILARITY_BACKEND
+    if similarity_backend == 'local':
+        comparisons = 0
+    elif config.BANAL_BATCH_COMPARE or similarity_backend == 'hybrid':
+        comparisons = 1
+    else:
+        comparisons = n
+    return 1 + comparisons + int(causal_check)
+
+
+def _reproducibility_tiers(tiers=None):
+    """Уровни оценки воспроизводимости (config.REPRODUCIBILITY_TIERS) или None, если уровневая оценка выключена."""
+    if tiers is None and config.TIERED_ASSESSMENT:
+        tiers = config.REPRODUCIBILITY_TIERS
+    return tiers or None
+
+
+def assess_reproducibility(enriched_triplet, tiers=None):
+    """
+    Оценка воспроизводимости обогащенной связки: (оценка, [{'tier', 'score'}] по уровням или
+    None без уровневой оценки). tiers - уровни (по умолчанию config.REPRODUCIBILITY_TIERS, если
+    включена config.TIERED_ASSESSMENT; пустой список - без уровней): следующий уровень
+    вызывается, только если оценка ближе config.TIER_ESCALATION_BAND к
+    config.TIER_REPRODUCIBILITY_THRESHOLD.
+    """
+    prediction = dspy.Prediction(transformations=[enriched_triplet])
+    tiers = _reproducibility_tiers(tiers)
+    if not tiers:
+        return reproducibility_metric(prediction), None
+
+    def assess(tier, previous):
+        with dspy.context(lm=tier_lm(tier)):
+            return reproducibility_metric(prediction)
+    return route('reproducibility', tiers, assess, float, config.TIER_REPRODUCIBILITY_THRESHOLD)
+
+
+async def aassess_reproducibility(enriched_triplet, tiers=None):
+    """Асинхронный вариант assess_reproducibility."""
+    prediction = dspy.Prediction(transformations=[enriched_triplet])
+    tiers = _reproducibility_tiers(tiers)
+    if not tiers:
+        return await _acall(reproducibility_metric, prediction), None
+
+    async def assess(tier, previous):
+        with dspy.context(lm=tier_lm(tier)):
+            return await _acall(reproducibility_metric, prediction)
+    return await aroute('reproducibility', tiers, assess, float, config.TIER_REPRODUCIBILITY_THRESHOLD)
 
-    if not non_banal_triplets:
-        return [], unfiltered_triplets, "\n".join(failed_triplets_details)
+
+def _reproducibility_result(assessment, score, path):
+    """Оценка воспроизводимости; при уровневой оценке - с решившим уровнем и оценками по уровням."""
+    if path is None:
+        return dict(assessment, reproducibility_score=score)
+    return dict(assessment, reproducibility_score=score, reproducibility_tier=path[-1]['tier'],
+                reproducibility_tier_scores=path)
+
+
+def _triplet_stages(text, triplet, enricher, banal_threshold):
+    """
+    Стадии оценки связки для каскада. Отсеивают только стадии банальности (локальный фильтр
+    и LLM): порог воспроизводимости применяется позже, в filter_assessments, поэтому обогащение
+    и воспроизводимость выполняются последними и только для связок, прошедших банальность.
+    """
+    # Сравнения с банальными преобразованиями останавливаются, как только связка заведомо не проходит порог
+    stop_at = 1.0 - banal_threshold if config.CASCADE_EARLY_STOP else None
+
+    # Локальный фильтр - отдельная стадия каскада, поэтому оценка банальности его не повторяет;
+    # его решение по неочевидной связке сохраняется в подробностях оценки
+    def prefilter(assessment):
+        decision = prefilter_triplet(triplet)
+        return dict(assessment, prefilter=decision, banality=prefilter_banality(triplet, decision))
+
+    def with_prefilter(assessment, banality):
+        return dict(assessment, banality=dict(banality, prefilter=assessment.get('prefilter')))
+
+    def banality(assessment):
+        banality = assess_triplet_banality(triplet, prefilter=False, stop_at=stop_at, threshold=banal_threshold)
+        return with_prefilter(assessment, banality)
+
+    async def abanality(assessment):
+        banality = await aassess_triplet_banality(triplet, prefilter=False, stop_at=stop_at, threshold=banal_threshold)
+        return with_prefilter(assessment, banality)
+
+    # Вариант для нехватки времени: результат помечается degraded и без срока оценивается заново
+    degraded = {'n': DEGRADED_BANAL_GENERATIONS, 'prefilter': False, 'stop_at': stop_at, 'causal_check': False,
+                'threshold': banal_threshold, 'tiers': (), 'similarity_backend': DEGRADED_BANAL_SIMILARITY_BACKEND}
+
+    def degraded_banality(assessment):
+        return with_prefilter(assessment, dict(assess_triplet_banality(triplet, **degraded), degraded=True))
+
+    async def adegraded_banality(assessment):
+        banality = await aassess_triplet_banality(triplet, **degraded)
+        return with_prefilter(assessment, dict(banality, degraded=True))
+
+    def enrichment(assessment):
+        return dict(assessment, enriched_triplet=enricher(initial_text=text, transformation_triplet=triplet))
+
+    async def aenrichment(assessment):
+        enriched = await _acall(enricher, initial_text=text, transformation_triplet=triplet)
+        return dict(assessment, enriched_triplet=enriched)
+
+    def reproducibility(assessment):
+        return _reproducibility_result(assessment, *assess_reproducibility(assessment['enriched_triplet']))
+
+    async def areproducibility(assessment):
+        return _reproducibility_result(assessment, *await aassess_reproducibility(assessment['enriched_triplet']))
+
+    rejected = lambda assessment: _banal_rejected(assessment, banal_threshold)
+    banality_done = lambda assessment: _banality_done(assessment, banal_threshold)
+
+    stages = [
+        Stage('banality', banality, arun=abanality, cost=_banality_cost(),
+              rejects=rejected, done=banality_done, rejection_rate=0.5,
+              degraded=degraded_banality, adegraded=adegraded_banality,
+              degraded_cost=_banality_cost(DEGRADED_BANAL_GENERATIONS, causal_check=False,
+                                           similarity_backend=DEGRADED_BANAL_SIMILARITY_BACKEND)),
+        Stage('enrichment', enrichment, arun=aenrichment, cost=1,
+              done=lambda assessment: assessment['enriched_triplet'] is not None),
+        Stage('reproducibility', reproducibility, arun=areproducibility, cost=1,
+              done=lambda assessment: assessment['reproducibility_score'] is not None, requires=('enrichment',)),
+    ]
+    if config.BANAL_PREFILTER_ENABLED:
+        stages.insert(0, Stage(
+            'prefilter', prefilter, cost=0,
+            rejects=rejected, done=banality_done, rejection_rate=0.1
+        ))
+    return stages
+
+
+def _new_assessment(triplet):
+    return {'triplet': triplet, 'prefilter': None, 'banality': None, 'enriched_triplet': None,
+            'reproducibility_score': None, 'partial': None}
+
+
+def _mark_partial(assessment, banal_threshold):
+    """
+    Отмечает в оценке стадии, не выполненные (skipped_stages) или упрощенные (degraded_stages)
+    из-за срока запроса; 'partial' - None, если оценка полная.
+    """
+    skipped = []
+    if not _banality_done(assessment, banal_threshold):
+        skipped.append('banality')
+    if not _banal_rejected(assessment, banal_threshold):
+        if assessment['enriched_triplet'] is None:
+            skipped.append('enrichment')
+        if assessment['reproducibility_score'] is None:
+            skipped.append('reproducibility')
+    banality = assessment['banality']
+    degraded = ['banality'] if banality is not None and banality.get('degraded') else []
+    if 'banality' in skipped and degraded:
+        # Упрощенная оценка пропустила связку, но для ответа ее достаточно
+        skipped.remove('banality')
+    partial = {'skipped_stages': skipped, 'degraded_stages': degraded} if skipped or degraded else None
+    return dict(assessment, partial=partial)
+
+
+def _stage_callbacks(on_stage, cancel_event):
+    """before_stage и after_stage каскада: отмена и уведомления on_stage о выполненных стадиях."""
+    def before_stage(name):
+        _check_cancelled(cancel_event)
+
+    def after_stage(name, assessment):
+        if on_stage is None:
+            return
+        if name in ('prefilter', 'banality') and assessment['banality'] is not None:
+            on_stage(name, {'score': assessment['banality']['non_banality_score']})
+        elif name == 'reproducibility':
+            on_stage(name, {'score': assessment['reproducibility_score'], 'enriched_triplet': assessment['enriched_triplet']})
+
+    return before_stage, after_stage
+
+
+def _assess_triplet(text, triplet, enricher, banal_threshold, assessment=None, on_stage=None, cancel_event=None):
+    """
+    Проводит одну связку через каскад стадий (modules.cascade): локальный фильтр банальности,
+    банальность, обогащение, воспроизводимость.
+
+    Результат - словарь-оценка с ключами 'triplet', 'banality' (подробности оценки банальности),
+    'enriched_triplet' и 'reproducibility_score'. Каскад останавливается на стадии, отсеявшей
+    связку по порогу банальности; обогащение и воспроизводимость для нее остаются None. Если
+    передана ранее полученная оценка, уже выполненные стадии не повторяются.
+
+    on_stage(stage, payload) вызывается после выполненных стадий ('prefilter' - если фильтр
+    принял решение, 'banality', 'reproducibility'); перед каждой стадией проверяется cancel_event.
+
+    При сроке запроса (modules.deadline) не успевающие стадии упрощаются или пропускаются;
+    они перечислены в 'partial' ({'skipped_stages', 'degraded_stages'}, None - оценка полная).
+    """
+    cascade = Cascade(_triplet_stages(text, triplet, enricher, banal_threshold), get_cascade_stats())
+    before_stage, after_stage = _stage_callbacks(on_stage, cancel_event)
+    assessment, _ = cascade.run(
+        assessment or _new_assessment(triplet), before_stage, after_stage, deadline=current_deadline()
+    )
+    return _mark_partial(assessment, banal_threshold)
+
+
+async def _acall(component, *args, **kwargs):
+    """
+    Асинхронный вызов компонента пайплайна: модули DSPy с aforward вызываются через acall,
+    остальные (функции и модули без асинхронной реализации) - в пуле потоков.
+    """
+    if hasattr(component, 'aforward'):
+        return await component.acall(*args, **kwargs)
+    return await asyncio.to_thread(component, *args, **kwargs)
+
+
+async def _aassess_triplet(text, triplet, enricher, banal_threshold, assessment=None):
+    """Асинхронный вариант _assess_triplet."""
+    cascade = Cascade(_triplet_stages(text, triplet, enricher, banal_threshold), get_cascade_stats())
+    assessment, _ = await cascade.arun(assessment or _new_assessment(triplet), deadline=current_deadline())
+    return _mark_partial(assessment, banal_threshold)
+
+
+def _chunks_for(text):
+    """Фрагменты для извлечения или None, если текст извлекается целиком."""
+    if not config.CHUNKING_ENABLED:
+        return None
+    chunks = split_text(text)
+    return chunks if len(chunks) > 1 else None
+
+
+def _extraction(text, chunks, predictions):
+    """Собирает результат извлечения из предсказаний экстрактора для фрагментов (или всего текста)."""
+    if chunks is None:
+        triplets = predictions[0].transformations or []
+        chunks = [{'index': 0, 'start': 0, 'end': len(text)}]
+        sources = [[0] for _ in triplets]
+    else:
+        chunks = [chunk_boundaries(c) for c in chunks]
+        triplets, sources = merge_chunk_triplets([p.transformations or [] for p in predictions], chunks)
+
+    merged_duplicates = []
+    if config.DEDUP_ENABLED:
+        kept, merged_duplicates = collapse_duplicates(triplets)
+        for duplicate in merged_duplicates:
+            representative_sources = sources[kept[duplicate['duplicate_of']]]
+            representative_sources.extend(c for c in sources[duplicate['index']] if c not in representative_sources)
+        triplets = [triplets[i] for i in kept]
+        sources = [sorted(sources[i]) for i in kept]
+        merged_duplicates = [
+            {k: v for k, v in duplicate.items() if k != 'index'} for duplicate in merged_duplicates
+        ]
+
+    return {'triplets': triplets, 'chunks': chunks, 'triplet_chunks': sources, 'merged_duplicates': merged_duplicates}
+
+
+def _previous_extraction(report):
+    """Результат извлечения из ранее полученного отчета assess_text."""
+    return {
+        'triplets': report['unfiltered_triplets'],
+        'chunks': report['chunks'],
+        'triplet_chunks': report['triplet_chunks'],
+        'merged_duplicates': report['merged_duplicates'],
+    }
+
+
+def extract_triplets(extractor, text, max_concurrency=config.MAX_CONCURRENCY):
+    """
+    Извлекает связки из текста. Возвращает словарь:
+    - triplets: связки для оценки
+    - chunks: границы {'index', 'start', 'end'} частей текста, из которых извлекались связки
+    - triplet_chunks: triplet_chunks[i] - индексы фрагментов, в которых найдена i-я связка
+    - merged_duplicates: схлопнутые почти одинаковые связки ({'triplet', 'duplicate_of', 'similarity'},
+      duplicate_of - индекс оставленной связки в triplets)
+
+    При CHUNKING_ENABLED длинный текст разбивается на фрагменты (split_text), из них связки
+    извлекаются одновременно (не более max_concurrency). При DEDUP_ENABLED почти одинаковые
+    связки схлопываются (collapse_duplicates), чтобы не оценивать их повторно.
+    """
+    chunks = _chunks_for(text)
+    with telemetry.stage_timer('extraction'), tracing.span('extraction', chunks=len(chunks) if chunks else None):
+        if chunks is None:
+            predictions = [extractor(initial_text=text)]
+        else:
+            predictions = parallel_map(
+                lambda chunk: extractor(initial_text=chunk['text']), chunks, max_workers=max_concurrency
+            )
+    return _extraction(text, chunks, predictions)
+
+
+async def aextract_triplets(extractor, text, max_concurrency=config.MAX_CONCURRENCY):
+    """Асинхронный вариант extract_triplets."""
+    chunks = _chunks_for(text)
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def extract(chunk):
+        async with semaphore:
+            return await _acall(extractor, initial_text=chunk['text'])
+
+    with telemetry.stage_timer('extraction'), tracing.span('extraction', chunks=len(chunks) if chunks else None):
+        if chunks is None:
+            predictions = [await _acall(extractor, initial_text=text)]
+        else:
+            predictions = await asyncio.gather(*[extract(chunk) for chunk in chunks])
+    return _extraction(text, chunks, predictions)
+
+
+def assess_text(extractor, text, banal_threshold=config.BANAL_THRESHOLD, max_concurrency=config.MAX_CONCURRENCY,
+                previous=None, on_event=None, cancel_event=None):
+    """
+    Извлекает связки из текста и оценивает каждую из них, не применяя порог воспроизводимости.
+
+    Возвращает отчет - словарь с ключами 'unfiltered_triplets' (все извлеченные связки),
+    'assessments' (оценки связок в том же порядке), а также 'chunks', 'triplet_chunks' и
+    'merged_duplicates' (см. extract_triplets).
+    Отчет сериализуется в JSON и может быть повторно отфильтрован с другими порогами
+    через filter_assessments().
+
+    Если передан previous - ранее полученный отчет для того же текста, извлечение и уже
+    выполненные стадии не повторяются; LLM вызывается только для недостающих стадий.
+    Связки оцениваются одновременно, не более max_concurrency штук.
+
+    on_event(event, payload) - необязательный обработчик промежуточных результатов:
+    'extracted' (результат extract_triplets) после извлечения, 'stage' ({'index': i, 'stage': ..., 'score': ...})
+    после каждой стадии связки и 'assessed' ({'index': i, 'assessment': {...}}) после оценки
+    связки. Может вызываться из рабочих потоков.
+
+    cancel_event (threading.Event) прерывает обработку: стадии, которые еще не начались,
+    не выполняются, а assess_text выбрасывает ProcessingCancelled.
+
+    Срок обработки задается через dspy.context(deadline=...) (modules.deadline): стадии, которые
+    не успевают до него, упрощаются или пропускаются, а оценка связки помечается в 'partial'.
+    """
+    if previous is not None:
+        extraction = _previous_extraction(previous)
+        assessments = previous['assessments']
+    else:
+        _check_cancelled(cancel_event)
+        extraction = extract_triplets(extractor, text, max_concurrency=max_concurrency)
+        assessments = [None] * len(extraction['triplets'])
+    unfiltered_triplets = extraction['triplets']
+
+    if on_event is not None:
+        on_event('extracted', extraction)
+
+    enricher = TripletEnricher()
+
+    def assess(item):
+        index, (triplet, assessment) = item
+        on_stage = None
+        if on_event is not None:
+            on_stage = lambda stage, payload: on_event('stage', dict(payload, index=index, stage=stage))
+        with tracing.span('triplet', index=index):
+            assessment = _assess_triplet(
+                text, triplet, enricher, banal_threshold,
+                assessment=assessment, on_stage=on_stage, cancel_event=cancel_event
+            )
+        if on_event is not None:
+            on_event('assessed', {'index': index, 'assessment': assessment})
+        return assessment
+
+    assessments = parallel_map(
+        assess,
+        list(enumerate(zip(unfiltered_triplets, assessments))),
+        max_workers=max_concurrency,
+    )
+
+    return {
+        'unfiltered_triplets': unfiltered_triplets,
+        'assessments': assessments,
+        'chunks': extraction['chunks'],
+        'triplet_chunks': extraction['triplet_chunks'],
+        'merged_duplicates': extraction['merged_duplicates'],
+    }
+
+
+async def aassess_text(extractor, text, banal_threshold=config.BANAL_THRESHOLD,
+                       max_concurrency=config.MAX_CONCURRENCY, previous=None, on_event=None):
+    """
+    Асинхронный вариант assess_text для ASGI-сервера: ожидание ответов LLM не занимает потоки,
+    поэтому один процесс может одновременно обслуживать много запросов.
+    """
+    if previous is not None:
+        extraction = _previous_extraction(previous)
+        assessments = previous['assessments']
+    else:
+        extraction = await aextract_triplets(extractor, text, max_concurrency=max_concurrency)
+        assessments = [None] * len(extraction['triplets'])
+    unfiltered_triplets = extraction['triplets']
+
+    if on_event is not None:
+        on_event('extracted', extraction)
 
     enricher = TripletEnricher()
-    enriched_triplets = [enricher(initial_text=text, transformation_triplet=t) for t in non_banal_triplets]
-    
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def assess(index, triplet, assessment):
+        async with semaphore:
+            with tracing.span('triplet', index=index):
+                assessment = await _aassess_triplet(text, triplet, enricher, banal_threshold, assessment=assessment)
+        if on_event is not None:
+            on_event('assessed', {'index': index, 'assessment': assessment})
+        return assessment
+
+    assessments = await asyncio.gather(*[
+        assess(index, triplet, assessment)
+        for index, (triplet, assessment) in enumerate(zip(unfiltered_triplets, assessments))
+    ])
+
+    return {
+        'unfiltered_triplets': unfiltered_triplets,
+        'assessments': list(assessments),
+        'chunks': extraction['chunks'],
+        'triplet_chunks': extraction['triplet_chunks'],
+        'merged_duplicates': extraction['merged_duplicates'],
+    }
+
+
+def filter_assessments(assessments, banal_threshold=config.BANAL_THRESHOLD, reproducibility_threshold=0.7):
+    """
+    Применяет пороги к оценкам связок без вызовов LLM.
+    Возвращает (связки, прошедшие все фильтры, строка с информацией об отфильтрованных).
+
+    Связки, оценка которых не завершена или упрощена из-за срока запроса (нет оценки
+    банальности или воспроизводимости, упрощенная оценка банальности не отсеяла связку), не
+    принимаются и перечисляются в информации отдельно.
+    """
     final_triplets = []
-    for triplet in enriched_triplets:
-        single_prediction = dspy.Prediction(transformations=[triplet])
-        repro_score = reproducibility_metric(single_prediction)
-        if repro_score >= reproducibility_threshold:
-            final_triplets.append(triplet)
+    banal_details = []
+    reproducibility_details = []
+    partial_details = []
+
+    for assessment in assessments:
+        banality = assessment['banality']
+        if banality is None:
+            partial_details.append(_format_partial(assessment))
+            continue
+        if banality['non_banality_score'] <= banal_threshold:
+            banal_details.append(_format_banal_failure(banality))
+            continue
+        if banality.get('degraded'):
+            # Упрощенная оценка годится только для отсева
+            partial_details.append(_format_partial(assessment))
+            continue
+
+        enriched = assessment['enriched_triplet']
+        repro_score = assessment['reproducibility_score']
+        if repro_score is None:
+            partial_details.append(_format_partial(assessment))
+        elif repro_score >= reproducibility_threshold:
+            final_triplets.append(enriched)
         else:
-            details = f"Отфильтрована по воспроизводимости: {triplet.get('initial_state', 'N/A')} -> {triplet.get('transformation', 'N/A')} -> {triplet.get('result', 'N/A')} (Воспроизводимость: {repro_score:.2f})"
-            failed_triplets_details.append(details)
-            
-    return final_triplets, unfiltered_triplets, "\n".join(failed_triplets_details)
\ No newline at end of file
+            reproducibility_details.append(_format_reproducibility_failure(
+                enriched, repro_score, assessment.get('reproducibility_tier')
+            ))
+
+    # Сначала причины отсева по банальности, затем по воспроизводимости, затем неоцененные
+    return final_triplets, "\n".join(banal_details + reproducibility_details + partial_details)
+
+
+def partial_triplets(report):
+    """Связки отчета, оценка которых упрощена или не завершена из-за срока запроса."""
+    return [
+        dict(assessment['partial'], index=index, triplet=assessment['triplet'])
+        for index, assessment in enumerate(report['assessments'])
+        if assessment.get('partial')
+    ]
+
+
+def funnel_counts(report, banal_threshold, accepted_count):
+    """
+    Воронка связок одного отчета: извлечено (вместе со схлопнутыми повторами), уникальных,
+    прошли фильтр банальности, приняты.
+    """
+    unique = len(report['unfiltered_triplets'])
+    banality_passed = sum(
+        1 for assessment in report['assessments']
+        if assessment['banality'] is not None and assessment['banality']['non_banality_score'] > banal_threshold
+    )
+    return {
+        'extracted': unique + len(report['merged_duplicates']),
+        'unique': unique,
+        'banality_passed': banality_passed,
+        'accepted': accepted_count,
+    }
+
+
+def record_funnel(report, banal_threshold, accepted_count):
+    """Учитывает в метриках воронку связок одного ответа (см. funnel_counts)."""
+    telemetry.record_funnel(**funnel_counts(report, banal_threshold, accepted_count))
+
+
+def process_text(extractor, text, banal_threshold=config.BANAL_THRESHOLD, reproducibility_threshold=0.7,
+                 max_concurrency=config.MAX_CONCURRENCY):
+    """
+    Выполняет полный цикл: извлечение, фильтрация по банальности, обогащение и оценка воспроизводимости.
+    Возвращает отфильтрованные и неотфильтрованные связки, а также строку с информацией об отфильтрованных.
+
+    Связки оцениваются независимо друг от друга, одновременно не более max_concurrency штук
+    (1 - последовательная обработка). Порядок результатов совпадает с порядком извлечения.
+    """
+    with telemetry.stage_timer('process_text'):
+        report = assess_text(extractor, text, banal_threshold=banal_threshold, max_concurrency=max_concurrency)
+    if not report['unfiltered_triplets']:
+        record_funnel(report, banal_threshold, 0)
+        return [], [], NO_TRANSFORMATIONS_MESSAGE
+
+    final_triplets, failed_triplets_details = filter_assessments(
+        report['assessments'], banal_threshold, reproducibility_threshold
+    )
+    record_funnel(report, banal_threshold, len(final_triplets))
+    return final_triplets, report['unfiltered_triplets'], failed_triplets_details
+
+
+def process_texts(extractor, items, max_concurrency=config.BATCH_CONCURRENCY):
+    """
+    Пакетный вариант process_text для многих текстов (например, глав книги).
+
+    items - список словарей с ключом 'text' и необязательными 'banal_threshold' и
+    'reproducibility_threshold'. Тексты обрабатываются одновременно, не более max_concurrency
+    штук; запросы к LLM всех текстов проходят через общий лимит процесса (LLM_MAX_CONCURRENCY).
+
+    Возвращает список результатов в порядке items: {'success': True, 'filtered_triplets',
+    'unfiltered_triplets', 'failed_reasoning'} или {'success': False, 'error': ...}. Ошибка
+    одного текста не прерывает обработку остальных.
+    """
+    def process(item):
+        try:
+            final_triplets, unfiltered_triplets, failed_reasoning = process_text(
+                extractor,
+                item['text'],
+                banal_threshold=item.get('banal_threshold', config.BANAL_THRESHOLD),
+                reproducibility_threshold=item.get('reproducibility_threshold', 0.7),
+            )
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+        return {
+            'success': True,
+            'filtered_triplets': final_triplets,
+            'unfiltered_triplets': unfiltered_triplets,
+            'failed_reasoning': failed_reasoning,
+        }
+
+    return parallel_map(process, items, max_workers=max_concurrency)
+
+
+async def aprocess_text(extractor, text, banal_threshold=config.BANAL_THRESHOLD, reproducibility_threshold=0.7,
+                        max_concurrency=config.MAX_CONCURRENCY):
+    """Асинхронный вариант process_text с тем же контрактом результата."""
+    with telemetry.stage_timer('process_text'):
+        report = await aassess_text(extractor, text, banal_threshold=banal_threshold, max_concurrency=max_concurrency)
+    if not report['unfiltered_triplets']:
+        record_funnel(report, banal_threshold, 0)
+        return [], [], NO_TRANSFORMATIONS_MESSAGE
+
+    final_triplets, failed_triplets_details = filter_assessments(
+        report['assessments'], banal_threshold, reproducibility_threshold
+    )
+    record_funnel(report, banal_threshold, len(final_triplets))
+    return final_triplets, report['unfiltered_triplets'], failed_triplets_details
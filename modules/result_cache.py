@@ -0,0 +1,202 @@
+import asyncio
+import hashlib
+import re
+import time
+import unicodedata
+
+import config
+from modules import telemetry
+from modules.process import aassess_text, assess_text, needs_assessment
+from modules.sqlite_cache import SQLiteCache, make_key
+
+# Настройки, от которых зависят оценки связок: при их изменении кэшированные отчеты не используются
+CACHE_KEY_SETTINGS = [
+    # Отчеты синтетической LM и кассеты не должны выдаваться при работе с провайдером
+    'LM_BACKEND',
+    'MAIN_MODEL',
+    'BANAL_MODEL',
+    'ASSESSMENT_MODEL',
+    'BANAL_BATCH_COMPARE',
+    'BANAL_SIMILARITY_BACKEND',
+    'BANAL_FUSED_ASSESSMENT',
+    'BANAL_LOCAL_AMBIGUOUS_LOW',
+    'BANAL_LOCAL_AMBIGUOUS_HIGH',
+    'CAUSAL_CHECK_ENABLED',
+    'TIERED_ASSESSMENT',
+    'BANAL_TIERS',
+    'REPRODUCIBILITY_TIERS',
+    'TIER_ESCALATION_BAND',
+    'TIER_REPRODUCIBILITY_THRESHOLD',
+    'BANAL_PREFILTER_ENABLED',
+    'BANAL_PREFILTER_BANAL_OVERLAP',
+    'BANAL_PREFILTER_ACCEPT_OVERLAP',
+    'BANAL_PREFILTER_ACCEPT_MIN_WORDS',
+    'CHUNKING_ENABLED',
+    'CHUNK_MAX_CHARS',
+    'CHUNK_OVERLAP_CHARS',
+    'DEDUP_ENABLED',
+    'DEDUP_SIMILARITY_THRESHOLD',
+]
+
+# Отпечаток экстрактора без демонстраций (оптимизированный экстрактор не загружен)
+NO_DEMOS_FINGERPRINT = 'no-demos'
+
+_result_cache = None
+
+
+def normalize_text(text):
+    """Нормализация текста для ключа кэша: Unicode NFC и схлопывание пробельных символов."""
+    return re.sub(r'\s+', ' ', unicodedata.normalize('NFC', text)).strip()
+
+
+def extractor_fingerprint(path=None):
+    """
+    Отпечаток программы экстрактора для ключа кэша: SHA-256 файла оптимизированного экстрактора
+    или NO_DEMOS_FINGERPRINT, если он не загружен (path=None). Считается один раз при загрузке,
+    чтобы после переобучения или смены экстрактора кэшированные отчеты не использовались.
+    """
+    if path is None:
+        return NO_DEMOS_FINGERPRINT
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def get_result_cache():
+    """Общий для процесса кэш отчетов обработки (None, если кэш выключен)."""
+    global _result_cache
+    if _result_cache is None and config.RESULT_CACHE_ENABLED:
+        _result_cache = ResultCache(SQLiteCache(
+            config.RESULT_CACHE_PATH,
+            table='process_results',
+            max_bytes=config.RESULT_CACHE_MAX_MB * 1024 * 1024,
+            ttl_seconds=config.RESULT_CACHE_TTL_SECONDS,
+        ))
+    return _result_cache
+
+
+class ResultCache:
+    """
+    Кэш отчетов assess_text с объединением одновременных одинаковых запросов (single-flight).
+
+    Отчет хранится по ключу из нормализованного текста, настроек пайплайна и отпечатка
+    экстрактора (атрибут fingerprint, см. extractor_fingerprint); пороги в ключ
+    не входят - отчет содержит оценки каждой связки и фильтруется под пороги запроса.
+    Пока один процесс считает отчет, он держит аренду ключа в SQLite, а остальные процессы
+    и потоки ждут результат, а не запускают собственный пайплайн. Промах считается один раз
+    на запрос: ожидание проверяет кэш через peek, не трогая счетчики.
+    """
+
+    def __init__(self, store, lease_seconds=config.RESULT_CACHE_LEASE_SECONDS, poll_interval=0.2):
+        self.store = store
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+
+    def key_for(self, text, extractor=None):
+        settings = {name: getattr(config, name) for name in CACHE_KEY_SETTINGS}
+        if config.LM_BACKEND == 'replay':
+            # Ответы зависят от кассеты
+            settings['LM_CASSETTE_PATH'] = config.LM_CASSETTE_PATH
+        return make_key(normalize_text(text), settings, getattr(extractor, 'fingerprint', None))
+
+    def get_or_compute(self, key, compute):
+        """
+        Возвращает (отчет, статус), где статус - 'hit' (из кэша), 'coalesced' (дождались
+        параллельного запроса) или 'miss' (отчет посчитан этим вызовом).
+        """
+        report = self.store.get(key)
+        if report is not None:
+            return report, 'hit'
+
+        waited = False
+        while not self.store.try_acquire_lease(key, self.lease_seconds):
+            waited = True
+            time.sleep(self.poll_interval)
+            report = self.store.peek(key)
+            if report is not None:
+                return report, 'coalesced'
+
+        try:
+            # Пока ждали аренду, отчет мог появиться
+            report = self.store.peek(key) if waited else None
+            if report is not None:
+                return report, 'coalesced'
+            report = compute()
+            self.store.set(key, report)
+            return report, 'miss'
+        finally:
+            self.store.release_lease(key)
+
+    async def aget_or_compute(self, key, acompute):
+        """Асинхронный вариант get_or_compute: ожидание чужого вычисления не блокирует цикл событий."""
+        report = self.store.get(key)
+        if report is not None:
+            return report, 'hit'
+
+        waited = False
+        while not self.store.try_acquire_lease(key, self.lease_seconds):
+            waited = True
+            await asyncio.sleep(self.poll_interval)
+            report = self.store.peek(key)
+            if report is not None:
+                return report, 'coalesced'
+
+        try:
+            report = self.store.peek(key) if waited else None
+            if report is not None:
+                return report, 'coalesced'
+            report = await acompute()
+            self.store.set(key, report)
+            return report, 'miss'
+        finally:
+            self.store.release_lease(key)
+
+
+def assess_text_cached(extractor, text, banal_threshold=config.BANAL_THRESHOLD, **kwargs):
+    """
+    assess_text с кэшем отчетов. Возвращает (отчет, статус кэша).
+
+    Статусы: 'hit' и 'coalesced' - вызовов LLM не было; 'partial' - отчет взят из кэша, но
+    для нового порога банальности пришлось дооценить часть связок; 'miss' - полный прогон;
+    'disabled' - кэш выключен.
+    """
+    result_cache = get_result_cache()
+    if result_cache is None:
+        return assess_text(extractor, text, banal_threshold=banal_threshold, **kwargs), 'disabled'
+
+    key = result_cache.key_for(text, extractor)
+    report, status = result_cache.get_or_compute(
+        key, lambda: assess_text(extractor, text, banal_threshold=banal_threshold, **kwargs)
+    )
+
+    # Отчет, только что вычисленный с этим порогом, неполон лишь из-за срока запроса - дооценивать его сейчас некогда
+    if status != 'miss' and needs_assessment(report, banal_threshold):
+        report = assess_text(extractor, text, banal_threshold=banal_threshold, previous=report, **kwargs)
+        result_cache.store.set(key, report)
+        status = 'partial'
+
+    telemetry.record_result_cache(status)
+    return report, status
+
+
+async def aassess_text_cached(extractor, text, banal_threshold=config.BANAL_THRESHOLD, **kwargs):
+    """Асинхронный вариант assess_text_cached."""
+    result_cache = get_result_cache()
+    if result_cache is None:
+        return await aassess_text(extractor, text, banal_threshold=banal_threshold, **kwargs), 'disabled'
+
+    key = result_cache.key_for(text, extractor)
+    report, status = await result_cache.aget_or_compute(
+        key, lambda: aassess_text(extractor, text, banal_threshold=banal_threshold, **kwargs)
+    )
+
+    # Отчет, только что вычисленный с этим порогом, неполон лишь из-за срока запроса - дооценивать его сейчас некогда
+    if status != 'miss' and needs_assessment(report, banal_threshold):
+        report = await aassess_text(extractor, text, banal_threshold=banal_threshold, previous=report, **kwargs)
+        result_cache.store.set(key, report)
+        status = 'partial'
+
+    telemetry.record_result_cache(status)
+    return report, status
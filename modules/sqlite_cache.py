@@ -0,0 +1,236 @@
+import contextlib
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+def make_key(*parts):
+    """Стабильный ключ кэша: SHA-256 от JSON-представления частей."""
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class SQLiteCache:
+    """
+    Кэш JSON-значений в файле SQLite, общий для всех процессов (воркеров gunicorn).
+
+    - Вытеснение по LRU: при превышении max_bytes удаляются давно не читавшиеся записи.
+      Общий размер записей поддерживается триггерами, а не считается при каждой записи.
+    - TTL: записи старше ttl_seconds считаются отсутствующими (0 - без ограничения).
+    - Счетчики попаданий и промахов хранятся в той же базе и суммируются по всем процессам.
+      Чтение ничего не пишет: счетчики и время доступа копятся в процессе и записываются одной
+      транзакцией раз в flush_seconds (0 - сразу), поэтому stats() других процессов и порядок
+      LRU отстают не больше чем на flush_seconds.
+    """
+
+    def __init__(self, path, table, max_bytes, ttl_seconds=0, flush_seconds=1.0):
+        self.path = path
+        self.table = table
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.flush_seconds = flush_seconds
+        self._local = threading.local()
+        self._pending_lock = threading.Lock()
+        self._reset_pending()
+
+    def __deepcopy__(self, memo):
+        # Кэш разделяется, а не копируется (например, при копировании LM в DSPy)
+        return self
+
+    def _connection(self):
+        """Соединение для текущего потока; после fork открывается заново."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(
+            f'CREATE TABLE IF NOT EXISTS {self.table} ('
+            'key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, '
+            'created_at REAL NOT NULL, accessed_at REAL NOT NULL)'
+        )
+        conn.execute(f'CREATE INDEX IF NOT EXISTS {self.table}_accessed ON {self.table} (accessed_at)')
+        conn.execute(f'CREATE INDEX IF NOT EXISTS {self.table}_created ON {self.table} (created_at)')
+        conn.execute(f'CREATE TABLE IF NOT EXISTS {self.table}_stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+        conn.execute(f'CREATE TABLE IF NOT EXISTS {self.table}_leases (key TEXT PRIMARY KEY, expires_at REAL NOT NULL)')
+        with self._transaction(conn):
+            # Общий размер записей ('bytes' в таблице счетчиков); для существующей базы - начальный подсчет
+            conn.execute(
+                f"INSERT OR IGNORE INTO {self.table}_stats (name, value) "
+                f"SELECT 'bytes', COALESCE(SUM(size), 0) FROM {self.table}"
+            )
+            for event, change in (('INSERT', 'NEW.size'), ('DELETE', '-OLD.size'),
+                                  ('UPDATE OF size', 'NEW.size - OLD.size')):
+                conn.execute(
+                    f"CREATE TRIGGER IF NOT EXISTS {self.table}_size_{event.split()[0].lower()} "
+                    f"AFTER {event} ON {self.table} BEGIN "
+                    f"UPDATE {self.table}_stats SET value = value + {change} WHERE name = 'bytes'; END"
+                )
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    @contextlib.contextmanager
+    def _transaction(conn):
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def _reset_pending(self):
+        self._pending_pid = os.getpid()
+        self._pending_counts = {}
+        self._pending_access = {}
+        self._flushed_at = time.monotonic()
+
+    def _count(self, name, key=None, now=None):
+        """Откладывает счетчик name и время доступа к key до flush."""
+        with self._pending_lock:
+            if self._pending_pid != os.getpid():
+                # После fork отложенное принадлежит родителю
+                self._reset_pending()
+            self._pending_counts[name] = self._pending_counts.get(name, 0) + 1
+            if key is not None:
+                self._pending_access[key] = now
+            due = time.monotonic() - self._flushed_at >= self.flush_seconds
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Записывает отложенные счетчики и время доступа одной транзакцией."""
+        with self._pending_lock:
+            if self._pending_pid != os.getpid():
+                self._reset_pending()
+            counts, access = self._pending_counts, self._pending_access
+            self._pending_counts, self._pending_access = {}, {}
+            self._flushed_at = time.monotonic()
+        if not counts and not access:
+            return
+        conn = self._connection()
+        with self._transaction(conn):
+            conn.executemany(
+                f'INSERT INTO {self.table}_stats (name, value) VALUES (?, ?) '
+                'ON CONFLICT(name) DO UPDATE SET value = value + excluded.value',
+                counts.items()
+            )
+            conn.executemany(
+                f'UPDATE {self.table} SET accessed_at = MAX(accessed_at, ?) WHERE key = ?',
+                [(accessed_at, key) for key, accessed_at in access.items()]
+            )
+
+    def _read(self, conn, key, now):
+        """Строка (value, created_at) записи или None; просроченная запись удаляется."""
+        row = conn.execute(f'SELECT value, created_at FROM {self.table} WHERE key = ?', (key,)).fetchone()
+        if row is not None and self.ttl_seconds and row[1] + self.ttl_seconds < now:
+            conn.execute(f'DELETE FROM {self.table} WHERE key = ?', (key,))
+            row = None
+        return row
+
+    def get(self, key):
+        """Возвращает сохраненное значение или None."""
+        conn = self._connection()
+        now = time.time()
+        row = self._read(conn, key, now)
+        if row is None:
+            self._count('misses')
+            return None
+
+        self._count('hits', key, now)
+        return json.loads(row[0])
+
+    def peek(self, key):
+        """
+        Возвращает сохраненное значение или None, не меняя счетчиков и времени доступа: для
+        повторных проверок при ожидании значения, которое вычисляет другой поток или процесс.
+        """
+        row = self._read(self._connection(), key, time.time())
+        return None if row is None else json.loads(row[0])
+
+    def set(self, key, value):
+        """Сохраняет значение. Значения, которые нельзя сериализовать в JSON, не кэшируются."""
+        try:
+            payload = json.dumps(value, ensure_ascii=False)
+        except (TypeError, ValueError):
+            return False
+
+        conn = self._connection()
+        now = time.time()
+        size = len(payload.encode('utf-8'))
+        # Не INSERT OR REPLACE: замена строки через REPLACE не вызывает триггер удаления
+        conn.execute(
+            f'INSERT INTO {self.table} (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?) '
+            'ON CONFLICT(key) DO UPDATE SET value = excluded.value, size = excluded.size, '
+            'created_at = excluded.created_at, accessed_at = excluded.accessed_at',
+            (key, payload, size, now, now)
+        )
+        self._evict(conn, now)
+        return True
+
+    def delete(self, key):
+        self._connection().execute(f'DELETE FROM {self.table} WHERE key = ?', (key,))
+
+    def try_acquire_lease(self, key, seconds):
+        """
+        Пытается взять аренду ключа (например, на время вычисления значения).
+        Возвращает True, если аренда получена; просроченные аренды перехватываются.
+        """
+        conn = self._connection()
+        now = time.time()
+        conn.execute(f'DELETE FROM {self.table}_leases WHERE key = ? AND expires_at < ?', (key, now))
+        cursor = conn.execute(
+            f'INSERT OR IGNORE INTO {self.table}_leases (key, expires_at) VALUES (?, ?)',
+            (key, now + seconds)
+        )
+        return cursor.rowcount == 1
+
+    def release_lease(self, key):
+        self._connection().execute(f'DELETE FROM {self.table}_leases WHERE key = ?', (key,))
+
+    def _evict(self, conn, now):
+        if self.ttl_seconds:
+            conn.execute(f'DELETE FROM {self.table} WHERE created_at < ?', (now - self.ttl_seconds,))
+
+        total = conn.execute(f"SELECT value FROM {self.table}_stats WHERE name = 'bytes'").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        # Порядок LRU - с учетом отложенного времени доступа
+        self.flush()
+
+        to_free = total - self.max_bytes
+        stale_keys = []
+        for key, size in conn.execute(f'SELECT key, size FROM {self.table} ORDER BY accessed_at'):
+            stale_keys.append((key,))
+            to_free -= size
+            if to_free <= 0:
+                break
+        conn.executemany(f'DELETE FROM {self.table} WHERE key = ?', stale_keys)
+
+    def stats(self):
+        """Счетчики попаданий/промахов и текущий размер кэша (по всем процессам)."""
+        self.flush()
+        conn = self._connection()
+        counters = dict(conn.execute(f'SELECT name, value FROM {self.table}_stats').fetchall())
+        entries = conn.execute(f'SELECT COUNT(*) FROM {self.table}').fetchone()[0]
+        size = counters.get('bytes', 0)
+        hits = counters.get('hits', 0)
+        misses = counters.get('misses', 0)
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / (hits + misses) if hits + misses else 0.0,
+            'entries': entries,
+            'bytes': size,
+        }
@@ -0,0 +1,46 @@
+"""
+Отчет о запуске процесса сервера: время импорта и этапов прогрева (настройка DSPy, импорт
+LiteLLM, загрузка экстрактора). Отчет отдается в /ready и печатается после прогрева, так что
+замедление запуска видно сразу.
+
+При WARM_START=preload этапы выполняются в мастер-процессе gunicorn, и воркеры получают
+отчет мастера вместе с загруженным экстрактором.
+"""
+
+import contextlib
+import os
+import time
+
+# Момент импорта модуля - начало отсчета (модуль импортируется первым из модулей проекта)
+_started = time.perf_counter()
+_started_pid = os.getpid()
+_phases = {}
+
+
+@contextlib.contextmanager
+def phase(name):
+    """Замеряет этап запуска."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _phases[name] = round(time.perf_counter() - started, 3)
+
+
+def mark(name):
+    """Отмечает момент запуска: время от импорта модуля до этой точки."""
+    _phases[name] = round(time.perf_counter() - _started, 3)
+
+
+def report():
+    """Этапы запуска в секундах; preloaded - этапы выполнены в родительском процессе."""
+    return {
+        'pid': os.getpid(),
+        'preloaded': os.getpid() != _started_pid,
+        'phases': dict(_phases),
+    }
+
+
+def format_report():
+    phases = ', '.join(f'{name} {seconds:.2f} с' for name, seconds in _phases.items())
+    return f"Запуск (pid {os.getpid()}): {phases}"
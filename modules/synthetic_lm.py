@@ -0,0 +1,93 @@
+"""
+Синтетические ответы LM для бенчмарков и нагрузочных прогонов без сети (LM_BACKEND=synthetic).
+
+Ответ строится по промпту ChatAdapter DSPy: из системного сообщения берутся выходные поля
+сигнатуры и их типы, значения генерируются детерминированно от текста промпта. Качество
+ответов не моделируется - только их форма, число и размер, чтобы пайплайн выполнял те же
+стадии и вызовы, что и с настоящей моделью.
+"""
+
+import json
+import random
+import re
+
+_OUTPUT_FIELDS_RE = re.compile(r'Your output fields are:\n((?:\d+\. .*\n?)+)')
+_FIELD_RE = re.compile(r'^\d+\. `(\w+)` \((.*?)\):', re.MULTILINE)
+_INPUT_RE = re.compile(r'\[\[ ## (\w+) ## \]\]\n(.*?)(?=\n\n\[\[ ## |\n\nRespond with|\Z)', re.DOTALL)
+
+# Слоги псевдослов: синтетические связки не совпадают по словам, поэтому не схлопываются
+# как повторы и не отсеиваются локальным фильтром банальности
+_SYLLABLES = ('ка', 'ро', 'ми', 'ту', 'ле', 'на', 'зо', 'ви', 'ба', 'де', 'су', 'ги', 'по', 'ша', 'ре', 'ны')
+
+
+def _words(rng, count):
+    return ' '.join(''.join(rng.choice(_SYLLABLES) for _ in range(3)) for _ in range(count))
+
+
+def _output_fields(system_message):
+    match = _OUTPUT_FIELDS_RE.search(system_message)
+    if match is None:
+        return []
+    return _FIELD_RE.findall(match.group(1))
+
+
+def _inputs(user_message):
+    return {name: value.strip() for name, value in _INPUT_RE.findall(user_message)}
+
+
+def _list_length(inputs, default):
+    """Длина списка в ответе: входное поле n или число кандидатов, если они есть во входе."""
+    if inputs.get('n', '').isdigit():
+        return int(inputs['n'])
+    for value in inputs.values():
+        try:
+            parsed = json.loads(value)
+        except ValueError:
+            continue
+        if isinstance(parsed, list):
+            return len(parsed)
+    return default
+
+
+def _value(rng, type_name, inputs, triplets):
+    type_name = type_name.replace(' ', '').lower()
+    if type_name == 'float':
+        return f'{rng.random():.2f}'
+    if type_name == 'int':
+        return str(rng.randint(1, 5))
+    if type_name == 'bool':
+        return rng.choice(('True', 'False'))
+    if type_name.startswith('list[dict'):
+        return json.dumps([
+            {'initial_state': _words(rng, 6), 'transformation': _words(rng, 12), 'result': _words(rng, 6)}
+            for _ in range(triplets)
+        ], ensure_ascii=False)
+    if type_name.startswith('list[float'):
+        return json.dumps([round(rng.random(), 2) for _ in range(_list_length(inputs, 3))])
+    if type_name.startswith('list'):
+        return json.dumps([_words(rng, 10) for _ in range(_list_length(inputs, 3))], ensure_ascii=False)
+    if type_name.startswith('dict'):
+        return json.dumps({'initial_state': _words(rng, 8), 'transformation': _words(rng, 16),
+                           'result': _words(rng, 8)}, ensure_ascii=False)
+    return _words(rng, 20)
+
+
+def synthetic_response(messages, triplets=5):
+    """
+    Ответ в формате ChatAdapter на сообщения промпта; поле со списком словарей (извлеченные
+    связки) содержит triplets элементов.
+    """
+    system = next((str(m['content']) for m in messages if m['role'] == 'system'), '')
+    user = str(messages[-1]['content']) if messages else ''
+    rng = random.Random(json.dumps(messages, sort_keys=True, ensure_ascii=False))
+    inputs = _inputs(user)
+    parts = [
+        f'[[ ## {name} ## ]]\n{_value(rng, type_name, inputs, triplets)}'
+        for name, type_name in _output_fields(system)
+    ]
+    return '\n\n'.join(parts + ['[[ ## completed ## ]]'])
+
+
+def estimate_tokens(text):
+    """Грубая оценка числа токенов (около 4 символов на токен)."""
+    return max(1, len(text) // 4)
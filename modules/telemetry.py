@@ -0,0 +1,177 @@
+"""
+Метрики Prometheus: время стадий пайплайна и запросов к LLM, число вызовов и токенов по
+моделям, состояние лимитера запросов к провайдеру, попадания в кэши, запросы в обработке и
+воронка связок. Отдаются эндпоинтом /metrics.
+
+Под gunicorn каждый воркер - отдельный процесс, поэтому значения пишутся в файлы каталога
+PROMETHEUS_MULTIPROC_DIR (переменная должна быть задана до запуска сервера; каталог очищается
+при старте в gunicorn.conf.py), а /metrics любого воркера суммирует их по всем процессам.
+Без этой переменной метрики хранятся в памяти процесса.
+"""
+
+import contextlib
+import os
+import time
+
+# Каталог multiprocess-режима должен существовать до создания метрик (например, под uvicorn без gunicorn.conf.py)
+if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+    os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+)
+
+# Границы корзин гистограмм времени (секунды): от локальных стадий до долгих вызовов LLM
+LATENCY_BUCKETS = (0.005, 0.025, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+STAGE_SECONDS = Histogram(
+    'pipeline_stage_duration_seconds', 'Время выполнения стадии пайплайна', ['stage'], buckets=LATENCY_BUCKETS
+)
+STAGE_REJECTIONS = Counter(
+    'pipeline_stage_rejections_total', 'Связки, отсеянные стадией каскада', ['stage']
+)
+STAGE_DEADLINE = Counter(
+    'pipeline_stage_deadline_total',
+    'Стадии каскада, не успевавшие до срока запроса: action=degraded (упрощена), skipped (пропущена)',
+    ['stage', 'action']
+)
+TIER_DECISIONS = Counter(
+    'pipeline_tier_decisions_total', 'Связки, решение по которым принял уровень уровневой оценки', ['stage', 'tier']
+)
+TRIPLETS = Counter(
+    'pipeline_triplets_total',
+    'Воронка связок в ответах: extracted, unique (после схлопывания повторов), banality_passed, accepted',
+    ['step']
+)
+LLM_SECONDS = Histogram(
+    'llm_request_duration_seconds', 'Время запроса к провайдеру LLM', ['model'], buckets=LATENCY_BUCKETS
+)
+LLM_CALLS = Counter(
+    'llm_calls_total', 'Вызовы LM: source=provider - запрос к провайдеру, cache - ответ из общего кэша',
+    ['model', 'source']
+)
+LLM_ERRORS = Counter('llm_errors_total', 'Запросы к провайдеру LLM, завершившиеся ошибкой', ['model'])
+LLM_TOKENS = Counter('llm_tokens_total', 'Токены запросов к провайдеру LLM', ['model', 'kind'])
+LLM_CONCURRENCY_LIMIT = Gauge(
+    'llm_concurrency_limit', 'Адаптивный лимит одновременных запросов к модели', ['model'],
+    multiprocess_mode='livesum'
+)
+LLM_IN_FLIGHT = Gauge(
+    'llm_requests_in_flight', 'Запросы к модели в обработке', ['model'], multiprocess_mode='livesum'
+)
+LLM_THROTTLED = Counter(
+    'llm_throttled_total',
+    'Сигналы перегрузки провайдера: reason=rate_limited (429), unavailable (5xx), timeout, latency (всплеск времени ответа)',
+    ['model', 'reason']
+)
+LLM_RETRIES = Counter('llm_retries_total', 'Повторы запросов к провайдеру LLM', ['model', 'reason'])
+LLM_LIMITER_WAIT = Histogram(
+    'llm_limiter_wait_seconds', 'Ожидание запроса в лимитере модели (лимит, токен-бакет, Retry-After)', ['model'],
+    buckets=LATENCY_BUCKETS
+)
+CACHE_REQUESTS = Counter(
+    'cache_requests_total', 'Обращения к кэшам: cache=lm|result, outcome=hit|miss|coalesced|partial',
+    ['cache', 'outcome']
+)
+HTTP_IN_FLIGHT = Gauge(
+    'http_requests_in_flight', 'HTTP-запросы в обработке', ['endpoint'], multiprocess_mode='livesum'
+)
+HTTP_SECONDS = Histogram(
+    'http_request_duration_seconds', 'Время обработки HTTP-запроса', ['endpoint', 'status'], buckets=LATENCY_BUCKETS
+)
+
+
+@contextlib.contextmanager
+def stage_timer(stage):
+    """Замеряет время блока как стадии пайплайна (работает и вокруг await)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(stage).observe(time.perf_counter() - started)
+
+
+def record_stage(stage, seconds, rejected):
+    """Выполненная стадия каскада: время и отсев."""
+    STAGE_SECONDS.labels(stage).observe(seconds)
+    if rejected:
+        STAGE_REJECTIONS.labels(stage).inc()
+
+
+def record_stage_deadline(stage, action):
+    """Стадия каскада упрощена (degraded) или пропущена (skipped) из-за срока запроса."""
+    STAGE_DEADLINE.labels(stage, action).inc()
+
+
+def record_tier_decision(stage, tier):
+    """Уровневая оценка: решение стадии stage принял уровень tier (modules.tiers)."""
+    TIER_DECISIONS.labels(stage, tier).inc()
+
+
+def record_llm_request(model, seconds, usage=None, error=False):
+    """Запрос к провайдеру: время, токены (usage из DSPy: prompt_tokens, completion_tokens) и ошибка."""
+    LLM_CALLS.labels(model, 'provider').inc()
+    LLM_SECONDS.labels(model).observe(seconds)
+    if error:
+        LLM_ERRORS.labels(model).inc()
+    for kind in ('prompt_tokens', 'completion_tokens'):
+        tokens = (usage or {}).get(kind)
+        if isinstance(tokens, (int, float)) and tokens:
+            LLM_TOKENS.labels(model, kind.replace('_tokens', '')).inc(tokens)
+
+
+def record_limiter_state(model, limit, in_flight):
+    LLM_CONCURRENCY_LIMIT.labels(model).set(limit)
+    LLM_IN_FLIGHT.labels(model).set(in_flight)
+
+
+def record_llm_throttle(model, reason):
+    LLM_THROTTLED.labels(model, reason).inc()
+
+
+def record_llm_retry(model, reason):
+    LLM_RETRIES.labels(model, reason).inc()
+
+
+def record_limiter_wait(model, seconds):
+    LLM_LIMITER_WAIT.labels(model).observe(seconds)
+
+
+def record_lm_cache(model, hit):
+    CACHE_REQUESTS.labels('lm', 'hit' if hit else 'miss').inc()
+    if hit:
+        LLM_CALLS.labels(model, 'cache').inc()
+
+
+def record_result_cache(status):
+    """Статус кэша результатов (см. assess_text_cached); 'disabled' и 'bypassed' не учитываются."""
+    if status in ('hit', 'miss', 'coalesced', 'partial'):
+        CACHE_REQUESTS.labels('result', status).inc()
+
+
+def record_funnel(extracted, unique, banality_passed, accepted):
+    for step, count in (('extracted', extracted), ('unique', unique),
+                        ('banality_passed', banality_passed), ('accepted', accepted)):
+        if count:
+            TRIPLETS.labels(step).inc(count)
+
+
+def http_request_started(endpoint):
+    """Начало HTTP-запроса; возвращает отметку времени для http_request_finished."""
+    HTTP_IN_FLIGHT.labels(endpoint).inc()
+    return time.perf_counter()
+
+
+def http_request_finished(endpoint, status, started):
+    HTTP_IN_FLIGHT.labels(endpoint).dec()
+    HTTP_SECONDS.labels(endpoint, str(status)).observe(time.perf_counter() - started)
+
+
+def render_metrics():
+    """Текст метрик в формате Prometheus и его Content-Type (по всем процессам в multiprocess-режиме)."""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
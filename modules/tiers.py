@@ -0,0 +1,76 @@
+"""
+Уровневая оценка связок (config.TIERED_ASSESSMENT): стадия сначала выполняется на дешевом
+уровне, а следующий, более сильный уровень вызывается, только если оценка попала в полосу
+±config.TIER_ESCALATION_BAND около порога - там, где ошибка дешевого уровня меняет решение.
+Последний уровень решает всегда. Какой уровень принял решение, записывается в подробности
+оценки и в метрику pipeline_tier_decisions_total.
+
+Уровень - имя модели или LOCAL (локальное сходство, metrics.local_similarity).
+"""
+
+import threading
+
+import dspy
+
+import config
+from modules import telemetry
+from modules.lm import create_lm
+
+LOCAL = 'local'
+
+_lms = {}
+_lms_lock = threading.Lock()
+
+
+def escalates(score, threshold, band=None):
+    """Попала ли оценка в полосу неуверенности около порога (нужен следующий уровень)."""
+    if band is None:
+        band = config.TIER_ESCALATION_BAND
+    return abs(score - threshold) < band
+
+
+def tier_lm(model):
+    """
+    LM уровня: уже настроенные banal_lm или основная LM, если модель совпадает, иначе - LM,
+    создаваемая один раз на процесс (с нулевой температурой, как banal_lm).
+    """
+    for lm in (dspy.settings.get('banal_lm'), dspy.settings.lm):
+        if lm is not None and lm.model == model:
+            return lm
+    with _lms_lock:
+        if model not in _lms:
+            _lms[model] = create_lm(model, max_tokens=config.MAIN_MODEL_MAX_TOKENS, temperature=0.0)
+        return _lms[model]
+
+
+def _decided(stage, tier, path, result):
+    telemetry.record_tier_decision(stage, tier)
+    return result, path
+
+
+def route(stage, tiers, assess, score_of, threshold, band=None):
+    """
+    Выполняет assess(уровень, результат предыдущего уровня или None) по уровням tiers, пока
+    оценка score_of(результат) не выйдет из полосы около threshold. Возвращает (результат
+    решившего уровня, путь [{'tier', 'score'}] по всем выполненным уровням).
+    """
+    path = []
+    result = None
+    for index, tier in enumerate(tiers):
+        result = assess(tier, result)
+        score = score_of(result)
+        path.append({'tier': tier, 'score': score})
+        if index == len(tiers) - 1 or score is None or not escalates(score, threshold, band):
+            return _decided(stage, tier, path, result)
+
+
+async def aroute(stage, tiers, aassess, score_of, threshold, band=None):
+    """Асинхронный вариант route: aassess - корутинная функция."""
+    path = []
+    result = None
+    for index, tier in enumerate(tiers):
+        result = await aassess(tier, result)
+        score = score_of(result)
+        path.append({'tier': tier, 'score': score})
+        if index == len(tiers) - 1 or score is None or not escalates(score, threshold, band):
+            return _decided(stage, tier, path, result)
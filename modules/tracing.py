@@ -0,0 +1,178 @@
+"""
+Трассировка отдельного запроса: дерево спанов (извлечение, стадии каждой связки, вызовы LLM)
+с временем, моделью и токенами. Экспорт - в формате OTLP/JSON (OpenTelemetry), который
+принимают otel-collector, Jaeger и Grafana Tempo.
+
+Текущий спан хранится в dspy.context, поэтому переходит в рабочие потоки parallel_map и в
+асинхронные задачи. Без активной трассировки span() сводится к одному чтению настроек DSPy.
+"""
+
+import contextlib
+import os
+import threading
+import time
+
+import dspy
+
+import config
+from modules.sqlite_cache import SQLiteCache
+
+SERVICE_NAME = 'dspy-text-processing-api'
+
+# Ключ настроек DSPy с текущим спаном (имя 'trace' занято самим DSPy)
+_SPAN_KEY = 'request_trace_span'
+
+# Коды статуса спана OpenTelemetry
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+# Контекст без трассировки: один объект на все вызовы span()
+_NO_SPAN = contextlib.nullcontext()
+
+_trace_store = None
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def _otlp_attributes(attributes):
+    return [{'key': key, 'value': _otlp_value(value)} for key, value in attributes.items()]
+
+
+class Span:
+    """Участок работы в трассировке; атрибуты со значением None не сохраняются."""
+
+    def __init__(self, trace, name, parent_id=None, attributes=None):
+        self.trace = trace
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.attributes = {}
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.error = None
+        self.set(**(attributes or {}))
+
+    def set(self, **attributes):
+        self.attributes.update((key, value) for key, value in attributes.items() if value is not None)
+
+    def end(self, error=None):
+        self.end_ns = time.time_ns()
+        if error is not None:
+            self.error = f'{type(error).__name__}: {error}'
+
+    def to_otlp(self):
+        span = {
+            'traceId': self.trace.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': 1,  # SPAN_KIND_INTERNAL
+            'startTimeUnixNano': str(self.start_ns),
+            # Незавершенный спан (например, отмененная задача) обрывается моментом экспорта
+            'endTimeUnixNano': str(self.end_ns or time.time_ns()),
+            'attributes': _otlp_attributes(self.attributes),
+            'status': {'code': STATUS_ERROR, 'message': self.error} if self.error else {'code': STATUS_OK},
+        }
+        if self.parent_id is not None:
+            span['parentSpanId'] = self.parent_id
+        return span
+
+
+class Trace:
+    """Спаны одного запроса; спаны добавляются из разных потоков."""
+
+    def __init__(self):
+        self.trace_id = os.urandom(16).hex()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def start_span(self, name, parent=None, **attributes):
+        span = Span(self, name, parent.span_id if parent is not None else None, attributes)
+        with self._lock:
+            self.spans.append(span)
+        return span
+
+    def to_otlp(self):
+        """Трассировка в формате OTLP/JSON (тело запроса POST /v1/traces коллектора)."""
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.start_ns)
+        return {
+            'resourceSpans': [{
+                'resource': {'attributes': _otlp_attributes({'service.name': SERVICE_NAME})},
+                'scopeSpans': [{
+                    'scope': {'name': __name__},
+                    'spans': [span.to_otlp() for span in spans],
+                }],
+            }]
+        }
+
+
+def current_span():
+    """Текущий спан или None, если запрос не трассируется."""
+    return dspy.settings.get(_SPAN_KEY)
+
+
+def annotate(**attributes):
+    """Добавляет атрибуты текущему спану (без трассировки ничего не делает)."""
+    span = current_span()
+    if span is not None:
+        span.set(**attributes)
+
+
+@contextlib.contextmanager
+def _activate(span):
+    error = None
+    try:
+        with dspy.context(**{_SPAN_KEY: span}):
+            yield
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        span.end(error)
+
+
+@contextlib.contextmanager
+def _child_span(parent, name, attributes):
+    child = parent.trace.start_span(name, parent, **attributes)
+    with _activate(child):
+        yield child
+
+
+def span(name, **attributes):
+    """Дочерний спан текущего спана на время блока; без трассировки блок получает None."""
+    parent = current_span()
+    if parent is None:
+        return _NO_SPAN
+    return _child_span(parent, name, attributes)
+
+
+@contextlib.contextmanager
+def start_trace(name, enabled=True, **attributes):
+    """Трассировка запроса с корневым спаном name; при enabled=False блок получает None."""
+    if not enabled:
+        yield None
+        return
+    trace = Trace()
+    with _activate(trace.start_span(name, **attributes)):
+        yield trace
+
+
+def get_trace_store():
+    """Общее для воркеров хранилище трассировок, сохраненных для скачивания."""
+    global _trace_store
+    if _trace_store is None:
+        _trace_store = SQLiteCache(
+            config.TRACE_STORE_PATH,
+            table='traces',
+            max_bytes=config.TRACE_STORE_MAX_MB * 1024 * 1024,
+            ttl_seconds=config.TRACE_TTL_SECONDS,
+        )
+    return _trace_store
@@ -0,0 +1,170 @@
+"""
+Валидационный прогон по набору текстов: тексты обрабатываются одновременно, результат
+каждого текста сразу дописывается строкой в файл JSONL. Этот же файл - контрольная точка:
+при перезапуске тексты с успешной записью пропускаются, тексты с ошибкой обрабатываются заново.
+"""
+
+import hashlib
+import json
+import os
+import statistics
+import threading
+import time
+
+import dspy
+from dspy.utils.usage_tracker import UsageTracker
+
+import config
+from modules.parallel import parallel_map
+from modules.process import NO_TRANSFORMATIONS_MESSAGE, assess_text, filter_assessments, funnel_counts, record_funnel
+
+FUNNEL_STEPS = ('extracted', 'unique', 'banality_passed', 'accepted')
+
+
+def text_id(text):
+    """Идентификатор текста в файле результатов (не зависит от порядка текстов в наборе)."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+
+
+def load_results(path):
+    """
+    Записи файла результатов. Оборванная последняя строка (прогон прервался во время
+    записи) пропускается.
+    """
+    records = []
+    if not os.path.exists(path):
+        return records
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    return records
+
+
+def _drop_partial_line(path):
+    """Обрезает оборванную последнюю строку, чтобы новые записи начинались с новой строки."""
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb+') as f:
+        data = f.read()
+        if data and not data.endswith(b'\n'):
+            f.truncate(data.rfind(b'\n') + 1)
+
+
+def _usage(tracker):
+    calls = sum(len(entries) for entries in tracker.usage_data.values())
+    tokens = {'prompt_tokens': 0, 'completion_tokens': 0}
+    for totals in tracker.get_total_tokens().values():
+        for key in tokens:
+            tokens[key] += totals.get(key) or 0
+    return calls, tokens
+
+
+def validate_text(extractor, index, text, banal_threshold=config.BANAL_THRESHOLD, reproducibility_threshold=0.7):
+    """Обрабатывает один текст и возвращает запись для файла результатов."""
+    tracker = UsageTracker()
+    started = time.perf_counter()
+    with dspy.context(usage_tracker=tracker):
+        report = assess_text(extractor, text, banal_threshold=banal_threshold)
+    seconds = time.perf_counter() - started
+
+    if report['unfiltered_triplets']:
+        final_triplets, failed_reasoning = filter_assessments(
+            report['assessments'], banal_threshold, reproducibility_threshold
+        )
+    else:
+        final_triplets, failed_reasoning = [], NO_TRANSFORMATIONS_MESSAGE
+    record_funnel(report, banal_threshold, len(final_triplets))
+    llm_calls, tokens = _usage(tracker)
+
+    return {
+        'text_id': text_id(text),
+        'index': index,
+        'success': True,
+        'text_chars': len(text),
+        'seconds': round(seconds, 3),
+        'llm_calls': llm_calls,
+        'tokens': tokens,
+        'funnel': funnel_counts(report, banal_threshold, len(final_triplets)),
+        'filtered_triplets': final_triplets,
+        'unfiltered_triplets': report['unfiltered_triplets'],
+        'failed_reasoning': failed_reasoning,
+        'assessments': report['assessments'],
+    }
+
+
+def run_validation(extractor, texts, output_path=config.VALIDATION_RESULTS_PATH, workers=config.VALIDATION_WORKERS,
+                   resume=True, on_result=None):
+    """
+    Обрабатывает тексты, не более workers одновременно, и дописывает результат каждого
+    текста в output_path по мере готовности. При resume=True тексты, уже успешно записанные
+    в output_path, пропускаются; при resume=False файл начинается заново.
+
+    on_result(record) вызывается после записи каждого результата (из рабочих потоков).
+    Возвращает все записи файла о текстах набора - последнюю запись каждого текста.
+    """
+    directory = os.path.dirname(output_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    if not resume and os.path.exists(output_path):
+        os.remove(output_path)
+    _drop_partial_line(output_path)
+
+    done = {record['text_id'] for record in load_results(output_path) if record.get('success')}
+    pending = [(index, text) for index, text in enumerate(texts) if text_id(text) not in done]
+    lock = threading.Lock()
+
+    def process(item):
+        index, text = item
+        try:
+            record = validate_text(extractor, index, text)
+        except Exception as e:
+            record = {'text_id': text_id(text), 'index': index, 'success': False, 'error': str(e)}
+        line = json.dumps(record, ensure_ascii=False, default=str) + '\n'
+        with lock:
+            with open(output_path, 'a', encoding='utf-8') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+        if on_result is not None:
+            on_result(record)
+
+    parallel_map(process, pending, max_workers=workers)
+
+    ids = {text_id(text) for text in texts}
+    latest = {}
+    for record in load_results(output_path):
+        if record['text_id'] in ids:
+            latest[record['text_id']] = record
+    return sorted(latest.values(), key=lambda record: record['index'])
+
+
+def _percentile(values, p):
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, round(p / 100 * len(ordered) + 0.5) - 1))]
+
+
+def summarize(records):
+    """Сводка прогона: воронка связок, время обработки текста, вызовы LLM и токены."""
+    succeeded = [record for record in records if record.get('success')]
+    summary = {
+        'texts': len(records),
+        'succeeded': len(succeeded),
+        'failed': len(records) - len(succeeded),
+        'funnel': {step: sum(record['funnel'][step] for record in succeeded) for step in FUNNEL_STEPS},
+        'llm_calls': sum(record['llm_calls'] for record in succeeded),
+        'prompt_tokens': sum(record['tokens']['prompt_tokens'] for record in succeeded),
+        'completion_tokens': sum(record['tokens']['completion_tokens'] for record in succeeded),
+    }
+    if succeeded:
+        seconds = [record['seconds'] for record in succeeded]
+        summary['seconds'] = {
+            'mean': round(statistics.fmean(seconds), 3),
+            'p50': _percentile(seconds, 50),
+            'p95': _percentile(seconds, 95),
+            'max': max(seconds),
+        }
+        summary['llm_calls_per_text'] = round(summary['llm_calls'] / len(succeeded), 2)
+    return summary
@@ -11,8 +11,15 @@ def main():
     # Получаем путь к корневой папке проекта
     project_root = os.path.dirname(os.path.abspath(__file__))
     server_path = os.path.join(project_root, 'server', 'app.py')
-    
-    print("🚀 Запуск Flask сервера...")
+
+    # --asgi: асинхронный сервер (uvicorn + server/asgi.py) вместо Flask
+    if '--asgi' in sys.argv[1:]:
+        command = [sys.executable, '-m', 'uvicorn', 'server.asgi:app', '--host', '0.0.0.0', '--port', '5000']
+        print("🚀 Запуск ASGI сервера...")
+    else:
+        command = [sys.executable, server_path]
+        print("🚀 Запуск Flask сервера...")
+
     print(f"📁 Корневая папка проекта: {project_root}")
     print(f"🌐 Сервер будет доступен по адресу: http://localhost:5000")
     print("📖 Документация: server/README_FLASK.md")
@@ -21,7 +28,7 @@ def main():
     
     try:
         # Запускаем сервер
-        subprocess.run([sys.executable, server_path], cwd=project_root)
+        subprocess.run(command, cwd=project_root)
     except KeyboardInterrupt:
         print("\n⏹️  Сервер остановлен пользователем")
     except Exception as e:
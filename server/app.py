@@ -1,19 +1,36 @@
-from flask import Flask, request, jsonify
-import dspy
-from dotenv import load_dotenv
 import os
+import queue
 import sys
 import logging
+import threading
 
 # Добавляем родительскую папку в путь Python для импортов
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+# Первым из модулей проекта: от его импорта отсчитывается время запуска
+from modules import startup
+
+from flask import Flask, Response, g, request, jsonify
+import dspy
+from dotenv import load_dotenv
+
 # Подавляем предупреждения DSPy о structured output format
 logging.getLogger("dspy").setLevel(logging.WARNING)
 
 import config
+from modules import telemetry, tracing
+from modules.deadline import start_deadline
 from modules.extract import TransformationExtractor
-from modules.process import process_text
+from modules.lm import create_lm, preload_client
+from modules.parallel import parallel_map, spawn
+from modules.process import ProcessingCancelled, assess_text
+from modules.result_cache import assess_text_cached, extractor_fingerprint
+from server.jobs import JobWorkerPool, create_job_store
+from server.payloads import (
+    BASE_ENDPOINTS, batch_response_body, error_body, health_body, index_body, liveness_body, parse_batch_request,
+    parse_process_request, process_response_body, readiness_body, stream_event, TRACE_HEADER, attach_trace,
+    parse_trace_header, DEADLINE_HEADER, parse_deadline_header
+)
 
 # Загрузка переменных окружения из .env файла
 load_dotenv()
@@ -23,23 +40,37 @@ OPTIMIZED_EXTRACTOR_PATH = "optimized_extractor.pkl"
 
 app = Flask(__name__)
 
+ENDPOINTS = dict(
+    BASE_ENDPOINTS,
+    **{
+        '/process/stream': 'POST - Обработка текста с потоковой выдачей результатов по стадиям (NDJSON или SSE)',
+        '/jobs': 'POST - Постановка обработки текста в очередь',
+        '/jobs/<job_id>': 'GET - Статус, промежуточный и итоговый результат задания'
+    }
+)
+
 # Глобальная переменная для хранения экстрактора
 extractor = None
 
+# Очередь асинхронных заданий и фоновые воркеры этого процесса
+job_store = create_job_store()
+job_workers = None
+
+# Прогрев выполняется один раз, одновременные первые запросы ждут его окончания
+_init_lock = threading.Lock()
+
+startup.mark('imports')
+
 def setup_dspy():
     """Configures the DSPy language models."""
-    main_lm = dspy.LM(
-        model=config.MAIN_MODEL,
-        api_key=config.OPENROUTER_API_KEY,
-        api_base='https://openrouter.ai/api/v1',
+    main_lm = create_lm(
+        config.MAIN_MODEL,
         max_tokens=config.MAIN_MODEL_MAX_TOKENS,
         temperature=config.MAIN_MODEL_TEMPERATURE
     )
     
-    banal_lm = dspy.LM(
-        model=config.BANAL_MODEL,
-        api_key=config.OPENROUTER_API_KEY,
-        api_base='https://openrouter.ai/api/v1',
+    banal_lm = create_lm(
+        config.BANAL_MODEL,
         max_tokens=500,
         temperature=0.0
     )
@@ -49,21 +80,92 @@ def setup_dspy():
 
 def load_extractor():
     """Loads the pre-optimized extractor."""
+    if not os.path.exists(OPTIMIZED_EXTRACTOR_PATH) and config.LM_BACKEND == 'synthetic':
+        # Нагрузочные прогоны на синтетической LM: демонстрации экстрактора не нужны
+        print("Оптимизированный экстрактор не найден, LM_BACKEND=synthetic - используется экстрактор без демонстраций.")
+        plain_extractor = TransformationExtractor()
+        plain_extractor.fingerprint = extractor_fingerprint()
+        return plain_extractor
     if not os.path.exists(OPTIMIZED_EXTRACTOR_PATH):
         raise FileNotFoundError(f"Оптимизированный экстрактор не найден по пути {OPTIMIZED_EXTRACTOR_PATH}")
     
     print("Загрузка оптимизированного экстрактора...")
     optimized_extractor = TransformationExtractor()
     optimized_extractor.load(OPTIMIZED_EXTRACTOR_PATH)
+    # Отпечаток для ключа кэша результатов: отчеты прежнего экстрактора не используются
+    optimized_extractor.fingerprint = extractor_fingerprint(OPTIMIZED_EXTRACTOR_PATH)
     print("Загрузка завершена.")
     return optimized_extractor
 
-def initialize():
-    """Инициализация экстрактора."""
+def warm_start():
+    """
+    Прогрев: настройка DSPy, импорт LiteLLM и загрузка экстрактора. При WARM_START=preload
+    вызывается в мастер-процессе gunicorn (gunicorn.conf.py), до запуска воркеров.
+    """
     global extractor
-    if extractor is None:
-        setup_dspy()
-        extractor = load_extractor()
+    with _init_lock:
+        if extractor is not None:
+            return
+        with startup.phase('setup_dspy'):
+            setup_dspy()
+        with startup.phase('import_lm_client'):
+            preload_client()
+        with startup.phase('load_extractor'):
+            loaded = load_extractor()
+        extractor = loaded
+        startup.mark('ready')
+    print(startup.format_report())
+
+def initialize():
+    """Инициализация экстрактора и запуск воркеров заданий (потоки - в каждом воркере отдельно)."""
+    global job_workers
+    warm_start()
+    with _init_lock:
+        if job_workers is None:
+            job_workers = JobWorkerPool(job_store, run_job, num_workers=config.JOB_WORKERS)
+            job_workers.start()
+
+def run_assessment(params, on_event=None, cancel_event=None, deadline=None):
+    """
+    Оценивает связки текста по параметрам запроса и возвращает тело ответа /process.
+    Срок - наиболее ранний из deadline (например, из заголовка запроса) и deadline_seconds
+    параметров (по умолчанию REQUEST_DEADLINE_SECONDS), отсчитываемого от начала оценки.
+    """
+    text = params['text']
+    banal_threshold = params['banal_threshold']
+    options = {'on_event': on_event, 'cancel_event': cancel_event}
+    deadline = start_deadline(params.get('deadline_seconds') or config.REQUEST_DEADLINE_SECONDS, parent=deadline)
+
+    # Оцениваем связки: из кэша результатов или полным прогоном, затем применяем пороги
+    if params['use_cache']:
+        with dspy.context(deadline=deadline):
+            report, cache_status = assess_text_cached(extractor, text, banal_threshold=banal_threshold, **options)
+    else:
+        with dspy.context(lm_cache_bypass=True, deadline=deadline):
+            report = assess_text(extractor, text, banal_threshold=banal_threshold, **options)
+        cache_status = 'bypassed'
+
+    return process_response_body(report, cache_status, banal_threshold, params['reproducibility_threshold'])
+
+def run_job(job_id, params, save_progress):
+    """Выполняет задание из очереди, сохраняя оценки связок по мере готовности."""
+    lock = threading.Lock()
+    progress = {'unfiltered_triplets': [], 'assessments': [], 'assessed_count': 0}
+
+    def on_event(event, payload):
+        with lock:
+            if event == 'extracted':
+                progress['unfiltered_triplets'] = payload['triplets']
+                progress['chunks'] = payload['chunks']
+                progress['triplet_chunks'] = payload['triplet_chunks']
+                progress['merged_duplicates'] = payload['merged_duplicates']
+                progress['assessments'] = [None] * len(payload['triplets'])
+            elif event == 'assessed':
+                progress['assessments'][payload['index']] = payload['assessment']
+                progress['assessed_count'] += 1
+            save_progress(progress)
+
+    return run_assessment(params, on_event=on_event)
 
 @app.route('/process', methods=['POST'])
 def process_endpoint():
@@ -74,119 +176,256 @@ def process_endpoint():
     - text: исходный текст для обработки
     - banal_threshold: порог фильтрации по банальности (опционально, по умолчанию из config)
     - reproducibility_threshold: порог фильтрации по воспроизводимости (опционально, по умолчанию 0.7)
+    - use_cache: использовать общий кэш ответов LM (опционально, по умолчанию true)
+    - deadline_seconds: срок обработки в секундах (опционально; также заголовок X-Deadline-Seconds)
     
     Возвращает JSON с полями:
     - filtered_triplets: массив связок, прошедших все фильтры
     - unfiltered_triplets: массив всех извлеченных связок
     - failed_reasoning: строка с рассуждениями для отфильтрованных связок
+    - assessments: оценки каждой извлеченной связки (банальность, обогащение, воспроизводимость)
+    - partial_triplets: связки, оценка которых упрощена или не завершена из-за срока
+    - cached: true, если результат взят из кэша без вызовов LLM
+    - cache_status: 'hit', 'coalesced', 'partial', 'miss', 'bypassed' или 'disabled'
     - success: булево значение успешности операции
     - message: сообщение об ошибке (если есть)
+
+    С заголовком X-Trace: inline ответ дополнительно содержит trace - дерево спанов запроса
+    в формате OTLP/JSON; с X-Trace: store - trace_url для скачивания трассировки.
     """
     try:
         # Инициализируем экстрактор при необходимости
         initialize()
 
-        # Получаем данные из запроса
-        data = request.get_json()
-        
-        if not data:
-            return jsonify({
-                'success': False,
-                'message': 'Не предоставлены данные JSON',
-                'filtered_triplets': [],
-                'unfiltered_triplets': [],
-                'failed_reasoning': ''
-            }), 400
-
-        # Извлекаем параметры
-        text = data.get('text')
-        if not text:
-            return jsonify({
-                'success': False,
-                'message': 'Поле "text" обязательно',
-                'filtered_triplets': [],
-                'unfiltered_triplets': [],
-                'failed_reasoning': ''
-            }), 400
-
-        banal_threshold = data.get('banal_threshold', config.BANAL_THRESHOLD)
-        reproducibility_threshold = data.get('reproducibility_threshold', 0.7)
-
-        # Валидация пороговых значений
+        # Получаем и проверяем данные из запроса
+        params, error = parse_process_request(request.get_json())
+        if not error:
+            trace_mode, error = parse_trace_header(request.headers.get(TRACE_HEADER))
+        if not error:
+            deadline_seconds, error = parse_deadline_header(request.headers.get(DEADLINE_HEADER))
+        if error:
+            return jsonify(error_body(error)), 400
+
+        with tracing.start_trace('POST /process', enabled=trace_mode is not None) as trace:
+            body = run_assessment(params, deadline=start_deadline(deadline_seconds))
+        return jsonify(attach_trace(body, trace, trace_mode))
+
+    except Exception as e:
+        return jsonify(error_body(f'Ошибка при обработке: {str(e)}')), 500
+
+@app.route('/process/batch', methods=['POST'])
+def process_batch_endpoint():
+    """
+    Пакетная обработка текстов.
+
+    Принимает JSON {"items": [{"text": ..., "banal_threshold": ..., "reproducibility_threshold": ...}, ...]}
+    и необязательные поля верхнего уровня (пороги, use_cache) - значения по умолчанию для элементов.
+    Тексты обрабатываются одновременно (BATCH_CONCURRENCY), запросы к LLM всех текстов проходят
+    через общий лимит процесса (LLM_MAX_CONCURRENCY).
+
+    Возвращает results - тела ответов /process в порядке items; ошибка одного элемента
+    (success: false) не прерывает обработку остальных. Срок из заголовка X-Deadline-Seconds -
+    общий для пакета, deadline_seconds элемента отсчитывается от начала его обработки.
+    """
+    try:
+        initialize()
+
+        parsed, error = parse_batch_request(request.get_json())
+        if not error:
+            trace_mode, error = parse_trace_header(request.headers.get(TRACE_HEADER))
+        if not error:
+            deadline_seconds, error = parse_deadline_header(request.headers.get(DEADLINE_HEADER))
+        if error:
+            return jsonify(error_body(error)), 400
+        deadline = start_deadline(deadline_seconds)
+
+        def process_item(item):
+            index, (params, item_error) = item
+            if item_error:
+                return error_body(item_error)
+            try:
+                with tracing.span('item', index=index):
+                    return run_assessment(params, deadline=deadline)
+            except Exception as e:
+                return error_body(f'Ошибка при обработке: {str(e)}')
+
+        with tracing.start_trace('POST /process/batch', enabled=trace_mode is not None) as trace:
+            results = parallel_map(process_item, list(enumerate(parsed)), max_workers=config.BATCH_CONCURRENCY)
+        return jsonify(attach_trace(batch_response_body(results), trace, trace_mode))
+
+    except Exception as e:
+        return jsonify(error_body(f'Ошибка при обработке: {str(e)}')), 500
+
+@app.route('/process/stream', methods=['POST'])
+def process_stream_endpoint():
+    """
+    Потоковая обработка текста. Поля запроса - как у /process.
+
+    Ответ - поток событий в формате NDJSON (по умолчанию) или Server-Sent Events
+    (если клиент передал Accept: text/event-stream):
+    - extracted: извлеченные связки, сразу после работы экстрактора
+    - stage: связка прошла или не прошла стадию (banality, reproducibility)
+    - assessed: полная оценка связки
+    - summary: итог в формате ответа /process
+    - error: ошибка обработки
+    Если клиент отключается, еще не начатые стадии не выполняются.
+    """
+    try:
+        initialize()
+
+        params, error = parse_process_request(request.get_json())
+        if not error:
+            deadline_seconds, error = parse_deadline_header(request.headers.get(DEADLINE_HEADER))
+        if error:
+            return jsonify(error_body(error)), 400
+        deadline = start_deadline(deadline_seconds)
+    except Exception as e:
+        return jsonify(error_body(f'Ошибка при обработке: {str(e)}')), 500
+
+    sse = 'text/event-stream' in request.headers.get('Accept', '')
+    events = queue.Queue()
+    cancel_event = threading.Event()
+
+    def on_event(event, payload):
+        if event == 'stage':
+            if payload['stage'] in ('prefilter', 'banality'):
+                passed = payload['score'] > params['banal_threshold']
+            else:
+                passed = payload['score'] >= params['reproducibility_threshold']
+            payload = dict(payload, passed=passed)
+        events.put((event, payload))
+
+    def worker():
+        try:
+            events.put(('summary', run_assessment(params, on_event=on_event, cancel_event=cancel_event, deadline=deadline)))
+        except ProcessingCancelled:
+            pass
+        except Exception as e:
+            events.put(('error', error_body(f'Ошибка при обработке: {str(e)}')))
+        finally:
+            events.put(None)
+
+    spawn(worker)
+
+    def generate():
+        extracted = False
         try:
-            banal_threshold = float(banal_threshold)
-            reproducibility_threshold = float(reproducibility_threshold)
-        except (ValueError, TypeError):
-            return jsonify({
-                'success': False,
-                'message': 'Пороговые значения должны быть числами',
-                'filtered_triplets': [],
-                'unfiltered_triplets': [],
-                'failed_reasoning': ''
-            }), 400
-
-        # Обрабатываем текст
-        final_triplets, unfiltered_triplets, failed_reasoning = process_text(
-            extractor, 
-            text, 
-            banal_threshold=banal_threshold, 
-            reproducibility_threshold=reproducibility_threshold
-        )
+            while True:
+                item = events.get()
+                if item is None:
+                    break
+                event, payload = item
+                if event == 'summary' and not extracted:
+                    # Результат из кэша: промежуточных событий не было
+                    yield stream_event('extracted', {
+                        'triplets': payload['unfiltered_triplets'],
+                        'chunks': payload['chunks'],
+                        'triplet_chunks': payload['triplet_chunks'],
+                        'merged_duplicates': payload['merged_duplicates']
+                    }, sse)
+                extracted = extracted or event == 'extracted'
+                yield stream_event(event, payload, sse)
+        finally:
+            # Клиент отключился или поток завершен: оставшиеся стадии не запускаем
+            cancel_event.set()
+
+    mimetype = 'text/event-stream' if sse else 'application/x-ndjson'
+    return Response(generate(), mimetype=mimetype, headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/jobs', methods=['POST'])
+def create_job_endpoint():
+    """
+    Ставит обработку текста в очередь и сразу возвращает идентификатор задания.
+    Поля запроса - как у /process. Статус и результат - GET /jobs/<job_id>.
+    """
+    try:
+        initialize()
+
+        params, error = parse_process_request(request.get_json())
+        if error:
+            return jsonify(error_body(error)), 400
 
+        job_id = job_store.create(params)
         return jsonify({
             'success': True,
-            'message': 'Обработка завершена успешно',
-            'filtered_triplets': final_triplets,
-            'unfiltered_triplets': unfiltered_triplets,
-            'failed_reasoning': failed_reasoning,
-            'processed_count': len(final_triplets),
-            'total_count': len(unfiltered_triplets)
-        })
+            'job_id': job_id,
+            'status': 'queued',
+            'status_url': f'/jobs/{job_id}'
+        }), 202
 
     except Exception as e:
-        return jsonify({
-            'success': False,
-            'message': f'Ошибка при обработке: {str(e)}',
-            'filtered_triplets': [],
-            'unfiltered_triplets': [],
-            'failed_reasoning': ''
-        }), 500
+        return jsonify(error_body(f'Ошибка при создании задания: {str(e)}')), 500
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job_endpoint(job_id):
+    """
+    Статус задания: 'queued', 'running', 'done' или 'failed'.
+    progress - извлеченные связки и оценки уже обработанных, result - тело ответа /process.
+    """
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': 'Задание не найдено или истекло'}), 404
+    return jsonify(dict(job, success=True))
+
+@app.before_request
+def start_request_metrics():
+    g.metrics_endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    g.metrics_started = telemetry.http_request_started(g.metrics_endpoint)
+
+@app.after_request
+def record_response_status(response):
+    g.metrics_status = response.status_code
+    return response
+
+@app.teardown_request
+def finish_request_metrics(exc):
+    if 'metrics_started' in g:
+        telemetry.http_request_finished(g.metrics_endpoint, g.get('metrics_status', 500), g.metrics_started)
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Метрики Prometheus (суммарно по всем воркерам gunicorn)."""
+    body, content_type = telemetry.render_metrics()
+    return Response(body, content_type=content_type)
+
+@app.route('/traces/<trace_id>', methods=['GET'])
+def get_trace_endpoint(trace_id):
+    """Трассировка, сохраненная запросом с X-Trace: store, в формате OTLP/JSON."""
+    trace = tracing.get_trace_store().get(trace_id)
+    if trace is None:
+        return jsonify({'success': False, 'message': 'Трассировка не найдена или истекла'}), 404
+    return jsonify(trace)
 
 @app.route('/health', methods=['GET'])
 def health_check():
     """Проверка состояния сервера."""
-    return jsonify({
-        'status': 'healthy',
-        'extractor_loaded': extractor is not None
-    })
+    return jsonify(health_body(extractor is not None))
+
+@app.route('/live', methods=['GET'])
+def liveness_check():
+    """Проверка живости: процесс отвечает (без обращения к экстрактору и кэшам)."""
+    return jsonify(liveness_body())
+
+@app.route('/ready', methods=['GET'])
+def readiness_check():
+    """
+    Проверка готовности: 200, когда экстрактор загружен, иначе 503. При WARM_START=lazy
+    проверка сама запускает прогрев, иначе процесс не получил бы ни одного запроса.
+    """
+    if extractor is None and config.WARM_START == 'lazy':
+        try:
+            initialize()
+        except Exception as e:
+            return jsonify(dict(readiness_body(False), message=f'Ошибка прогрева: {str(e)}')), 503
+    ready = extractor is not None
+    return jsonify(readiness_body(ready)), 200 if ready else 503
 
 @app.route('/', methods=['GET'])
 def index():
     """Главная страница с информацией об API."""
-    return jsonify({
-        'message': 'Flask сервер для обработки текста',
-        'endpoints': {
-            '/process': 'POST - Обработка текста с фильтрацией',
-            '/health': 'GET - Проверка состояния сервера'
-        },
-        'example_request': {
-            'url': '/process',
-            'method': 'POST',
-            'body': {
-                'text': 'Ваш текст для обработки...',
-                'banal_threshold': 0.6,
-                'reproducibility_threshold': 0.7
-            }
-        },
-        'example_response': {
-            'success': True,
-            'filtered_triplets': ['связки, прошедшие все фильтры'],
-            'unfiltered_triplets': ['все извлеченные связки'],
-            'failed_reasoning': 'детали отфильтрованных связок',
-            'processed_count': 2,
-            'total_count': 5
-        }
-    })
+    return jsonify(index_body('Flask сервер для обработки текста', ENDPOINTS))
 
 if __name__ == '__main__':
+    if config.WARM_START != 'lazy':
+        initialize()
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,221 @@
+"""
+Асинхронный (ASGI) сервер с тем же контрактом /process, /health и /, что и Flask-сервер.
+
+Вызовы LLM выполняются через асинхронный API DSPy, поэтому один процесс держит сотни
+одновременных запросов, ожидающих ответа OpenRouter, не занимая по потоку на запрос.
+
+Запуск:
+    uvicorn server.asgi:app --host 0.0.0.0 --port 5000 --workers 1
+"""
+
+import asyncio
+import contextlib
+import logging
+import os
+import sys
+
+# Добавляем родительскую папку в путь Python для импортов
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Первым из модулей проекта: от его импорта отсчитывается время запуска
+from modules import startup
+
+import dspy
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Match, Route
+
+# Подавляем предупреждения DSPy о structured output format
+logging.getLogger("dspy").setLevel(logging.WARNING)
+
+import config
+from modules import telemetry, tracing
+from modules.deadline import start_deadline
+from modules.lm import preload_client
+from modules.process import aassess_text
+from modules.result_cache import aassess_text_cached
+from server.app import load_extractor, setup_dspy
+from server.payloads import (
+    TRACE_HEADER, attach_trace, parse_trace_header, batch_response_body, error_body, health_body, index_body, parse_batch_request, parse_process_request,
+    process_response_body, liveness_body, readiness_body, DEADLINE_HEADER, parse_deadline_header
+)
+
+# Глобальная переменная для хранения экстрактора
+extractor = None
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    """Настраивает DSPy и загружает экстрактор при старте процесса, а не при первом запросе."""
+    global extractor
+    startup.mark('imports')
+    with startup.phase('setup_dspy'):
+        setup_dspy()
+    with startup.phase('import_lm_client'):
+        preload_client()
+    with startup.phase('load_extractor'):
+        extractor = load_extractor()
+    startup.mark('ready')
+    print(startup.format_report())
+    yield
+
+
+async def _read_json(request):
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+async def run_assessment(params, deadline=None):
+    """Оценивает связки текста по параметрам запроса и возвращает тело ответа /process (срок - как во Flask-версии)."""
+    text = params['text']
+    banal_threshold = params['banal_threshold']
+    deadline = start_deadline(params.get('deadline_seconds') or config.REQUEST_DEADLINE_SECONDS, parent=deadline)
+
+    if params['use_cache']:
+        with dspy.context(deadline=deadline):
+            report, cache_status = await aassess_text_cached(extractor, text, banal_threshold=banal_threshold)
+    else:
+        with dspy.context(lm_cache_bypass=True, deadline=deadline):
+            report = await aassess_text(extractor, text, banal_threshold=banal_threshold)
+        cache_status = 'bypassed'
+
+    return process_response_body(report, cache_status, banal_threshold, params['reproducibility_threshold'])
+
+
+async def process_endpoint(request):
+    """Эндпоинт для обработки текста. Поля запроса и ответа - как у Flask-версии."""
+    try:
+        params, error = parse_process_request(await _read_json(request))
+        if not error:
+            trace_mode, error = parse_trace_header(request.headers.get(TRACE_HEADER))
+        if not error:
+            deadline_seconds, error = parse_deadline_header(request.headers.get(DEADLINE_HEADER))
+        if error:
+            return JSONResponse(error_body(error), status_code=400)
+
+        with tracing.start_trace('POST /process', enabled=trace_mode is not None) as trace:
+            body = await run_assessment(params, deadline=start_deadline(deadline_seconds))
+        return JSONResponse(attach_trace(body, trace, trace_mode))
+
+    except Exception as e:
+        return JSONResponse(error_body(f'Ошибка при обработке: {str(e)}'), status_code=500)
+
+
+async def process_batch_endpoint(request):
+    """Пакетная обработка текстов. Поля запроса и ответа - как у Flask-версии."""
+    try:
+        parsed, error = parse_batch_request(await _read_json(request))
+        if not error:
+            trace_mode, error = parse_trace_header(request.headers.get(TRACE_HEADER))
+        if not error:
+            deadline_seconds, error = parse_deadline_header(request.headers.get(DEADLINE_HEADER))
+        if error:
+            return JSONResponse(error_body(error), status_code=400)
+        deadline = start_deadline(deadline_seconds)
+
+        semaphore = asyncio.Semaphore(max(1, config.BATCH_CONCURRENCY))
+
+        async def process_item(index, params, item_error):
+            if item_error:
+                return error_body(item_error)
+            try:
+                async with semaphore:
+                    with tracing.span('item', index=index):
+                        return await run_assessment(params, deadline=deadline)
+            except Exception as e:
+                return error_body(f'Ошибка при обработке: {str(e)}')
+
+        with tracing.start_trace('POST /process/batch', enabled=trace_mode is not None) as trace:
+            results = await asyncio.gather(*[
+                process_item(index, params, item_error) for index, (params, item_error) in enumerate(parsed)
+            ])
+        return JSONResponse(attach_trace(batch_response_body(list(results)), trace, trace_mode))
+
+    except Exception as e:
+        return JSONResponse(error_body(f'Ошибка при обработке: {str(e)}'), status_code=500)
+
+
+async def metrics_endpoint(request):
+    """Метрики Prometheus."""
+    body, content_type = telemetry.render_metrics()
+    return Response(body, media_type=content_type)
+
+
+async def get_trace_endpoint(request):
+    """Трассировка, сохраненная запросом с X-Trace: store, в формате OTLP/JSON."""
+    trace = tracing.get_trace_store().get(request.path_params['trace_id'])
+    if trace is None:
+        return JSONResponse({'success': False, 'message': 'Трассировка не найдена или истекла'}, status_code=404)
+    return JSONResponse(trace)
+
+
+async def health_check(request):
+    """Проверка состояния сервера."""
+    return JSONResponse(health_body(extractor is not None))
+
+
+async def liveness_check(request):
+    """Проверка живости: процесс отвечает."""
+    return JSONResponse(liveness_body())
+
+
+async def readiness_check(request):
+    """Проверка готовности: 200, когда экстрактор загружен, иначе 503."""
+    ready = extractor is not None
+    return JSONResponse(readiness_body(ready), status_code=200 if ready else 503)
+
+
+async def index(request):
+    """Главная страница с информацией об API."""
+    return JSONResponse(index_body('ASGI сервер для обработки текста'))
+
+
+class RequestMetricsMiddleware:
+    """Учитывает HTTP-запросы в метриках: запросы в обработке и время по эндпоинту и статусу."""
+
+    def __init__(self, app, routes):
+        self.app = app
+        self.routes = routes
+
+    def _endpoint(self, scope):
+        """Шаблон пути маршрута (например, /traces/{trace_id}), чтобы не плодить метки по каждому URL."""
+        for route in self.routes:
+            if route.matches(scope)[0] != Match.NONE:
+                return route.path
+        return 'unmatched'
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        endpoint = self._endpoint(scope)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        started = telemetry.http_request_started(endpoint)
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            telemetry.http_request_finished(endpoint, status, started)
+
+
+routes = [
+    Route('/process', process_endpoint, methods=['POST']),
+    Route('/process/batch', process_batch_endpoint, methods=['POST']),
+    Route('/metrics', metrics_endpoint, methods=['GET']),
+    Route('/traces/{trace_id}', get_trace_endpoint, methods=['GET']),
+    Route('/health', health_check, methods=['GET']),
+    Route('/live', liveness_check, methods=['GET']),
+    Route('/ready', readiness_check, methods=['GET']),
+    Route('/', index, methods=['GET']),
+]
+
+app = RequestMetricsMiddleware(Starlette(routes=routes, lifespan=lifespan), routes)
@@ -0,0 +1,285 @@
+"""
+Асинхронные задания обработки: очередь заданий, хранилище статусов и пул фоновых воркеров.
+
+Клиент ставит задание через POST /jobs и сразу получает его идентификатор, а результат
+(в том числе промежуточный) забирает через GET /jobs/<id>. Хранилище подключаемое
+(см. JOB_STORES); SQLite-хранилище позволяет нескольким процессам и контейнерам с общим
+томом разбирать одну очередь.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Статусы задания
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class JobStore:
+    """
+    Интерфейс хранилища заданий. claim() выдает задание вместе с токеном аренды; изменения
+    задания (прогресс, продление аренды, результат) применяются, только пока токен актуален,
+    то есть задание не перехватил другой воркер.
+    """
+
+    # Срок аренды: задание, аренду которого не продлевали дольше, снова выдается claim()
+    lease_seconds = None
+
+    def create(self, params):
+        """Ставит задание в очередь и возвращает его идентификатор."""
+        raise NotImplementedError
+
+    def claim(self):
+        """
+        Забирает следующее задание из очереди (статус 'running') и возвращает
+        {'id', 'params', 'token'} или None.
+        """
+        raise NotImplementedError
+
+    def renew(self, job_id, token):
+        """Продлевает аренду задания; False - аренду перехватил другой воркер."""
+        raise NotImplementedError
+
+    def update_progress(self, job_id, token, progress):
+        """Сохраняет промежуточный результат задания."""
+        raise NotImplementedError
+
+    def complete(self, job_id, token, result):
+        raise NotImplementedError
+
+    def fail(self, job_id, token, error):
+        raise NotImplementedError
+
+    def get(self, job_id):
+        """Задание в виде словаря или None, если его нет (или оно истекло)."""
+        raise NotImplementedError
+
+
+class SQLiteJobStore(JobStore):
+    """
+    Хранилище заданий в файле SQLite.
+
+    - Задание, воркер которого не продлевал аренду дольше lease_seconds (процесс упал),
+      снова становится доступным для claim(); записи прежнего воркера по нему не применяются.
+    - Завершенные задания удаляются через ttl_seconds после завершения.
+    """
+
+    def __init__(self, path, ttl_seconds, lease_seconds):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.lease_seconds = lease_seconds
+        self._local = threading.local()
+
+    def _connection(self):
+        """Соединение для текущего потока; после fork открывается заново."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            'id TEXT PRIMARY KEY, status TEXT NOT NULL, params TEXT NOT NULL, '
+            'progress TEXT, result TEXT, error TEXT, '
+            'created_at REAL NOT NULL, updated_at REAL NOT NULL, finished_at REAL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)')
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(jobs)')}
+        if 'claim_token' not in columns:
+            # База, созданная до появления токенов аренды
+            try:
+                conn.execute('ALTER TABLE jobs ADD COLUMN claim_token TEXT')
+            except sqlite3.OperationalError:
+                pass  # Столбец уже добавил другой процесс
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def _purge_expired(self, conn, now):
+        conn.execute('DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?', (now - self.ttl_seconds,))
+
+    def create(self, params):
+        conn = self._connection()
+        now = time.time()
+        self._purge_expired(conn, now)
+        job_id = uuid.uuid4().hex
+        conn.execute(
+            'INSERT INTO jobs (id, status, params, created_at, updated_at) VALUES (?, ?, ?, ?, ?)',
+            (job_id, QUEUED, json.dumps(params, ensure_ascii=False), now, now)
+        )
+        return job_id
+
+    def claim(self):
+        conn = self._connection()
+        now = time.time()
+        # BEGIN IMMEDIATE: только один процесс может забрать конкретное задание
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                'SELECT id, params FROM jobs WHERE status = ? OR (status = ? AND updated_at < ?) '
+                'ORDER BY created_at LIMIT 1',
+                (QUEUED, RUNNING, now - self.lease_seconds)
+            ).fetchone()
+            token = uuid.uuid4().hex
+            if row is not None:
+                conn.execute(
+                    'UPDATE jobs SET status = ?, updated_at = ?, claim_token = ? WHERE id = ?',
+                    (RUNNING, now, token, row[0])
+                )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        if row is None:
+            return None
+        return {'id': row[0], 'params': json.loads(row[1]), 'token': token}
+
+    def _update_claimed(self, job_id, token, assignments, values):
+        """UPDATE задания, если его аренда все еще у токена token; True - строка обновлена."""
+        cursor = self._connection().execute(
+            f'UPDATE jobs SET {assignments} WHERE id = ? AND status = ? AND claim_token = ?',
+            (*values, job_id, RUNNING, token)
+        )
+        return cursor.rowcount == 1
+
+    def renew(self, job_id, token):
+        return self._update_claimed(job_id, token, 'updated_at = ?', (time.time(),))
+
+    def update_progress(self, job_id, token, progress):
+        self._update_claimed(
+            job_id, token, 'progress = ?, updated_at = ?', (json.dumps(progress, ensure_ascii=False), time.time())
+        )
+
+    def complete(self, job_id, token, result):
+        now = time.time()
+        self._update_claimed(
+            job_id, token, 'status = ?, result = ?, updated_at = ?, finished_at = ?',
+            (DONE, json.dumps(result, ensure_ascii=False), now, now)
+        )
+
+    def fail(self, job_id, token, error):
+        now = time.time()
+        self._update_claimed(
+            job_id, token, 'status = ?, error = ?, updated_at = ?, finished_at = ?', (FAILED, error, now, now)
+        )
+
+    def get(self, job_id):
+        conn = self._connection()
+        self._purge_expired(conn, time.time())
+        row = conn.execute(
+            'SELECT id, status, progress, result, error, created_at, updated_at, finished_at FROM jobs WHERE id = ?',
+            (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {
+            'job_id': row[0],
+            'status': row[1],
+            'progress': json.loads(row[2]) if row[2] else None,
+            'result': json.loads(row[3]) if row[3] else None,
+            'error': row[4],
+            'created_at': row[5],
+            'updated_at': row[6],
+            'finished_at': row[7],
+        }
+
+
+# Доступные хранилища заданий (config.JOB_STORE_BACKEND)
+JOB_STORES = {
+    'sqlite': lambda: SQLiteJobStore(
+        config.JOB_STORE_PATH,
+        ttl_seconds=config.JOB_TTL_SECONDS,
+        lease_seconds=config.JOB_LEASE_SECONDS,
+    ),
+}
+
+
+def create_job_store(backend=None):
+    backend = backend or config.JOB_STORE_BACKEND
+    if backend not in JOB_STORES:
+        raise ValueError(f"Неизвестное хранилище заданий: {backend}. Доступные: {', '.join(JOB_STORES)}")
+    return JOB_STORES[backend]()
+
+
+class JobWorkerPool:
+    """
+    Пул фоновых потоков, которые разбирают очередь заданий и выполняют
+    handler(job_id, params, save_progress), где save_progress(progress) сохраняет промежуточный
+    результат. handler возвращает итоговый результат задания; исключение переводит задание в
+    статус 'failed'. Пока handler работает, аренда задания продлевается раз в heartbeat_seconds
+    (по умолчанию треть store.lease_seconds), чтобы долгое задание не забрал другой воркер.
+    """
+
+    def __init__(self, store, handler, num_workers, poll_interval=0.5, heartbeat_seconds=None):
+        self.store = store
+        self.handler = handler
+        self.num_workers = num_workers
+        self.poll_interval = poll_interval
+        self.heartbeat_seconds = heartbeat_seconds or store.lease_seconds / 3
+        self._threads = []
+        self._stop = threading.Event()
+
+    def start(self):
+        if self._threads:
+            return
+        for i in range(self.num_workers):
+            thread = threading.Thread(target=self._run, name=f'job-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                job = self.store.claim()
+            except sqlite3.Error as e:
+                logger.warning('Не удалось получить задание из очереди: %s', e)
+                job = None
+
+            if job is None:
+                self._stop.wait(self.poll_interval)
+                continue
+
+            finished = threading.Event()
+            heartbeat = threading.Thread(
+                target=self._heartbeat, args=(job, finished), name=f'{threading.current_thread().name}-heartbeat',
+                daemon=True
+            )
+            heartbeat.start()
+            save_progress = lambda progress: self.store.update_progress(job['id'], job['token'], progress)
+            try:
+                result = self.handler(job['id'], job['params'], save_progress)
+                self.store.complete(job['id'], job['token'], result)
+            except Exception as e:
+                logger.exception('Задание %s завершилось ошибкой', job['id'])
+                self.store.fail(job['id'], job['token'], str(e))
+            finally:
+                finished.set()
+                heartbeat.join()
+
+    def _heartbeat(self, job, finished):
+        """Продлевает аренду задания, пока оно выполняется."""
+        while not finished.wait(self.heartbeat_seconds):
+            try:
+                if not self.store.renew(job['id'], job['token']):
+                    logger.warning('Аренду задания %s перехватил другой воркер', job['id'])
+                    return
+            except sqlite3.Error as e:
+                logger.warning('Не удалось продлить аренду задания %s: %s', job['id'], e)
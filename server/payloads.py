@@ -0,0 +1,258 @@
+"""
+Разбор запросов и тела ответов API, общие для Flask (server/app.py) и ASGI (server/asgi.py) серверов.
+"""
+
+import json
+
+import config
+from modules import startup
+from modules.cascade import get_cascade_stats
+from modules.limiter import model_limiters_snapshot
+from modules.lm import get_response_cache
+from modules.process import NO_TRANSFORMATIONS_MESSAGE, filter_assessments, partial_triplets, record_funnel
+from modules.result_cache import get_result_cache
+from modules.tracing import get_trace_store
+
+# Заголовок запроса, включающий трассировку: inline - трассировка в теле ответа,
+# store - сохраняется для скачивания через GET /traces/<trace_id>
+TRACE_HEADER = 'X-Trace'
+TRACE_MODES = ('inline', 'store')
+
+# Заголовок запроса со сроком обработки в секундах (как поле deadline_seconds)
+DEADLINE_HEADER = 'X-Deadline-Seconds'
+
+
+def error_body(message):
+    """Тело ответа с ошибкой в формате /process."""
+    return {
+        'success': False,
+        'message': message,
+        'filtered_triplets': [],
+        'unfiltered_triplets': [],
+        'failed_reasoning': ''
+    }
+
+
+def parse_process_request(data):
+    """
+    Проверяет JSON запроса /process.
+    Возвращает (параметры, None) или (None, сообщение об ошибке).
+    """
+    if not data:
+        return None, 'Не предоставлены данные JSON'
+
+    # Извлекаем параметры
+    text = data.get('text')
+    if not text:
+        return None, 'Поле "text" обязательно'
+
+    banal_threshold = data.get('banal_threshold', config.BANAL_THRESHOLD)
+    reproducibility_threshold = data.get('reproducibility_threshold', 0.7)
+
+    # Валидация пороговых значений
+    try:
+        banal_threshold = float(banal_threshold)
+        reproducibility_threshold = float(reproducibility_threshold)
+    except (ValueError, TypeError):
+        return None, 'Пороговые значения должны быть числами'
+
+    use_cache = data.get('use_cache', True)
+    if not isinstance(use_cache, bool):
+        return None, 'Поле "use_cache" должно быть булевым значением'
+
+    deadline_seconds, error = _parse_deadline(data.get('deadline_seconds'), 'Поле "deadline_seconds"')
+    if error:
+        return None, error
+
+    return {
+        'text': text,
+        'banal_threshold': banal_threshold,
+        'reproducibility_threshold': reproducibility_threshold,
+        'use_cache': use_cache,
+        'deadline_seconds': deadline_seconds
+    }, None
+
+
+def _parse_deadline(value, name):
+    """Срок обработки в секундах: (число или None, None) или (None, сообщение об ошибке)."""
+    if value is None:
+        return None, None
+    try:
+        seconds = float(value)
+    except (ValueError, TypeError):
+        seconds = None
+    if isinstance(value, bool) or seconds is None or not seconds > 0:
+        return None, f'{name} должно быть положительным числом секунд'
+    return seconds, None
+
+
+def parse_deadline_header(value):
+    """Срок обработки из заголовка X-Deadline-Seconds: (секунды или None, None) или (None, сообщение об ошибке)."""
+    if not value:
+        return None, None
+    return _parse_deadline(value.strip(), f'Значение заголовка {DEADLINE_HEADER}')
+
+
+def parse_trace_header(value):
+    """Режим трассировки из заголовка X-Trace: (режим или None, None) или (None, сообщение об ошибке)."""
+    if not value:
+        return None, None
+    mode = value.strip().lower()
+    if mode not in TRACE_MODES:
+        return None, f'Заголовок {TRACE_HEADER} должен быть одним из: {", ".join(TRACE_MODES)}'
+    return mode, None
+
+
+def attach_trace(body, trace, mode):
+    """Добавляет к телу ответа трассировку (inline) или ссылку на сохраненную трассировку (store)."""
+    if trace is None:
+        return body
+    otlp = trace.to_otlp()
+    if mode == 'store':
+        get_trace_store().set(trace.trace_id, otlp)
+        return dict(body, trace_id=trace.trace_id, trace_url=f'/traces/{trace.trace_id}')
+    return dict(body, trace_id=trace.trace_id, trace=otlp)
+
+
+def parse_batch_request(data):
+    """
+    Проверяет JSON запроса /process/batch: {"items": [{"text": ..., ...}, ...]}.
+    Поля верхнего уровня (пороги, use_cache) - значения по умолчанию для элементов.
+
+    Возвращает (список (параметры, ошибка) для каждого элемента, None) или
+    (None, сообщение об ошибке всего запроса).
+    """
+    if not data:
+        return None, 'Не предоставлены данные JSON'
+
+    items = data.get('items')
+    if not isinstance(items, list) or not items:
+        return None, 'Поле "items" должно быть непустым массивом'
+    if len(items) > config.BATCH_MAX_ITEMS:
+        return None, f'Слишком много элементов в пакете: {len(items)} (максимум {config.BATCH_MAX_ITEMS})'
+
+    defaults = {k: v for k, v in data.items() if k != 'items'}
+    parsed = []
+    for item in items:
+        if not isinstance(item, dict):
+            parsed.append((None, 'Элемент пакета должен быть объектом'))
+            continue
+        parsed.append(parse_process_request(dict(defaults, **item)))
+    return parsed, None
+
+
+def process_response_body(report, cache_status, banal_threshold, reproducibility_threshold):
+    """Тело успешного ответа /process: применяет пороги к отчету assess_text."""
+    unfiltered_triplets = report['unfiltered_triplets']
+    if unfiltered_triplets:
+        final_triplets, failed_reasoning = filter_assessments(
+            report['assessments'],
+            banal_threshold=banal_threshold,
+            reproducibility_threshold=reproducibility_threshold
+        )
+    else:
+        final_triplets, failed_reasoning = [], NO_TRANSFORMATIONS_MESSAGE
+    record_funnel(report, banal_threshold, len(final_triplets))
+
+    return {
+        'success': True,
+        'message': 'Обработка завершена успешно',
+        'filtered_triplets': final_triplets,
+        'unfiltered_triplets': unfiltered_triplets,
+        'failed_reasoning': failed_reasoning,
+        'processed_count': len(final_triplets),
+        'total_count': len(unfiltered_triplets),
+        'assessments': report['assessments'],
+        'chunks': report['chunks'],
+        'triplet_chunks': report['triplet_chunks'],
+        'merged_duplicates': report['merged_duplicates'],
+        'partial_triplets': partial_triplets(report),
+        'cached': cache_status in ('hit', 'coalesced'),
+        'cache_status': cache_status
+    }
+
+
+def batch_response_body(results):
+    """Тело ответа /process/batch: результаты элементов в порядке запроса."""
+    succeeded = sum(1 for r in results if r['success'])
+    return {
+        'success': True,
+        'message': 'Пакет обработан',
+        'results': results,
+        'total_count': len(results),
+        'succeeded_count': succeeded,
+        'failed_count': len(results) - succeeded
+    }
+
+
+def health_body(extractor_loaded):
+    """Тело ответа /health."""
+    response_cache = get_response_cache()
+    result_cache = get_result_cache()
+    return {
+        'status': 'healthy',
+        'extractor_loaded': extractor_loaded,
+        'lm_cache': response_cache.stats() if response_cache is not None else None,
+        'result_cache': result_cache.store.stats() if result_cache is not None else None,
+        'cascade': get_cascade_stats().snapshot(),
+        'llm_limiters': model_limiters_snapshot(),
+    }
+
+
+def liveness_body():
+    """Тело ответа /live."""
+    return {'status': 'alive'}
+
+
+def readiness_body(ready):
+    """Тело ответа /ready (код 200 - готов, 503 - идет прогрев) с отчетом о запуске."""
+    return {'status': 'ready' if ready else 'starting', 'startup': startup.report()}
+
+
+# Эндпоинты, общие для Flask и ASGI серверов
+BASE_ENDPOINTS = {
+    '/process': 'POST - Обработка текста с фильтрацией',
+    '/process/batch': 'POST - Пакетная обработка нескольких текстов',
+    '/health': 'GET - Проверка состояния сервера',
+    '/live': 'GET - Проверка живости процесса',
+    '/ready': 'GET - Проверка готовности (503, пока идет прогрев)',
+    '/metrics': 'GET - Метрики Prometheus',
+    '/traces/<trace_id>': 'GET - Сохраненная трассировка запроса (OTLP/JSON)'
+}
+
+
+def index_body(message, endpoints=BASE_ENDPOINTS):
+    """Тело ответа / с описанием API."""
+    return {
+        'message': message,
+        'endpoints': endpoints,
+        'example_request': {
+            'url': '/process',
+            'method': 'POST',
+            'body': {
+                'text': 'Ваш текст для обработки...',
+                'banal_threshold': 0.6,
+                'reproducibility_threshold': 0.7,
+                'use_cache': True
+            }
+        },
+        'example_response': {
+            'success': True,
+            'filtered_triplets': ['связки, прошедшие все фильтры'],
+            'unfiltered_triplets': ['все извлеченные связки'],
+            'failed_reasoning': 'детали отфильтрованных связок',
+            'processed_count': 2,
+            'total_count': 5,
+            'assessments': ['оценки каждой связки'],
+            'cached': False,
+            'cache_status': 'miss'
+        }
+    }
+
+
+def stream_event(event, payload, sse=False):
+    """Одно событие потоковой выдачи: строка NDJSON или сообщение Server-Sent Events."""
+    data = json.dumps(dict(payload, event=event), ensure_ascii=False)
+    if sse:
+        return f"event: {event}\ndata: {data}\n\n"
+    return data + "\n"